@@ -1,15 +1,46 @@
-import streamlit as st
-import replicate
-import requests
-import tempfile
-import os
-from datetime import datetime
-from PIL import Image
+import csv
 import io
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+
+import streamlit as st
+from streamlit import runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 
-# Initialize clients and API keys
-client = replicate.Client(api_token=st.secrets["REPLICATE_API_TOKEN"])
-imgbb_key = st.secrets["IMGBB_API_KEY"]
+from batch import Batch, read_manifest
+from imaging import make_thumbnail
+from jobs import CANCELED, FAILED, FETCHING, PREDICTING, PREPARING, QUEUED, SUCCEEDED, JobManager, SessionJobs
+import metrics
+from media import MediaCache, SessionRegistry
+from models import FAST, QUALITY
+from pipeline import Pipeline, PipelineConfig
+
+# Seconds between reruns while a job is in progress
+JOB_POLL_INTERVAL = 2
+# Share of the progress bar covered by each job status
+JOB_PROGRESS = {QUEUED: (0, 5), PREPARING: (5, 15), PREDICTING: (15, 90), FETCHING: (90, 100)}
+JOB_STAGE_TEXT = {
+    QUEUED: "Waiting in queue",
+    PREPARING: "Uploading image",
+    PREDICTING: "Generating video",
+    FETCHING: "Downloading video",
+}
+# Seconds between background checks for sessions that went away
+SESSION_REAP_INTERVAL = 15
+# Limit and layout of the variants grid
+MAX_VARIANTS = 12
+VARIANT_COLUMNS = 3
+# Rendering choices: the full render only, preview first (full render on
+# approval), or preview and full render together. The preview modes are only
+# offered when a model has a cheaper preview setting
+FINAL_ONLY = "✨ Full quality only"
+PREVIEW_FIRST = "👀 Quick preview first"
+PREVIEW_AND_FINAL = "⚡ Preview, full render in the background"
+RENDER_MODES = [FINAL_ONLY, PREVIEW_FIRST, PREVIEW_AND_FINAL]
 
 # Configure Streamlit page
 st.set_page_config(
@@ -386,8 +417,30 @@ if 'video_generated' not in st.session_state:
     st.session_state.video_generated = False
 if 'video_path' not in st.session_state:
     st.session_state.video_path = None
+if 'video_filename' not in st.session_state:
+    st.session_state.video_filename = None
+if 'artifact_id' not in st.session_state:
+    st.session_state.artifact_id = None
+# Small JPEG preview of the uploaded image, made once at submit time
+if 'thumbnail' not in st.session_state:
+    st.session_state.thumbnail = None
 if 'processing' not in st.session_state:
     st.session_state.processing = False
+# Whether the video shown is a preview clip, and the full render queued next to it
+if 'preview' not in st.session_state:
+    st.session_state.preview = False
+if 'final_job_id' not in st.session_state:
+    st.session_state.final_job_id = st.query_params.get('final')
+# Jobs of the current prompt variants, restored from the URL after a refresh
+if 'variant_jobs' not in st.session_state:
+    st.session_state.variant_jobs = [job_id for job_id in st.query_params.get('variants', '').split(',') if job_id]
+# Reattach to a running batch after a browser refresh
+if 'batch_id' not in st.session_state:
+    st.session_state.batch_id = st.query_params.get('batch')
+# Reattach to a queued or running job after a browser refresh
+if 'job_id' not in st.session_state and 'job' in st.query_params:
+    st.session_state.job_id = st.query_params['job']
+    st.session_state.processing = True
 
 # Configuration in sidebar
 with st.sidebar:
@@ -404,320 +457,542 @@ with st.sidebar:
     5. Download your video!
     """)
 
-def upload_to_imgbb(image_file):
-    """Upload image to ImgBB and return the URL"""
-    try:
-        # Check if API key is available
-        if not imgbb_key or imgbb_key == "":
-            st.error("ImgBB API key not found. Please check your Streamlit secrets.")
-            return None
-            
-        # Convert image to PIL Image and then to bytes
-        image = Image.open(image_file)
-        
-        # Convert to RGB if necessary (ImgBB prefers standard formats)
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        # Save to bytes buffer
-        img_buffer = io.BytesIO()
-        image.save(img_buffer, format='JPEG', quality=95)
-        image_bytes = img_buffer.getvalue()
-        
-        # Encode image to base64
-        import base64
-        image_base64 = base64.b64encode(image_bytes).decode('utf-8')
-        
-        # ImgBB API endpoint
-        url = "https://api.imgbb.com/1/upload"
-        
-        # Prepare the data for upload - using form data as recommended by API docs
-        data = {
-            'key': imgbb_key,
-            'image': image_base64,
-            'name': 'uploaded_image'
-        }
-        
-        # Debug: Show some info about the image
-        st.info(f"Image size: {len(image_bytes)} bytes")
-        st.info(f"Base64 length: {len(image_base64)} characters")
-        st.info(f"Image format: JPEG")
-        
-        # Upload to ImgBB
-        response = requests.post(url, data=data, timeout=30)
-        
-        # Debug information
-        st.info(f"Response status: {response.status_code}")
-        
-        if response.status_code == 200:
-            result = response.json()
-            if result.get('success'):
-                # Use the direct URL as recommended by API docs
-                image_url = result['data']['url']
-                st.info(f"Image uploaded successfully! Direct URL: {image_url}")
-                
-                # Also show the display URL for reference
-                display_url = result['data'].get('display_url', image_url)
-                st.info(f"Display URL: {display_url}")
-                
-                # Test if the URL is publicly accessible
-                try:
-                    test_response = requests.head(image_url, timeout=10)
-                    if test_response.status_code == 200:
-                        st.success("✅ Image URL is publicly accessible")
-                        return image_url
-                    else:
-                        st.warning(f"⚠️ Image URL returned status: {test_response.status_code}")
-                        # Try display URL as fallback
-                        test_response_display = requests.head(display_url, timeout=10)
-                        if test_response_display.status_code == 200:
-                            st.success("✅ Display URL is accessible, using as fallback")
-                            return display_url
-                        return image_url  # Still return original URL, might work for Replicate
-                except Exception as test_error:
-                    st.warning(f"⚠️ Could not test image URL accessibility: {test_error}")
-                    return image_url  # Still return it, might work for Replicate
-            else:
-                error_msg = result.get('error', {}).get('message', 'Unknown error')
-                st.error(f"ImgBB upload failed: {error_msg}")
-                st.error(f"Full response: {result}")
-                return None
-        elif response.status_code == 403:
-            st.error("403 Forbidden: Check if your ImgBB API key is valid and has upload permissions")
-            st.error(f"Response text: {response.text}")
-            return None
-        elif response.status_code == 400:
-            st.error("400 Bad Request: Invalid image format or API key issue")
-            st.error(f"Response text: {response.text}")
-            return None
-        else:
-            st.error(f"Upload failed with status code: {response.status_code}")
-            st.error(f"Response text: {response.text}")
-            return None
-            
-    except Exception as e:
-        st.error(f"Error uploading image: {str(e)}")
-        return None
-
-def generate_video(image_url, prompt):
-    """Generate video using Replicate API"""
-    try:
-        # Test if the image URL is accessible
-        st.info(f"Testing image URL accessibility: {image_url}")
-        test_response = requests.head(image_url, timeout=30)
-        if test_response.status_code != 200:
-            st.error(f"Image URL not accessible: {test_response.status_code}")
-            return None
-            
-        # Call the model using the global client
-        output_url = client.run(
-            "minimax/hailuo-02-fast",
-            input={
-                "prompt": prompt,
-                "first_frame_image": image_url
-            }
+@st.cache_resource
+def get_pipeline():
+    """Pipeline shared by every session, configured from Streamlit secrets"""
+    return Pipeline(PipelineConfig.from_env(
+        st.secrets,
+        output_dir="outputs",
+        result_cache_dir="cache/results",
+        hosted_cache_path="cache/hosted.sqlite3",
+    ))
+
+@st.cache_resource
+def get_job_manager():
+    """Persistent job queue and worker pool shared by every session"""
+    manager = JobManager(
+        get_pipeline(),
+        root=st.secrets.get("JOBS_DIR", "jobs"),
+        max_workers=int(st.secrets.get("JOB_WORKERS", 2)),
+        max_predictions=int(st.secrets.get("MAX_CONCURRENT_PREDICTIONS", 4)),
+    )
+    # Prometheus metrics and job traces on a side port, when configured
+    if st.secrets.get("METRICS_PORT"):
+        metrics.serve_metrics(
+            st.secrets.get("METRICS_BIND", "127.0.0.1"), int(st.secrets["METRICS_PORT"]), traces=manager.trace,
         )
-        
-        return output_url
-        
-    except requests.exceptions.Timeout:
-        st.error("Timeout accessing image URL. The image might not be publicly accessible.")
-        return None
-    except requests.exceptions.ConnectionError:
-        st.error("Connection error accessing image URL. Please try again.")
-        return None
-    except Exception as e:
-        st.error(f"Error generating video: {str(e)}")
-        return None
-
-def download_video(video_url):
-    """Download video from URL and save locally"""
-    try:
-        response = requests.get(video_url, timeout=120)
-        
-        if response.status_code == 200:
-            # Create a unique filename with timestamp
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"generated_video_{timestamp}.mp4"
-            
-            # Save the video
-            with open(filename, "wb") as f:
-                f.write(response.content)
-            
-            return filename, response.content
-        else:
-            st.error(f"Failed to download video: {response.status_code}")
-            return None, None
-            
-    except Exception as e:
-        st.error(f"Error downloading video: {str(e)}")
-        return None, None
+    return manager
+
+@st.cache_resource
+def get_media_cache():
+    """Memory-capped video bytes shared by every session"""
+    return MediaCache(max_bytes=int(st.secrets.get("MEDIA_CACHE_MAX_BYTES", 256 * 1024 ** 2)))
+
+@st.cache_resource
+def get_session_registry():
+    """Tracks the media each session shows so it can be released when the session goes away"""
+    return SessionRegistry(get_media_cache(), idle_timeout=int(st.secrets.get("SESSION_IDLE_TIMEOUT", 30 * 60)))
+
+@st.cache_resource
+def get_session_jobs():
+    """Jobs each session waits on, canceled when nobody is left waiting after the session goes away"""
+    return SessionJobs(get_job_manager())
+
+def reap_sessions(registry, session_jobs):
+    """Release the media of sessions that disconnected or went idle, and their jobs after a grace period"""
+    for gone in registry.reap(runtime.get_instance().is_active_session if runtime.exists() else None):
+        session_jobs.end(gone)
+    session_jobs.release_ended()
+
+@st.cache_resource
+def start_session_reaper():
+    """Reap sessions from a background thread too, so closing the last tab still stops its jobs"""
+    registry, session_jobs = get_session_registry(), get_session_jobs()
+
+    def reap():
+        while True:
+            time.sleep(SESSION_REAP_INTERVAL)
+            try:
+                reap_sessions(registry, session_jobs)
+            except Exception:
+                logging.getLogger(__name__).exception("Could not reap sessions")
+
+    threading.Thread(target=reap, name="session-reaper", daemon=True).start()
+
+def load_video(path, artifact_id=None):
+    """Video bytes read through the shared cache; the video stays cached while this session shows it"""
+    key = artifact_id or path
+    shown_media.append(key)
+
+    def read():
+        with open(path, "rb") as f:
+            return f.read()
+
+    return get_media_cache().get(key, read)
+
+def job_progress(job):
+    """Progress bar value (0-100) and status text for an unfinished job"""
+    manager = get_job_manager()
+    start, end = JOB_PROGRESS[job.status]
+    value = int(start + (end - start) * manager.stage_progress(job))
+    text = JOB_STAGE_TEXT[job.status]
+    if job.draft:
+        text = f"Preview: {text[0].lower()}{text[1:]}"
+    if job.status == QUEUED:
+        text += f" (position {manager.position(job.id) + 1})"
+    eta = manager.eta(job)
+    if eta is not None:
+        text += f" · about {max(round(eta / 60), 1)} min left" if eta >= 60 else f" · about {max(int(eta), 1)} s left"
+    return value, text
+
+def follow_final_job():
+    """Track the full render queued alongside a finished preview"""
+    st.session_state.job_id = st.session_state.final_job_id
+    st.session_state.final_job_id = None
+    st.query_params['job'] = st.session_state.job_id
+    st.query_params.pop('final', None)
+    st.session_state.processing = True
+
+def batch_dir(batch_id):
+    """Directory of a batch started from the batch tab"""
+    # Batch ids come from the URL, so only accept the hex ids create_batch makes
+    if not re.fullmatch(r"[0-9a-f]{32}", batch_id):
+        raise ValueError(f"Invalid batch id: {batch_id}")
+    return os.path.join(st.secrets.get("BATCH_DIR", "batches"), batch_id)
+
+def create_batch(images, manifest_file, default_prompt):
+    """Save uploaded images with a manifest of their prompts; returns the new batch id"""
+    batch_id = uuid.uuid4().hex
+    images_dir = os.path.join(batch_dir(batch_id), "images")
+    os.makedirs(images_dir)
+    prompts = {}
+    if manifest_file is not None:
+        for row in csv.DictReader(io.StringIO(manifest_file.getvalue().decode("utf-8"))):
+            prompts[os.path.basename(row.get("image") or "")] = (row.get("prompt") or "").strip()
+    with open(os.path.join(batch_dir(batch_id), "manifest.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["image", "prompt"])
+        names = set()
+        for image in images:
+            uploaded = os.path.basename(image.name)
+            # Uploads from different folders can share a name; number the repeats
+            stem, ext = os.path.splitext(uploaded)
+            name, copy = uploaded, 1
+            while name in names:
+                name, copy = f"{stem}-{copy}{ext}", copy + 1
+            names.add(name)
+            with open(os.path.join(images_dir, name), "wb") as out:
+                out.write(image.getvalue())
+            writer.writerow([f"images/{name}", prompts.get(uploaded) or default_prompt])
+    return batch_id
+
+def load_batch(batch_id):
+    """Batch for an id, with the progress recorded in its report"""
+    root = batch_dir(batch_id)
+    return Batch(get_job_manager(), read_manifest(os.path.join(root, "manifest.csv")), root)
+
+session_id = get_script_run_ctx().session_id
+session_registry = get_session_registry()
+session_jobs = get_session_jobs()
+session_jobs.touch(session_id)
+# A reloaded page is a new session: watch the jobs restored from the URL before
+# the session that had them is reaped and lets go of them
+if 'jobs_rejoined' not in st.session_state:
+    st.session_state.jobs_rejoined = True
+    for job_id in [st.session_state.get('job_id'), st.session_state.final_job_id, *st.session_state.variant_jobs]:
+        if job_id:
+            session_jobs.rejoin(session_id, job_id)
+# Release media and jobs held for sessions that disconnected or went idle
+reap_sessions(session_registry, session_jobs)
+start_session_reaper()
+# Cache keys of the videos this run displays
+shown_media = []
 
 # Main interface
-col1, col2 = st.columns([1, 1])
+single_tab, variants_tab, batch_tab = st.tabs(["🎬 Single Video", "🎛️ Variants", "📚 Batch"])
+# Set when a tab is waiting on jobs; the script reruns once, after every tab has rendered
+poll_again = False
+
+with single_tab:
+    col1, col2 = st.columns([1, 1])
+
+    with col1:
+        st.markdown('<div class="upload-container">', unsafe_allow_html=True)
+        st.subheader("📤 Upload Your Image")
+
+        uploaded_file = st.file_uploader(
+            "Choose an image file",
+            type=['png', 'jpg', 'jpeg', 'gif'],
+            help="Upload the image you want to animate"
+        )
+
+        # Image will be displayed in the results section after generation
 
-with col1:
+        st.markdown('</div>', unsafe_allow_html=True)
+
+    with col2:
+        st.markdown('<div class="upload-container">', unsafe_allow_html=True)
+        st.subheader("✍️ Describe Your Vision")
+
+        prompt = st.text_area(
+            "Enter your prompt:",
+            value="an elephant turns blue and raises its trunk",
+            height=150,
+            help="Describe what should happen in the video",
+            placeholder="Describe the changes you want to see in the video..."
+        )
+        render_mode = FINAL_ONLY
+        if get_pipeline().previews:
+            render_mode = st.radio(
+                "Rendering:",
+                RENDER_MODES,
+                help="A preview is a cheaper, low-resolution clip, so you can check the prompt "
+                     "before paying for the full render. Rendering both costs more than the full render alone",
+            )
+
+        # Generate button
+        can_generate = (uploaded_file is not None and 
+                       prompt.strip() and 
+                       not st.session_state.processing)
+
+        if st.button("🎬 Generate Video", disabled=not can_generate):
+            if not uploaded_file:
+                st.error("Please upload an image!")
+            elif not prompt.strip():
+                st.error("Please enter a prompt!")
+            else:
+                image = uploaded_file.getvalue()
+                try:
+                    # Decode on the shared image pool rather than the script thread
+                    st.session_state.thumbnail = get_pipeline().submit_image_work(make_thumbnail, image).result()
+                except Exception:
+                    # Unreadable images (or ones Pillow refuses, such as decompression bombs) are reported by the job itself
+                    st.session_state.thumbnail = None
+                manager = get_job_manager()
+                if render_mode == FINAL_ONLY:
+                    job_id, final_id = manager.submit(image, prompt, sla=QUALITY), None
+                else:
+                    job_id, final_id = manager.submit_draft(image, prompt, final=render_mode == PREVIEW_AND_FINAL)
+                for submitted in (job_id, final_id):
+                    if submitted:
+                        session_jobs.follow(session_id, submitted)
+                st.session_state.job_id = job_id
+                st.session_state.final_job_id = final_id
+                st.query_params['job'] = job_id
+                if final_id:
+                    st.query_params['final'] = final_id
+                st.session_state.processing = True
+                st.rerun()
+
+        st.markdown('</div>', unsafe_allow_html=True)
+
+    # Processing section
+    if st.session_state.processing:
+        st.markdown("---")
+
+        # Progress bar only
+        progress_bar = st.progress(0)
+
+        job = get_job_manager().get(st.session_state.job_id)
+        if job is None:
+            st.error("Generation job was lost. Please try again.")
+            st.session_state.processing = False
+            del st.query_params['job']
+        elif job.status == SUCCEEDED:
+            progress_bar.progress(100)
+
+            # Store in session state
+            st.session_state.video_generated = True
+            # Keep only the file location; the video is served from disk
+            st.session_state.video_path = job.video_path
+            st.session_state.video_filename = job.video_filename
+            st.session_state.artifact_id = job.artifact_id
+            st.session_state.preview = job.draft
+            st.session_state.processing = False
+            if job.draft and st.session_state.final_job_id:
+                # Show the preview while following the full render queued with it
+                follow_final_job()
+
+            st.rerun()
+        elif job.status == FAILED and job.draft and st.session_state.final_job_id:
+            st.warning(f"The preview failed ({job.error}). Waiting for the full render instead.")
+            follow_final_job()
+            poll_again = True
+        elif job.status == FAILED:
+            st.error(job.error)
+            st.session_state.processing = False
+            del st.query_params['job']
+        elif job.status == CANCELED:
+            st.info("Generation was canceled.")
+            st.session_state.processing = False
+            del st.query_params['job']
+        else:
+            value, text = job_progress(job)
+            progress_bar.progress(value, text=text)
+            # Stops the prediction at the provider unless another tab waits on the same job
+            if st.button("⏹️ Cancel"):
+                for job_id in (st.session_state.job_id, st.session_state.final_job_id):
+                    if job_id:
+                        session_jobs.release(session_id, job_id)
+                st.session_state.processing = False
+                st.session_state.final_job_id = None
+                st.query_params.pop('job', None)
+                st.query_params.pop('final', None)
+                st.rerun()
+            # Poll the job store instead of blocking the script thread
+            poll_again = True
+
+    # Videos can be evicted from the output store while a session is idle
+    if st.session_state.video_generated and not os.path.exists(st.session_state.video_path or ""):
+        st.warning("This video has expired. Please generate it again.")
+        st.session_state.video_generated = False
+        st.session_state.video_path = None
+        st.session_state.artifact_id = None
+
+    # Display video result
+    if st.session_state.video_generated and st.session_state.video_path:
+        st.markdown("---")
+        st.subheader("🎥 Before & After Comparison")
+        if st.session_state.preview:
+            if st.session_state.processing:
+                st.info("This is a quick preview. The full-quality video is rendering and will replace it.")
+            else:
+                st.info("This is a quick preview. Happy with it? Render the full-quality video, "
+                        "or change the prompt and generate again.")
+                if st.button("✨ Render Full Quality"):
+                    final_id = get_job_manager().promote(st.session_state.job_id)
+                    if final_id is None:
+                        st.error("The preview has expired. Please upload the image again.")
+                    else:
+                        session_jobs.follow(session_id, final_id)
+                        st.session_state.job_id = final_id
+                        st.query_params['job'] = final_id
+                        st.session_state.processing = True
+                        st.rerun()
+
+        # Create two columns for side-by-side display
+        col1_result, col2_result = st.columns(2)
+
+        with col1_result:
+            st.markdown("**📸 Original Image**")
+            # Display the thumbnail kept from the upload instead of decoding it again
+            if st.session_state.thumbnail is not None:
+                st.image(st.session_state.thumbnail, caption="Original Image", width=1000)
+
+        with col2_result:
+            st.markdown("**🎬 Generated Video**")
+            # Display video with width matching prompt window
+            with metrics.span("render"):
+                video = load_video(st.session_state.video_path, st.session_state.artifact_id)
+                st.video(video, format="video/mp4", width=1000)
+
+            # Create working Download and Share buttons
+            col1, col2 = st.columns(2)
+            with col1:
+                st.download_button(
+                    label="📥 Download",
+                    data=video,
+                    file_name=st.session_state.video_filename,
+                    mime="video/mp4",
+                    use_container_width=True
+                )
+
+            with col2:
+                if st.button("📤 Share", use_container_width=True):
+                    st.session_state.show_share_options = True
+
+        # Share options modal
+        if hasattr(st.session_state, 'show_share_options') and st.session_state.show_share_options:
+            st.markdown("---")
+            st.subheader("📤 Share Your Video")
+
+            # Create share options
+            share_col1, share_col2, share_col3, share_col4 = st.columns(4)
+
+            with share_col1:
+                # Twitter/X
+                twitter_url = f"https://twitter.com/intent/tweet?text=Check out my AI-generated video! 🎬&url=YOUR_VIDEO_URL"
+                st.markdown(f'<a href="{twitter_url}" target="_blank" style="text-decoration: none;"><button style="background: #1DA1F2; color: white; border: none; padding: 10px 20px; border-radius: 8px; cursor: pointer; width: 100%;">🐦 Twitter/X</button></a>', unsafe_allow_html=True)
+
+            with share_col2:
+                # Facebook
+                facebook_url = f"https://www.facebook.com/sharer/sharer.php?u=YOUR_VIDEO_URL"
+                st.markdown(f'<a href="{facebook_url}" target="_blank" style="text-decoration: none;"><button style="background: #4267B2; color: white; border: none; padding: 10px 20px; border-radius: 8px; cursor: pointer; width: 100%;">📘 Facebook</button></a>', unsafe_allow_html=True)
+
+            with share_col3:
+                # LinkedIn
+                linkedin_url = f"https://www.linkedin.com/sharing/share-offsite/?url=YOUR_VIDEO_URL"
+                st.markdown(f'<a href="{linkedin_url}" target="_blank" style="text-decoration: none;"><button style="background: #0077B5; color: white; border: none; padding: 10px 20px; border-radius: 8px; cursor: pointer; width: 100%;">💼 LinkedIn</button></a>', unsafe_allow_html=True)
+
+            with share_col4:
+                # Copy Link
+                if st.button("🔗 Copy Link", use_container_width=True):
+                    st.success("Link copied to clipboard!")
+
+            # Close share options
+            if st.button("❌ Close", use_container_width=True):
+                st.session_state.show_share_options = False
+                st.rerun()
+
+        # Success message removed as requested
+
+        # Reset button
+        if st.button("🔄 Generate Another Video"):
+            # A full render still going in the background is no longer wanted
+            if st.session_state.processing:
+                session_jobs.release(session_id, st.session_state.job_id)
+                st.session_state.processing = False
+            st.session_state.video_generated = False
+            st.session_state.video_path = None
+            st.session_state.video_filename = None
+            st.session_state.artifact_id = None
+            st.session_state.thumbnail = None
+            st.session_state.preview = False
+            st.session_state.final_job_id = None
+            if hasattr(st.session_state, 'show_share_options'):
+                delattr(st.session_state, 'show_share_options')
+            st.session_state.pop('job_id', None)
+            st.query_params.pop('job', None)
+            st.query_params.pop('final', None)
+            st.rerun()
+
+with variants_tab:
     st.markdown('<div class="upload-container">', unsafe_allow_html=True)
-    st.subheader("📤 Upload Your Image")
-    
-    uploaded_file = st.file_uploader(
+    st.subheader("🎛️ Try Prompt Variants")
+    st.caption("One image, several prompts or seeds. The image is uploaded once and every variant renders at the same time.")
+
+    variant_image = st.file_uploader(
         "Choose an image file",
         type=['png', 'jpg', 'jpeg', 'gif'],
-        help="Upload the image you want to animate"
+        key="variant_image",
     )
-    
-    # Image will be displayed in the results section after generation
-    
+    variant_prompts = st.text_area("Prompts, one per line:", height=150, key="variant_prompts")
+    variant_seeds = st.number_input("Seeds per prompt", min_value=1, max_value=MAX_VARIANTS, value=1, key="variant_seeds")
+    prompts = [line.strip() for line in variant_prompts.splitlines() if line.strip()]
+
+    if st.button("🎛️ Generate Variants", disabled=not variant_image or not prompts or bool(st.session_state.variant_jobs)):
+        # A single seed leaves the model's own default
+        variants = [(text, seed if variant_seeds > 1 else None) for text in prompts for seed in range(variant_seeds)]
+        if len(variants) > MAX_VARIANTS:
+            st.error(f"Please ask for at most {MAX_VARIANTS} variants at a time.")
+        else:
+            st.session_state.variant_jobs = get_job_manager().submit_variants(variant_image.getvalue(), variants, sla=FAST)
+            for job_id in st.session_state.variant_jobs:
+                session_jobs.follow(session_id, job_id)
+            st.query_params['variants'] = ','.join(st.session_state.variant_jobs)
+            st.rerun()
+
     st.markdown('</div>', unsafe_allow_html=True)
 
-with col2:
+    if st.session_state.variant_jobs:
+        st.markdown("---")
+        # Each cell fills in as soon as its own prediction finishes
+        grid = st.columns(VARIANT_COLUMNS)
+        variant_jobs = [get_job_manager().get(job_id) for job_id in st.session_state.variant_jobs]
+        for index, job in enumerate(variant_jobs):
+            with grid[index % VARIANT_COLUMNS]:
+                if job is None:
+                    st.warning("This variant has expired.")
+                    continue
+                st.markdown(f"**{job.prompt}**" + (f" (seed {job.seed})" if job.seed is not None else ""))
+                if job.status == SUCCEEDED and os.path.exists(job.video_path or ""):
+                    variant_video = load_video(job.video_path, job.artifact_id)
+                    st.video(variant_video, format="video/mp4")
+                    st.download_button(
+                        label="📥 Download",
+                        data=variant_video,
+                        file_name=job.video_filename,
+                        mime="video/mp4",
+                        key=f"download_{job.id}",
+                        use_container_width=True
+                    )
+                elif job.status == SUCCEEDED:
+                    st.warning("This video has expired.")
+                elif job.status == FAILED:
+                    st.error(job.error)
+                elif job.status == CANCELED:
+                    st.info("Canceled.")
+                else:
+                    value, text = job_progress(job)
+                    st.progress(value, text=text)
+        if any(job is not None and not job.done for job in variant_jobs):
+            poll_again = True
+
+        if st.button("🔄 Clear Variants"):
+            # Variants still rendering are canceled
+            for job_id in st.session_state.variant_jobs:
+                session_jobs.release(session_id, job_id)
+            st.session_state.variant_jobs = []
+            st.query_params.pop('variants', None)
+            st.rerun()
+
+with batch_tab:
     st.markdown('<div class="upload-container">', unsafe_allow_html=True)
-    st.subheader("✍️ Describe Your Vision")
-    
-    prompt = st.text_area(
-        "Enter your prompt:",
-        value="an elephant turns blue and raises its trunk",
-        height=150,
-        help="Describe what should happen in the video",
-        placeholder="Describe the changes you want to see in the video..."
+    st.subheader("📚 Generate a Batch")
+    st.caption("Upload many images at once. Prompts come from an optional CSV manifest "
+               "(image and prompt columns) or from the default prompt below.")
+
+    batch_images = st.file_uploader(
+        "Choose image files",
+        type=['png', 'jpg', 'jpeg', 'gif'],
+        accept_multiple_files=True,
+        key="batch_images",
     )
-    
-    # Generate button
-    can_generate = (uploaded_file is not None and 
-                   prompt.strip() and 
-                   not st.session_state.processing)
-    
-    if st.button("🎬 Generate Video", disabled=not can_generate):
-        if not uploaded_file:
-            st.error("Please upload an image!")
-        elif not prompt.strip():
-            st.error("Please enter a prompt!")
+    batch_manifest = st.file_uploader("Optional manifest (CSV)", type=['csv'], key="batch_manifest")
+    batch_prompt = st.text_area("Default prompt:", height=100, key="batch_prompt")
+
+    if st.button("📚 Start Batch", disabled=not batch_images or bool(st.session_state.batch_id)):
+        try:
+            batch_id = create_batch(batch_images, batch_manifest, batch_prompt.strip())
+            load_batch(batch_id).submit()
+        except ValueError as e:
+            st.error(str(e))
         else:
-            st.session_state.processing = True
+            st.session_state.batch_id = batch_id
+            st.query_params['batch'] = batch_id
             st.rerun()
-    
+
     st.markdown('</div>', unsafe_allow_html=True)
 
-# Processing section
-if st.session_state.processing and uploaded_file and prompt.strip():
-    st.markdown("---")
-    
-    # Progress bar only
-    progress_bar = st.progress(0)
-    
-    # Step 1: Upload image
-    progress_bar.progress(20)
-    image_url = upload_to_imgbb(uploaded_file)
-    
-    if image_url:
-        progress_bar.progress(40)
-        
-        # Step 2: Generate video
-        progress_bar.progress(60)
-        video_url = generate_video(image_url, prompt)
-        
-        if video_url:
-            progress_bar.progress(80)
-            
-            # Step 3: Download video
-            video_path, video_bytes = download_video(video_url)
-            
-            if video_path and video_bytes:
-                progress_bar.progress(100)
-                
-                # Store in session state
-                st.session_state.video_generated = True
-                st.session_state.video_path = video_path
-                st.session_state.video_bytes = video_bytes
-                st.session_state.processing = False
-                
+    batch = None
+    if st.session_state.batch_id:
+        try:
+            batch = load_batch(st.session_state.batch_id)
+        except (OSError, ValueError):
+            st.warning("This batch is no longer available.")
+            st.session_state.batch_id = None
+            st.query_params.pop('batch', None)
+
+    if batch is not None:
+        # Requeues items whose job expired before this batch saw it finish
+        batch.submit()
+        counts = batch.refresh()
+        finished = counts[SUCCEEDED] + counts[FAILED]
+        st.progress(finished / len(batch.items), text=f"{finished} of {len(batch.items)} finished")
+        st.dataframe(
+            [
+                {"image": os.path.basename(item.image), "prompt": item.prompt, "status": item.status, "error": item.error or ""}
+                for item in batch.items
+            ],
+            use_container_width=True,
+        )
+        if batch.done:
+            archive = os.path.join(batch.out_dir, "videos.zip")
+            if not os.path.exists(archive):
+                batch.archive()
+            with open(archive, "rb") as archive_file:
+                st.download_button(
+                    label="📥 Download Videos",
+                    data=archive_file,
+                    file_name="videos.zip",
+                    mime="application/zip",
+                )
+            if st.button("🔄 Start Another Batch"):
+                st.session_state.batch_id = None
+                st.query_params.pop('batch', None)
                 st.rerun()
-            else:
-                st.session_state.processing = False
         else:
-            st.session_state.processing = False
-    else:
-        st.session_state.processing = False
-
-# Display video result
-if st.session_state.video_generated and hasattr(st.session_state, 'video_bytes'):
-    st.markdown("---")
-    st.subheader("🎥 Before & After Comparison")
-    
-    # Create two columns for side-by-side display
-    col1_result, col2_result = st.columns(2)
-    
-    with col1_result:
-        st.markdown("**📸 Original Image**")
-        # Display the original uploaded image
-        if uploaded_file is not None:
-            image = Image.open(uploaded_file)
-            st.image(image, caption="Original Image", width=1000)
-    
-    with col2_result:
-        st.markdown("**🎬 Generated Video**")
-        # Display video with width matching prompt window
-        st.video(st.session_state.video_bytes, width=1000)
-        
-        # Create working Download and Share buttons
-        col1, col2 = st.columns(2)
-        with col1:
-            st.download_button(
-                label="📥 Download",
-                data=st.session_state.video_bytes,
-                file_name=st.session_state.video_path,
-                mime="video/mp4",
-                use_container_width=True
-            )
-        
-        with col2:
-            if st.button("📤 Share", use_container_width=True):
-                st.session_state.show_share_options = True
-    
-    # Share options modal
-    if hasattr(st.session_state, 'show_share_options') and st.session_state.show_share_options:
-        st.markdown("---")
-        st.subheader("📤 Share Your Video")
-        
-        # Create share options
-        share_col1, share_col2, share_col3, share_col4 = st.columns(4)
-        
-        with share_col1:
-            # Twitter/X
-            twitter_url = f"https://twitter.com/intent/tweet?text=Check out my AI-generated video! 🎬&url=YOUR_VIDEO_URL"
-            st.markdown(f'<a href="{twitter_url}" target="_blank" style="text-decoration: none;"><button style="background: #1DA1F2; color: white; border: none; padding: 10px 20px; border-radius: 8px; cursor: pointer; width: 100%;">🐦 Twitter/X</button></a>', unsafe_allow_html=True)
-        
-        with share_col2:
-            # Facebook
-            facebook_url = f"https://www.facebook.com/sharer/sharer.php?u=YOUR_VIDEO_URL"
-            st.markdown(f'<a href="{facebook_url}" target="_blank" style="text-decoration: none;"><button style="background: #4267B2; color: white; border: none; padding: 10px 20px; border-radius: 8px; cursor: pointer; width: 100%;">📘 Facebook</button></a>', unsafe_allow_html=True)
-        
-        with share_col3:
-            # LinkedIn
-            linkedin_url = f"https://www.linkedin.com/sharing/share-offsite/?url=YOUR_VIDEO_URL"
-            st.markdown(f'<a href="{linkedin_url}" target="_blank" style="text-decoration: none;"><button style="background: #0077B5; color: white; border: none; padding: 10px 20px; border-radius: 8px; cursor: pointer; width: 100%;">💼 LinkedIn</button></a>', unsafe_allow_html=True)
-        
-        with share_col4:
-            # Copy Link
-            if st.button("🔗 Copy Link", use_container_width=True):
-                st.success("Link copied to clipboard!")
-        
-        # Close share options
-        if st.button("❌ Close", use_container_width=True):
-            st.session_state.show_share_options = False
-            st.rerun()
-    
-    # Success message removed as requested
-    
-    # Reset button
-    if st.button("🔄 Generate Another Video"):
-        st.session_state.video_generated = False
-        st.session_state.video_path = None
-        if hasattr(st.session_state, 'video_bytes'):
-            delattr(st.session_state, 'video_bytes')
-        if hasattr(st.session_state, 'show_share_options'):
-            delattr(st.session_state, 'show_share_options')
-        st.rerun()
+            poll_again = True
 
 # Footer
 st.markdown("---")
@@ -729,3 +1004,9 @@ st.markdown(
     """,
     unsafe_allow_html=True
 )
+
+session_registry.touch(session_id, *shown_media)
+
+if poll_again:
+    time.sleep(JOB_POLL_INTERVAL)
+    st.rerun()
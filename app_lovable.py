@@ -1,101 +1,45 @@
 import lovable as lv
-import replicate
-import requests
 from PIL import Image
-import io
-import base64
-import os
 
-# Initialize clients and API keys
-client = replicate.Client(api_token=os.getenv("REPLICATE_API_TOKEN"))
-imgbb_key = os.getenv("IMGBB_API_KEY")
+from pipeline import HostedImage, Pipeline, PipelineConfig, PipelineError, PredictionResult
 
-def upload_to_imgbb(image_file):
+# Pipeline configured from environment variables
+pipeline = Pipeline(PipelineConfig.from_env())
+
+
+def stage_progress(progress, start, end):
+    """Callback moving a progress bar between start and end as a stage reports (done, total)"""
+    def update(done, total):
+        if total:
+            progress.value = int(start + (end - start) * min(done / total, 1))
+    return update
+
+def upload_to_imgbb(image_file, progress=None):
     """Upload image to ImgBB and return the URL"""
     try:
-        if not imgbb_key:
-            return None
-            
-        # Process image with PIL
-        image = Image.open(image_file)
-        image = image.convert('RGB')
-        
-        # Save to bytes buffer
-        img_buffer = io.BytesIO()
-        image.save(img_buffer, format='JPEG', quality=95)
-        image_bytes = img_buffer.getvalue()
-        
-        # Encode to base64
-        image_base64 = base64.b64encode(image_bytes).decode('utf-8')
-        
-        # Upload to ImgBB
-        url = "https://api.imgbb.com/1/upload"
-        data = {
-            "key": imgbb_key,
-            "image": image_base64,
-            "name": "uploaded_image"
-        }
-        
-        response = requests.post(url, data=data)
-        
-        if response.status_code == 200:
-            result = response.json()
-            image_url = result['data']['url']
-            
-            # Test if URL is accessible
-            try:
-                requests.head(image_url, timeout=5)
-                return image_url
-            except:
-                return result['data']['display_url']
-        else:
-            return None
-            
-    except Exception as e:
+        return pipeline.host(image_file, progress).url
+    except PipelineError:
         return None
 
-def generate_video(image_url, prompt):
+def generate_video(image_url, prompt, progress=None):
     """Generate video using Replicate API"""
+    def on_status(status):
+        # Only models that print a progress bar in their logs report one
+        if progress and status.progress is not None:
+            progress(status.progress, 1)
+
     try:
-        # Test if image URL is accessible
-        try:
-            requests.head(image_url, timeout=5)
-        except:
-            return None
-            
-        output = client.run(
-            "minimax/hailuo-02-fast",
-            input={
-                "image": image_url,
-                "prompt": prompt,
-                "num_frames": 16,
-                "fps": 8
-            }
-        )
-        
-        if output and len(output) > 0:
-            return output[0]
-        return None
-        
-    except Exception as e:
+        return pipeline.predict(HostedImage(url=image_url), prompt, on_status).video_url
+    except PipelineError:
         return None
 
-def download_video(video_url):
+def download_video(video_url, progress=None):
     """Download video and return file path and bytes"""
     try:
-        response = requests.get(video_url)
-        if response.status_code == 200:
-            video_bytes = response.content
-            
-            # Generate filename with timestamp
-            from datetime import datetime
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"generated_video_{timestamp}.mp4"
-            
-            return filename, video_bytes
-        return None, None
-        
-    except Exception as e:
+        video = pipeline.fetch_result(PredictionResult(video_url=video_url), progress)
+        with open(video.path, "rb") as f:
+            return video.filename, f.read()
+    except PipelineError:
         return None, None
 
 # Create Lovable app
@@ -144,27 +88,24 @@ with app.page("Generate Video"):
             progress = lv.progress(value=0, max=100)
             
             # Step 1: Upload image
-            progress.value = 20
             lv.text("📤 Uploading image...")
-            image_url = upload_to_imgbb(uploaded_file)
+            image_url = upload_to_imgbb(uploaded_file, stage_progress(progress, 0, 15))
             
             if image_url:
-                progress.value = 40
+                progress.value = 15
                 lv.text("✅ Image uploaded successfully!")
                 
                 # Step 2: Generate video
-                progress.value = 60
                 lv.text("🎬 Generating video... This may take 2-5 minutes.")
-                video_url = generate_video(image_url, prompt)
+                video_url = generate_video(image_url, prompt, stage_progress(progress, 15, 90))
                 
                 if video_url:
-                    progress.value = 80
+                    progress.value = 90
                     lv.text("✅ Video generated successfully!")
                     
                     # Step 3: Download video
-                    progress.value = 90
                     lv.text("📥 Preparing video for download...")
-                    video_path, video_bytes = download_video(video_url)
+                    video_path, video_bytes = download_video(video_url, stage_progress(progress, 90, 100))
                     
                     if video_path and video_bytes:
                         progress.value = 100
@@ -0,0 +1,262 @@
+"""Batch generation from a CSV manifest or a directory of images
+
+Every (image, prompt) pair becomes a job on the shared JobManager queue, so
+batches get the same bounded worker pool, prediction cap and result cache as
+interactive requests, at a lower priority. Progress is checkpointed to
+report.csv in the output directory after every change; running the same
+batch again picks up where it stopped instead of resubmitting finished items.
+
+Usage:
+    python batch.py manifest.csv --out results
+    python batch.py photos/ --prompt "the camera slowly orbits the product"
+
+A manifest has "image" and "prompt" columns, with image paths relative to
+the manifest. For a directory, each image's prompt is read from a .txt file
+with the same name, falling back to --prompt.
+"""
+import argparse
+import csv
+import logging
+import os
+import sys
+import time
+import uuid
+import zipfile
+from collections import Counter
+from dataclasses import asdict, dataclass, fields
+from typing import Optional
+
+from cache import link_or_copy
+import metrics
+from jobs import CANCELED, FAILED, SUCCEEDED, JobManager
+from models import CHEAP, SLAS
+from pipeline import Pipeline, PipelineConfig
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+# Interactive jobs (priority 0) are claimed before batch items
+BATCH_PRIORITY = -10
+# Batch items are not waited on, so the router sends them to the cheapest model
+BATCH_SLA = CHEAP
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif")
+REPORT_NAME = "report.csv"
+
+
+@dataclass
+class BatchItem:
+    """One (image, prompt) pair of a batch and its progress"""
+    image: str
+    prompt: str
+    status: str = PENDING
+    job_id: Optional[str] = None
+    # Path of the finished video in the output directory
+    video: Optional[str] = None
+    error: Optional[str] = None
+
+    @property
+    def done(self):
+        return self.status in (SUCCEEDED, FAILED)
+
+
+REPORT_COLUMNS = [f.name for f in fields(BatchItem)]
+
+
+def read_manifest(source, prompt=None):
+    """BatchItems for a CSV manifest or a directory of images; prompt is the fallback prompt"""
+    items = []
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            if not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            image = os.path.join(source, name)
+            sidecar = os.path.splitext(image)[0] + ".txt"
+            text = prompt
+            if os.path.exists(sidecar):
+                with open(sidecar, encoding="utf-8") as f:
+                    text = f.read().strip()
+            if not text:
+                raise ValueError(f"No prompt for {name}: add {sidecar} or pass a default prompt")
+            items.append(BatchItem(image=image, prompt=text))
+        return items
+
+    root = os.path.dirname(os.path.abspath(source))
+    with open(source, newline="", encoding="utf-8") as f:
+        for line, row in enumerate(csv.DictReader(f), start=2):
+            if not row.get("image"):
+                raise ValueError(f"{source}:{line}: missing image")
+            text = (row.get("prompt") or "").strip() or prompt
+            if not text:
+                raise ValueError(f"{source}:{line}: no prompt for {row['image']}")
+            items.append(BatchItem(image=os.path.join(root, row["image"]), prompt=text))
+    return items
+
+
+class Batch:
+    """Runs BatchItems through a JobManager, checkpointing progress in out_dir/report.csv"""
+
+    def __init__(self, manager, items, out_dir, priority=BATCH_PRIORITY, retry_failed=False, sla=BATCH_SLA):
+        self.manager = manager
+        self.items = items
+        self.out_dir = out_dir
+        self.priority = priority
+        self.sla = sla
+        self.report_path = os.path.join(out_dir, REPORT_NAME)
+        os.makedirs(out_dir, exist_ok=True)
+        self._resume(retry_failed)
+
+    @property
+    def done(self):
+        return all(item.done for item in self.items)
+
+    def counts(self):
+        """Number of items in each status"""
+        return Counter(item.status for item in self.items)
+
+    def _resume(self, retry_failed):
+        """Carry over the progress recorded by an earlier run of the same batch"""
+        if not os.path.exists(self.report_path):
+            return
+        with open(self.report_path, newline="", encoding="utf-8") as f:
+            previous = {(row["image"], row["prompt"]): row for row in csv.DictReader(f)}
+        for item in self.items:
+            row = previous.get((item.image, item.prompt))
+            if row is None:
+                continue
+            if row["status"] == FAILED and retry_failed:
+                continue
+            if row["status"] == SUCCEEDED and not os.path.exists(row["video"] or ""):
+                continue
+            item.status = row["status"]
+            item.job_id = row["job_id"] or None
+            item.video = row["video"] or None
+            item.error = row["error"] or None
+
+    def save(self):
+        """Write the report atomically"""
+        tmp = f"{self.report_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_COLUMNS)
+            writer.writeheader()
+            for item in self.items:
+                writer.writerow(asdict(item))
+        os.replace(tmp, self.report_path)
+
+    def submit(self):
+        """Queue every item that has no job yet; returns the number queued"""
+        queued = 0
+        try:
+            for item in self.items:
+                if item.done or item.job_id:
+                    continue
+                try:
+                    with open(item.image, "rb") as f:
+                        image = f.read()
+                except OSError as e:
+                    item.status, item.error = FAILED, f"Could not read image: {e}"
+                else:
+                    item.job_id = self.manager.submit(image, item.prompt, priority=self.priority, sla=self.sla)
+                    item.status = PENDING
+                    queued += 1
+        finally:
+            # Record the job ids even if interrupted; an item submitted again attaches to its unfinished job
+            self.save()
+        return queued
+
+    def refresh(self):
+        """Pick up job progress, copy finished videos to out_dir and save the report"""
+        for index, item in enumerate(self.items):
+            if item.done or not item.job_id:
+                continue
+            job = self.manager.get(item.job_id)
+            if job is None:
+                # The job was pruned before this batch saw it finish; queue it again
+                item.job_id = None
+                item.status = PENDING
+                continue
+            # A job stopped from elsewhere counts as failed, so --retry-failed picks it up
+            item.status = FAILED if job.status == CANCELED else job.status
+            if item.status == FAILED:
+                item.error = job.error
+            elif job.status == SUCCEEDED:
+                stem = os.path.splitext(os.path.basename(item.image))[0]
+                video = os.path.join(self.out_dir, f"{index:04d}-{stem}.mp4")
+                try:
+                    link_or_copy(job.video_path, video)
+                except OSError as e:
+                    item.status, item.error = FAILED, f"Could not save video: {e}"
+                else:
+                    item.video = video
+        self.save()
+        return self.counts()
+
+    def run(self, poll_interval=2, on_progress=None):
+        """Submit and track items until every one has finished; returns the final counts"""
+        while True:
+            self.submit()
+            counts = self.refresh()
+            if on_progress:
+                on_progress(counts)
+            if self.done:
+                return counts
+            time.sleep(poll_interval)
+
+    def archive(self):
+        """Zip the finished videos and the report into out_dir; returns the zip path"""
+        path = os.path.join(self.out_dir, "videos.zip")
+        tmp = f"{path}.tmp"
+        # Videos are already compressed
+        with zipfile.ZipFile(tmp, "w", compression=zipfile.ZIP_STORED) as archive:
+            archive.write(self.report_path, REPORT_NAME)
+            for item in self.items:
+                if item.status == SUCCEEDED and item.video:
+                    archive.write(item.video, os.path.basename(item.video))
+        os.replace(tmp, path)
+        return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate videos for a CSV manifest or a directory of images")
+    parser.add_argument("manifest", help="CSV file with image and prompt columns, or a directory of images")
+    parser.add_argument("--out", default="batch-output", help="directory for videos and report.csv")
+    parser.add_argument("--prompt", help="prompt for images that have none in the manifest")
+    parser.add_argument("--jobs-dir", default="jobs", help="job queue directory, shared with the app")
+    parser.add_argument("--workers", type=int, default=2, help="worker threads preparing and hosting images")
+    parser.add_argument("--max-predictions", type=int, default=4, help="predictions running at once")
+    parser.add_argument("--retry-failed", action="store_true", help="resubmit items that failed in an earlier run")
+    parser.add_argument("--sla", choices=SLAS, default=BATCH_SLA, help="how the model router picks a model (ROUTED_MODELS)")
+    parser.add_argument("--poll-interval", type=float, default=2)
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics and job traces on this port")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    try:
+        items = read_manifest(args.manifest, args.prompt)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    pipeline = Pipeline(PipelineConfig.from_env(
+        output_dir="outputs",
+        result_cache_dir="cache/results",
+        hosted_cache_path="cache/hosted.sqlite3",
+    ))
+    manager = JobManager(pipeline, root=args.jobs_dir, max_workers=args.workers, max_predictions=args.max_predictions)
+    if args.metrics_port:
+        metrics.serve_metrics(port=args.metrics_port, traces=manager.trace)
+    batch = Batch(manager, items, args.out, retry_failed=args.retry_failed, sla=args.sla)
+
+    last = None
+
+    def report(counts):
+        nonlocal last
+        line = ", ".join(f"{status}: {count}" for status, count in sorted(counts.items()))
+        if line != last:
+            print(line, flush=True)
+            last = line
+
+    counts = batch.run(args.poll_interval, on_progress=report)
+    print(f"Report written to {batch.report_path}")
+    return 1 if counts.get(FAILED) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,183 @@
+"""Offline benchmark of the generation pipeline against local fake services
+
+Every job runs end to end (prepare, upload, URL check, predict, poll,
+download) through a JobManager pointed at fakes.FakeServices, for each
+combination of concurrency level and image size. The report gives
+throughput, p50/p95/p99 end-to-end latency, the median of the main stages
+taken from the job traces, and peak RSS, so performance changes can be
+checked on any Linux box without credentials or network access.
+
+Usage:
+    python benchmark.py
+    python benchmark.py --concurrency 1 4 16 --sizes 1024x768 4032x3024 --jobs 32 --render-seconds 2
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+from fakes import FakeServices, LatencyProfile
+from jobs import JobManager
+from pipeline import Pipeline, PipelineConfig
+
+logger = logging.getLogger(__name__)
+
+# Stages whose median duration is shown next to the end-to-end numbers
+REPORT_STAGES = ("queue_wait", "decode", "upload", "prediction", "download")
+
+
+def make_image(width, height, seed=0):
+    """Photo-like JPEG bytes: a gradient with noise, which compresses about as badly as a real photo"""
+    noise = Image.effect_noise((width, height), 48).convert("RGB")
+    gradient = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    image = Image.blend(noise, gradient, 0.5)
+    rng = random.Random(seed)
+    image.paste((rng.randrange(256), rng.randrange(256), rng.randrange(256)), (0, 0, width // 8, height // 8))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=92)
+    return buffer.getvalue()
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and its reaped children, in MB (Linux reports KB)"""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return (own + children) / 1024
+
+
+def run_level(services, concurrency, size, jobs, workdir, image_pool="thread", poll_interval=0.25, webhooks=False):
+    """Run jobs through a fresh JobManager with concurrency workers and return the result row"""
+    width, height = size
+    config = PipelineConfig(
+        **services.pipeline_settings(),
+        output_dir=os.path.join(workdir, "outputs"),
+        poll_interval=poll_interval,
+        image_pool=image_pool,
+        http_pool_size=max(10, concurrency),
+        # A free port; the fake provider posts straight back to it
+        webhook_port=0 if webhooks else None,
+    )
+    manager = JobManager(
+        Pipeline(config), root=os.path.join(workdir, "jobs"), max_workers=concurrency, max_predictions=concurrency,
+    )
+    throttled = services.throttled
+    base = make_image(width, height)
+    # Bytes after the JPEG end marker are ignored by decoders but give every job its own source digest
+    images = [base + f"job{i}".encode("ascii") for i in range(jobs)]
+
+    started = time.time()
+    job_ids = [manager.submit(image, "a slow camera orbit") for image in images]
+    while True:
+        finished = [manager.get(job_id) for job_id in job_ids]
+        if all(job.done for job in finished):
+            break
+        time.sleep(0.05)
+    wall = max(job.updated_at for job in finished) - started
+
+    latencies = [job.updated_at - job.created_at for job in finished if job.status == "succeeded"]
+    stages = {}
+    for job in finished:
+        for span in (manager.trace(job.id) or {}).get("spans", []):
+            stages.setdefault(span["stage"], []).append(span["duration"])
+    row = {
+        "concurrency": concurrency,
+        "size": f"{width}x{height}",
+        "jobs": jobs,
+        "succeeded": len(latencies),
+        "failed": jobs - len(latencies),
+        # Requests the fake services answered with a 429
+        "throttled": services.throttled - throttled,
+        "throughput": jobs / wall if wall else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    for pct in (50, 95, 99):
+        row[f"p{pct}"] = percentile(latencies, pct) if latencies else None
+    for stage in REPORT_STAGES:
+        row[f"{stage}_p50"] = percentile(stages[stage], 50) if stages.get(stage) else None
+    return row
+
+
+def format_table(rows):
+    """Fixed-width table of result rows, header first"""
+    columns = ["concurrency", "size", "succeeded", "failed", "throttled", "throughput", "p50", "p95", "p99"]
+    columns += [f"{stage}_p50" for stage in REPORT_STAGES] + ["peak_rss_mb"]
+    lines = ["  ".join(f"{column:>14}" for column in columns)]
+    for row in rows:
+        cells = []
+        for column in columns:
+            value = row[column]
+            cells.append(f"{value:>14.3f}" if isinstance(value, float) else f"{str(value):>14}")
+        lines.append("  ".join(cells))
+    return "\n".join(lines)
+
+
+def parse_size(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline against local fake ImgBB/Replicate/CDN servers")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8], help="worker/prediction limits to try")
+    parser.add_argument("--sizes", type=parse_size, nargs="+", default=[(1024, 768), (4032, 3024)],
+                        help="source image sizes, as WIDTHxHEIGHT")
+    parser.add_argument("--jobs", type=int, default=16, help="jobs per concurrency level and size")
+    parser.add_argument("--render-seconds", type=float, default=1.0, help="fake prediction time")
+    parser.add_argument("--render-jitter", type=float, default=0.5, help="uniform extra prediction time")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of predictions that fail")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of API requests answered with 503")
+    parser.add_argument("--api-rate", type=float, default=0, help="API and upload requests per second the fakes "
+                        "accept before answering 429 (0 = unlimited)")
+    parser.add_argument("--upload-seconds", type=float, default=0.0, help="fake upload latency")
+    parser.add_argument("--video-mb", type=float, default=2.0, help="size of the fake video")
+    parser.add_argument("--poll-interval", type=float, default=0.25)
+    parser.add_argument("--image-pool", choices=["thread", "process"], default="thread")
+    parser.add_argument("--webhooks", action="store_true", help="track predictions by webhook instead of polling")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    profile = LatencyProfile(
+        render_seconds=args.render_seconds,
+        render_jitter=args.render_jitter,
+        failure_rate=args.failure_rate,
+        upload_seconds=args.upload_seconds,
+        error_rate=args.error_rate,
+        api_rate=args.api_rate,
+    )
+    rows = []
+    print(format_table([]), flush=True)
+    with FakeServices(profile, video_bytes=int(args.video_mb * 1024 * 1024), seed=args.seed) as services:
+        for size in args.sizes:
+            for concurrency in args.concurrency:
+                with tempfile.TemporaryDirectory(prefix="image2video-bench-") as workdir:
+                    rows.append(run_level(
+                        services, concurrency, size, args.jobs, workdir,
+                        image_pool=args.image_pool, poll_interval=args.poll_interval, webhooks=args.webhooks,
+                    ))
+                print(format_table(rows[-1:]).splitlines()[-1], flush=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
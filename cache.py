@@ -0,0 +1,147 @@
+"""On-disk caches for pipeline results
+
+ResultCache maps (image digest, prompt, model, inputs) to a stored MP4 so a
+repeated request is answered without a new prediction. Entries expire after
+a TTL and the store is kept under a byte budget by evicting the least
+recently used files.
+
+HostedImageCache remembers where a source image was uploaded so later
+generations from the same image skip re-encoding and re-uploading it.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+def link_or_copy(src, dst):
+    """Hard-link src to dst (atomically replacing dst), copying when linking is not possible"""
+    tmp = f"{dst}.{uuid.uuid4().hex}.tmp"
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+class ResultCache:
+    """Size-bounded LRU cache of generated videos with a TTL"""
+
+    def __init__(self, root, max_bytes=2 * 1024 ** 3, ttl=7 * 24 * 3600):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        os.makedirs(root, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(root, "index.sqlite3"), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(image_digest, prompt, model, params):
+        """Stable cache key for a generation request"""
+        payload = json.dumps([image_digest, prompt, model, params], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.root, f"{key}.mp4")
+
+    def get(self, key):
+        """Path of the cached video for a key, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT created_at FROM entries WHERE key = ?", (key,)).fetchone()
+            path = self._path(key)
+            if row and row[0] + self.ttl > now and os.path.exists(path):
+                self._conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+                return path
+            if row:
+                self._remove(key)
+            return None
+
+    def put(self, key, source):
+        """Store a video (file path or bytes) under key and return the cached path"""
+        cached = self._path(key)
+        if isinstance(source, (bytes, bytearray)):
+            tmp = f"{cached}.{uuid.uuid4().hex}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(source)
+            os.replace(tmp, cached)
+        else:
+            link_or_copy(source, cached)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, size, created_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, os.path.getsize(cached), now, now),
+            )
+            self._evict(now)
+        return cached
+
+    def _remove(self, key):
+        self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self, now):
+        """Drop expired entries, then least recently used ones until under max_bytes"""
+        for (key,) in self._conn.execute("SELECT key FROM entries WHERE created_at <= ?", (now - self.ttl,)).fetchall():
+            self._remove(key)
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall():
+            self._remove(key)
+            logger.info("Evicted cached video %s", key)
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+
+class HostedImageCache:
+    """Maps source image digests to hosted URLs until the hosted copy expires"""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS hosted ("
+            "source_digest TEXT PRIMARY KEY, url TEXT NOT NULL, display_url TEXT, "
+            "image_digest TEXT, expires_at REAL NOT NULL)"
+        )
+        self._lock = threading.Lock()
+
+    def get(self, source_digest):
+        """(url, display_url, image_digest) for an unexpired upload, or None"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT url, display_url, image_digest FROM hosted WHERE source_digest = ? AND expires_at > ?",
+                (source_digest, now),
+            ).fetchone()
+            if row is None:
+                # Expired rows are useless; clear them out while we are here
+                self._conn.execute("DELETE FROM hosted WHERE expires_at <= ?", (now,))
+        return row
+
+    def put(self, source_digest, url, display_url, image_digest, expires_at):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO hosted (source_digest, url, display_url, image_digest, expires_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (source_digest, url, display_url, image_digest, expires_at),
+            )
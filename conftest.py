@@ -0,0 +1,11 @@
+"""Fixtures shared by the test modules"""
+import pytest
+
+from fakes import FakeServices, LatencyProfile
+
+
+@pytest.fixture
+def services():
+    """Fake ImgBB, Replicate and video CDN; predictions take two seconds"""
+    with FakeServices(LatencyProfile(render_seconds=2), video_bytes=64 * 1024) as services:
+        yield services
@@ -0,0 +1,335 @@
+"""Local stand-ins for ImgBB, the Replicate API and the video CDN
+
+FakeServices runs one HTTP server that answers like the three services the
+pipeline talks to, so the pipeline can be benchmarked or exercised offline:
+
+- POST /1/upload: ImgBB upload (multipart or base64 form), images then
+  served from /images/<n>.jpg
+- POST /v1/models/<owner>/<name>/predictions and GET /v1/predictions/<id>:
+  Replicate predictions that succeed after a configurable render time,
+  or fail at a configurable rate; POST /v1/predictions/<id>/cancel
+  cancels one
+- GET /videos/<prediction id>.mp4: the same static video for every
+  prediction, with Range support
+
+API and upload requests can be rate limited like the real services: past
+the profile's api_rate per second they get a 429 with Retry-After, and every
+answer carries X-RateLimit-* headers.
+
+Predictions created with a webhook URL are also pushed to it, like Replicate
+does: "logs" events while they render and a "completed" event at the end,
+signed when the services have a webhook secret.
+
+Point a PipelineConfig at it with pipeline_settings().
+"""
+import base64
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+from webhooks import signed_headers
+
+logger = logging.getLogger(__name__)
+
+PREDICTION_PATH = re.compile(r"^/v1/predictions/([^/]+)$")
+CREATE_PATH = re.compile(r"^/v1/models/([^/]+)/([^/]+)/predictions$")
+CANCEL_PATH = re.compile(r"^/v1/predictions/([^/]+)/cancel$")
+# Seconds between "logs" webhooks of one prediction, as Replicate throttles them
+WEBHOOK_LOGS_INTERVAL = 0.5
+
+
+@dataclass
+class LatencyProfile:
+    """How the fake Replicate API and upload endpoint behave"""
+    # Seconds from creation until a prediction finishes, plus uniform jitter
+    render_seconds: float = 1.0
+    render_jitter: float = 0.0
+    # Share of predictions that end as failed
+    failure_rate: float = 0.0
+    # Extra seconds before the upload endpoint answers
+    upload_seconds: float = 0.0
+    # Share of API and upload requests answered with a 503
+    error_rate: float = 0.0
+    # API and upload requests accepted per one-second window; 0 is unlimited
+    api_rate: float = 0
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    services = None
+
+    def log_message(self, format, *args):
+        logger.debug("fake services: " + format, *args)
+
+    def _send(self, status, body=b"", content_type="application/json", headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        services = self.services
+        body = self._body()
+        headers, limited = services.throttle()
+        if limited:
+            self._send(429, {"detail": "request was throttled"}, headers=headers)
+        elif services.flaky():
+            self._send(503, {"detail": "temporarily unavailable"})
+        elif path == "/1/upload":
+            self._send(200, services.upload(self.headers, body), headers=headers)
+        elif CREATE_PATH.match(path):
+            owner, name = CREATE_PATH.match(path).groups()
+            self._send(201, services.create_prediction(f"{owner}/{name}", json.loads(body or b"{}")), headers=headers)
+        elif CANCEL_PATH.match(path):
+            prediction = services.cancel_prediction(CANCEL_PATH.match(path).group(1))
+            if prediction is None:
+                self._send(404, {"detail": "not found"}, headers=headers)
+            else:
+                self._send(200, prediction, headers=headers)
+        else:
+            self._send(404, {"detail": "not found"})
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        services = self.services
+        match = PREDICTION_PATH.match(path)
+        if match:
+            headers, limited = services.throttle()
+            prediction = services.prediction(match.group(1))
+            if limited:
+                self._send(429, {"detail": "request was throttled"}, headers=headers)
+            elif prediction is None:
+                self._send(404, {"detail": "not found"}, headers=headers)
+            else:
+                self._send(200, prediction, headers=headers)
+        elif path.startswith("/images/"):
+            data = services.images.get(path[len("/images/"):])
+            if data is None:
+                self._send(404, b"", "text/plain")
+            else:
+                self._send(200, data, "image/jpeg")
+        elif path.startswith("/videos/") and path.endswith(".mp4"):
+            self._send_video(services.video)
+        else:
+            self._send(404, {"detail": "not found"})
+
+    do_HEAD = do_GET
+
+    def _send_video(self, video):
+        match = re.match(r"bytes=(\d+)-$", self.headers.get("Range", ""))
+        if not match:
+            self._send(200, video, "video/mp4", {"Accept-Ranges": "bytes"})
+            return
+        start = int(match.group(1))
+        if start >= len(video):
+            self._send(416, b"", "video/mp4", {"Content-Range": f"bytes */{len(video)}"})
+            return
+        self._send(206, video[start:], "video/mp4", {"Content-Range": f"bytes {start}-{len(video) - 1}/{len(video)}"})
+
+
+class FakeServices:
+    """ImgBB, Replicate and a video CDN served from one local HTTP server"""
+
+    def __init__(self, profile=None, video_bytes=2 * 1024 * 1024, bind="127.0.0.1", port=0, seed=None,
+                 webhook_secret=None):
+        self.profile = profile or LatencyProfile()
+        self.webhook_secret = webhook_secret
+        self.images = {}
+        self.predictions = {}
+        # Not a valid MP4; the pipeline only stores the bytes
+        self.video = os.urandom(video_bytes)
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        # Current one-second rate limit window and the requests seen in it
+        self._window = None
+        self._window_requests = 0
+        # Requests answered with a 429
+        self.throttled = 0
+        handler = type("FakeHandler", (_Handler,), {"services": self})
+        self.server = ThreadingHTTPServer((bind, port), handler)
+        self.server.daemon_threads = True
+        self.base_url = f"http://{bind}:{self.server.server_port}"
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fake-services", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def pipeline_settings(self):
+        """PipelineConfig fields that point a pipeline at these services"""
+        return {
+            "imgbb_api_key": "fake",
+            "imgbb_upload_url": f"{self.base_url}/1/upload",
+            "replicate_api_token": "fake",
+            "replicate_base_url": self.base_url,
+            "image_host": "imgbb",
+        }
+
+    def flaky(self):
+        with self._lock:
+            return self._random.random() < self.profile.error_rate
+
+    def throttle(self):
+        """(rate limit headers, whether to answer 429) for one API or upload request"""
+        if not self.profile.api_rate:
+            return {}, False
+        now = time.time()
+        limit = max(int(self.profile.api_rate), 1)
+        with self._lock:
+            if self._window != int(now):
+                self._window, self._window_requests = int(now), 0
+            self._window_requests += 1
+            remaining = limit - self._window_requests
+            if remaining < 0:
+                self.throttled += 1
+        headers = {
+            "X-RateLimit-Limit": str(limit),
+            "X-RateLimit-Remaining": str(max(remaining, 0)),
+            "X-RateLimit-Reset": f"{int(now) + 1 - now:.3f}",
+        }
+        if remaining < 0:
+            headers["Retry-After"] = "1"
+        return headers, remaining < 0
+
+    def upload(self, headers, body):
+        """ImgBB upload response for a multipart or base64 form body"""
+        time.sleep(self.profile.upload_seconds)
+        content_type = headers.get("Content-Type", "")
+        if content_type.startswith("multipart/form-data"):
+            message = BytesParser(policy=policy.HTTP).parsebytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode("utf-8") + body
+            )
+            data = next(
+                part.get_payload(decode=True) for part in message.iter_parts()
+                if part.get_param("name", header="content-disposition") == "image"
+            )
+        else:
+            data = base64.b64decode(parse_qs(body.decode("ascii"))["image"][0])
+        name = f"{next(self._ids)}.jpg"
+        self.images[name] = data
+        url = f"{self.base_url}/images/{name}"
+        return {"success": True, "status": 200, "data": {"url": url, "display_url": url, "size": len(data)}}
+
+    def create_prediction(self, model, body):
+        """Start a fake prediction that finishes after the profile's render time"""
+        with self._lock:
+            prediction_id = f"fake{next(self._ids)}"
+            render = self.profile.render_seconds + self._random.uniform(0, self.profile.render_jitter)
+            failed = self._random.random() < self.profile.failure_rate
+        self.predictions[prediction_id] = {
+            "model": model,
+            "input": body.get("input"),
+            "created": time.time(),
+            "ready_at": time.time() + render,
+            "failed": failed,
+            "canceled": False,
+        }
+        if body.get("webhook"):
+            threading.Thread(
+                target=self._send_webhooks,
+                args=(prediction_id, body["webhook"], body.get("webhook_events_filter") or ["completed"]),
+                name=f"fake-webhooks-{prediction_id}",
+                daemon=True,
+            ).start()
+        return self.prediction(prediction_id)
+
+    def _send_webhooks(self, prediction_id, url, events):
+        """Post a prediction's updates to its webhook until it finishes"""
+        state = self.predictions[prediction_id]
+        while time.time() < state["ready_at"]:
+            time.sleep(min(WEBHOOK_LOGS_INTERVAL, max(state["ready_at"] - time.time(), 0)))
+            if "logs" in events and time.time() < state["ready_at"]:
+                self.send_webhook(url, self.prediction(prediction_id))
+        if "completed" in events:
+            self.send_webhook(url, self.prediction(prediction_id))
+
+    def send_webhook(self, url, prediction):
+        """Post one prediction update to url, signed with webhook_secret when set; returns the status code"""
+        body = json.dumps(prediction).encode("utf-8")
+        headers = signed_headers(self.webhook_secret, body) if self.webhook_secret else {"Content-Type": "application/json"}
+        try:
+            return requests.post(url, data=body, headers=headers, timeout=10).status_code
+        except requests.RequestException as e:
+            logger.warning("Fake webhook to %s failed: %s", url, e)
+            return None
+
+    def cancel_prediction(self, prediction_id):
+        """Stop a running prediction; returns its JSON, or None for unknown ids"""
+        state = self.predictions.get(prediction_id)
+        if state is None:
+            return None
+        now = time.time()
+        if now < state["ready_at"]:
+            state["canceled"] = True
+            state["ready_at"] = now
+        return self.prediction(prediction_id)
+
+    def prediction(self, prediction_id):
+        """Replicate prediction JSON for an id, or None"""
+        state = self.predictions.get(prediction_id)
+        if state is None:
+            return None
+        now = time.time()
+        done = now >= state["ready_at"]
+        fraction = min((now - state["created"]) / max(state["ready_at"] - state["created"], 1e-6), 1)
+        status = "processing"
+        if state["canceled"]:
+            status = "canceled"
+        elif done:
+            status = "failed" if state["failed"] else "succeeded"
+        created = datetime.fromtimestamp(state["created"], timezone.utc).isoformat()
+        return {
+            "id": prediction_id,
+            "model": state["model"],
+            "version": "fake",
+            "status": status,
+            "input": state["input"],
+            # One URL per prediction, like the provider's delivery URLs
+            "output": f"{self.base_url}/videos/{prediction_id}.mp4" if status == "succeeded" else None,
+            # A tqdm-style bar, like models that report progress in their logs
+            "logs": f"{int(fraction * 100)}%|\n",
+            "error": "fake failure" if status == "failed" else None,
+            "metrics": {},
+            "created_at": created,
+            "started_at": created,
+            "completed_at": datetime.now(timezone.utc).isoformat() if done else None,
+            "urls": {
+                "get": f"{self.base_url}/v1/predictions/{prediction_id}",
+                "cancel": f"{self.base_url}/v1/predictions/{prediction_id}/cancel",
+            },
+        }
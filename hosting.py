@@ -0,0 +1,314 @@
+"""Image hosting backends
+
+The model fetches its first frame from a URL, so every prepared image has to
+be hosted somewhere first. Backends implement ImageHost and are registered by
+name; PipelineConfig.image_host picks one per deployment:
+
+- "imgbb": ImgBB upload API (default)
+- "replicate": Replicate's files API
+- "data-uri": image inlined in the prediction input
+- "s3": any S3-compatible bucket (needs boto3)
+- "local": built-in static file server, for benchmarks, tests and
+  deployments where the model provider can reach this machine
+"""
+import base64
+import functools
+import io
+import logging
+import os
+import uuid
+from http.server import SimpleHTTPRequestHandler
+
+import requests
+
+import metrics
+from pipeline import HostedImage, PERMANENT_HOST_TTL, PipelineError
+from servers import serve, shared_server
+
+logger = logging.getLogger(__name__)
+
+# Files uploaded through Replicate's files API are short-lived
+REPLICATE_FILE_TTL = 24 * 3600
+CHUNK_SIZE = 64 * 1024
+
+
+class MultipartBody:
+    """A multipart/form-data body streamed from its parts without joining them
+
+    requests sends file-like bodies in chunks with a Content-Length taken from
+    len(), so the image bytes are never base64-encoded or copied as a whole.
+    seek()/tell() let urllib3 rewind the body when it retries the upload.
+    """
+
+    def __init__(self, fields, file_field, filename, content_type, data, progress=None):
+        self._progress = progress
+        boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        self._chunks = []
+        for name, value in fields.items():
+            self._chunks.append(
+                f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode("utf-8")
+            )
+        self._chunks.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'.encode("utf-8")
+        )
+        self._chunks.append(memoryview(data))
+        self._chunks.append(f'\r\n--{boundary}--\r\n'.encode("utf-8"))
+        self._length = sum(len(chunk) for chunk in self._chunks)
+        self._pos = 0
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._length
+        self._pos = min(max(offset, 0), self._length)
+        return self._pos
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._length - self._pos
+        out = []
+        start = 0
+        for chunk in self._chunks:
+            end = start + len(chunk)
+            if size > 0 and self._pos < end:
+                piece = chunk[self._pos - start:self._pos - start + size]
+                out.append(bytes(piece))
+                self._pos += len(piece)
+                size -= len(piece)
+            start = end
+        if self._progress and out:
+            self._progress(self._pos, self._length)
+        return b"".join(out)
+
+
+class ImageHost:
+    """Interface of an image hosting backend"""
+
+    # Seconds an uploaded URL stays valid; None means uploads are not reused
+    lifetime = None
+    # Whether URLs should be checked for reachability before predicting; hosts
+    # that are read-after-write consistent or need credentials to read skip it
+    probe = True
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.config = pipeline.config
+
+    def upload(self, prepared, progress=None):
+        """Host a PreparedImage and return its HostedImage
+
+        Backends that stream the upload call progress(bytes_sent, total_bytes).
+        """
+        raise NotImplementedError
+
+
+IMAGE_HOSTS = {}
+
+
+def register_image_host(name):
+    """Class decorator adding an ImageHost to the registry under name"""
+    def decorator(cls):
+        IMAGE_HOSTS[name] = cls
+        return cls
+    return decorator
+
+
+def make_image_host(name, pipeline):
+    """Build the registered hosting backend called name for a Pipeline"""
+    if name not in IMAGE_HOSTS:
+        raise ValueError(f"Unknown image host: {name} (expected one of {', '.join(sorted(IMAGE_HOSTS))})")
+    return IMAGE_HOSTS[name](pipeline)
+
+
+@register_image_host("imgbb")
+class ImgBBHost(ImageHost):
+    """Uploads to ImgBB, as raw multipart bytes or as a base64 form field"""
+
+    def __init__(self, pipeline):
+        super().__init__(pipeline)
+        self.lifetime = self.config.imgbb_expiration or PERMANENT_HOST_TTL
+
+    def upload(self, prepared, progress=None):
+        if not self.config.imgbb_api_key:
+            raise PipelineError("host", "ImgBB API key not configured")
+
+        params = {'key': self.config.imgbb_api_key}
+        if self.config.imgbb_expiration:
+            params['expiration'] = self.config.imgbb_expiration
+        try:
+            if self.config.imgbb_upload_mode == "base64":
+                with metrics.span("base64"):
+                    data = {
+                        'image': base64.b64encode(prepared.data).decode('utf-8'),
+                        'name': 'uploaded_image'
+                    }
+                response = self.pipeline.http.post(self.config.imgbb_upload_url, params=params, data=data, timeout=self.config.upload_timeout)
+            else:
+                body = MultipartBody(
+                    {'name': 'uploaded_image'}, 'image', 'uploaded_image.jpg', prepared.mime_type, prepared.data,
+                    progress=progress,
+                )
+                response = self.pipeline.http.post(
+                    self.config.imgbb_upload_url, params=params, data=body,
+                    headers={'Content-Type': body.content_type},
+                    timeout=self.config.upload_timeout,
+                )
+        except requests.exceptions.RequestException as e:
+            raise PipelineError("host", f"Error uploading image: {e}") from e
+
+        if response.status_code == 403:
+            raise PipelineError("host", "403 Forbidden: Check if your ImgBB API key is valid and has upload permissions")
+        if response.status_code == 400:
+            raise PipelineError("host", f"400 Bad Request: Invalid image format or API key issue ({response.text})")
+        if response.status_code != 200:
+            raise PipelineError("host", f"Upload failed with status code: {response.status_code}")
+
+        result = response.json()
+        if not result.get('success'):
+            error_msg = result.get('error', {}).get('message', 'Unknown error')
+            raise PipelineError("host", f"ImgBB upload failed: {error_msg}")
+
+        image_url = result['data']['url']
+        display_url = result['data'].get('display_url', image_url)
+        logger.info("Image uploaded to %s", image_url)
+        # Reachability (with the display URL as fallback) is checked once, before predicting
+        return HostedImage(url=image_url, display_url=display_url, image_digest=prepared.digest, probe=self.probe)
+
+
+@register_image_host("replicate")
+class ReplicateFileHost(ImageHost):
+    """Uploads through Replicate's files API, so the model reads the image from Replicate itself"""
+
+    lifetime = REPLICATE_FILE_TTL
+    # Replicate file URLs need the API token, so they cannot be probed anonymously
+    probe = False
+
+    def upload(self, prepared, progress=None):
+        try:
+            uploaded = self.pipeline.client.files.create(
+                io.BytesIO(prepared.data),
+                filename="uploaded_image.jpg",
+                content_type=prepared.mime_type,
+            )
+        except PipelineError:
+            raise
+        except Exception as e:
+            raise PipelineError("host", f"Error uploading image to Replicate: {e}") from e
+        url = uploaded.urls["get"]
+        logger.info("Image uploaded to %s", url)
+        return HostedImage(url=url, image_digest=prepared.digest, probe=self.probe)
+
+
+@register_image_host("data-uri")
+class DataURIHost(ImageHost):
+    """Inlines the image in the prediction input as a data URI; best for small images"""
+
+    # Nothing is uploaded, so there is nothing worth remembering
+    lifetime = None
+    probe = False
+
+    def upload(self, prepared, progress=None):
+        with metrics.span("base64"):
+            encoded = base64.b64encode(prepared.data).decode("ascii")
+        return HostedImage(url=f"data:{prepared.mime_type};base64,{encoded}", image_digest=prepared.digest, probe=self.probe)
+
+
+@register_image_host("s3")
+class S3Host(ImageHost):
+    """Uploads to an S3-compatible bucket under a content-addressed key"""
+
+    # S3 is read-after-write consistent
+    probe = False
+
+    def __init__(self, pipeline):
+        super().__init__(pipeline)
+        config = self.config
+        if not config.s3_bucket:
+            raise PipelineError("host", "S3 bucket not configured")
+        try:
+            import boto3
+        except ImportError as e:
+            raise PipelineError("host", "S3 hosting needs boto3 (pip install boto3)") from e
+        self._s3 = boto3.client("s3", endpoint_url=config.s3_endpoint_url)
+        # Presigned URLs expire; public bucket URLs do not
+        self.lifetime = PERMANENT_HOST_TTL if config.s3_public_url else config.s3_url_ttl
+
+    def upload(self, prepared, progress=None):
+        key = f"{self.config.s3_prefix}{prepared.digest}.jpg"
+        try:
+            self._s3.put_object(
+                Bucket=self.config.s3_bucket, Key=key, Body=prepared.data, ContentType=prepared.mime_type,
+            )
+            if self.config.s3_public_url:
+                url = f"{self.config.s3_public_url.rstrip('/')}/{key}"
+            else:
+                url = self._s3.generate_presigned_url(
+                    "get_object",
+                    Params={"Bucket": self.config.s3_bucket, "Key": key},
+                    ExpiresIn=self.config.s3_url_ttl,
+                )
+        except Exception as e:
+            raise PipelineError("host", f"Error uploading image to S3: {e}") from e
+        logger.info("Image uploaded to s3://%s/%s", self.config.s3_bucket, key)
+        return HostedImage(url=url, image_digest=prepared.digest, probe=self.probe)
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        logger.debug("local host: " + format, *args)
+
+
+def serve_directory(directory, bind, port):
+    """Serve a directory over HTTP from a daemon thread, once per (bind, port); returns the server"""
+
+    def start():
+        handler = functools.partial(_QuietHandler, directory=os.path.abspath(directory))
+        server = serve(bind, port, handler, "local-image-host")
+        logger.info("Serving %s on http://%s:%d", directory, bind, server.server_port)
+        return server
+
+    return shared_server("local-image-host", bind, port, start)
+
+
+@register_image_host("local")
+class LocalHost(ImageHost):
+    """Writes images to a directory served by a built-in static file server"""
+
+    lifetime = PERMANENT_HOST_TTL
+    # Files are in place before upload() returns
+    probe = False
+
+    def __init__(self, pipeline):
+        super().__init__(pipeline)
+        config = self.config
+        os.makedirs(config.local_host_dir, exist_ok=True)
+        server = serve_directory(config.local_host_dir, config.local_host_bind, config.local_host_port)
+        self.base_url = (
+            config.local_host_public_url or f"http://{config.local_host_bind}:{server.server_port}"
+        ).rstrip("/")
+
+    def upload(self, prepared, progress=None):
+        filename = f"{prepared.digest}.jpg"
+        path = os.path.join(self.config.local_host_dir, filename)
+        if not os.path.exists(path):
+            tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(prepared.data)
+            os.replace(tmp, path)
+        return HostedImage(url=f"{self.base_url}/{filename}", image_digest=prepared.digest, probe=self.probe)
@@ -0,0 +1,91 @@
+"""Pooled HTTP session shared by the pipeline stages
+
+One requests.Session keeps TLS connections to ImgBB, S3, the local host and
+the video CDN alive between jobs. Each host gets a bounded connection pool,
+and 429/5xx answers and dropped connections are retried with jittered
+exponential backoff, honouring Retry-After. Provider APIs can be mounted
+with a RateLimiter, which queues requests under the provider's limits and
+retries 429s itself so every request to that provider backs off together.
+"""
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# HEAD is left out: URL checks run their own retry loop inside a time budget
+RETRY_METHODS = frozenset({"GET", "POST", "PUT", "DELETE", "OPTIONS"})
+
+
+class CountingRetry(Retry):
+    """Retry that counts each retried request in the metrics"""
+
+    def increment(self, *args, **kwargs):
+        new_retry = super().increment(*args, **kwargs)
+        metrics.RETRIES.inc(kind="http")
+        return new_retry
+
+
+def make_retry(retries, backoff, statuses=RETRY_STATUSES):
+    """urllib3 Retry policy for transient failures"""
+    options = dict(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        allowed_methods=RETRY_METHODS,
+        status_forcelist=statuses,
+        backoff_factor=backoff,
+        respect_retry_after_header=True,
+        # Hand the final 429/5xx response back to the caller instead of raising
+        raise_on_status=False,
+    )
+    try:
+        return CountingRetry(backoff_jitter=backoff, **options)
+    except TypeError:
+        # urllib3 < 2 has no jitter option
+        return CountingRetry(**options)
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    """HTTPAdapter sending every request through a RateLimiter"""
+
+    def __init__(self, limiter, **kwargs):
+        self.limiter = limiter
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        def attempt():
+            # Rewind a streamed body sent by an earlier, rate-limited attempt
+            if hasattr(request.body, "seek"):
+                request.body.seek(0)
+            return super(RateLimitedAdapter, self).send(request, **kwargs)
+
+        return self.limiter.send(attempt)
+
+
+def make_session(pool_size=10, retries=3, backoff=0.5, limits=None):
+    """requests.Session with per-host connection pools and retries
+
+    limits maps URL prefixes to the RateLimiter requests to them go through.
+    """
+    session = requests.Session()
+    options = dict(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        # Wait for a free connection instead of opening unpooled extras
+        pool_block=True,
+    )
+    adapter = HTTPAdapter(max_retries=make_retry(retries, backoff), **options)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    for prefix, limiter in (limits or {}).items():
+        # A limiter with a rate retries 429s itself, after pausing every request to the provider
+        statuses = tuple(status for status in RETRY_STATUSES if status != 429) if limiter.rate else RETRY_STATUSES
+        session.mount(prefix, RateLimitedAdapter(limiter, max_retries=make_retry(retries, backoff, statuses), **options))
+    return session
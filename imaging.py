@@ -0,0 +1,77 @@
+"""Image decoding, downscaling and JPEG encoding
+
+The model never renders above its own resolution (see models.py), so uploads
+are shrunk to that size before hosting: JPEGs are decoded at reduced scale with
+Image.draft, large integer factors are taken with reduce(), and only the
+last step uses a full resampling filter. The JPEG quality is then lowered
+step by step until the file fits a byte target.
+"""
+import io
+import time
+
+from PIL import Image, ImageOps
+
+QUALITY_STEP = 5
+
+
+def scaled_size(width, height, short_side):
+    """(width, height) with the short side at most short_side, keeping aspect ratio"""
+    scale = short_side / min(width, height)
+    if scale >= 1:
+        return width, height
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def open_scaled(data, short_side):
+    """Decode image bytes upright, as RGB, with the short side at most short_side"""
+    image = Image.open(io.BytesIO(data))
+    target = scaled_size(image.width, image.height, short_side)
+    if target != image.size:
+        # JPEG only: let libjpeg decode at 1/2, 1/4 or 1/8 scale, never below target
+        image.draft("RGB", target)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    factor = min(image.width // target[0], image.height // target[1])
+    if factor >= 2:
+        # Cheap box average by a whole factor, still no smaller than target
+        image = image.reduce(factor)
+    # The short side does not change when turning, so transposing last is safe
+    image = ImageOps.exif_transpose(image)
+    target = scaled_size(image.width, image.height, short_side)
+    if target != image.size:
+        image = image.resize(target, Image.LANCZOS)
+    return image
+
+
+def encode_jpeg(image, quality=95, target_bytes=None, min_quality=70):
+    """JPEG bytes at the highest quality (down to min_quality) that fits target_bytes"""
+    while True:
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=quality, optimize=True)
+        data = buffer.getvalue()
+        if not target_bytes or len(data) <= target_bytes or quality - QUALITY_STEP < min_quality:
+            return data, quality
+        quality -= QUALITY_STEP
+
+
+def prepare_jpeg(data, short_side, quality=95, target_bytes=None, min_quality=70):
+    """Scale and encode image bytes in one call, so it can run in a worker process
+
+    Returns (jpeg bytes, width, height, quality, timings), where timings holds
+    the seconds spent decoding and encoding.
+    """
+    began = time.perf_counter()
+    image = open_scaled(data, short_side)
+    decoded = time.perf_counter()
+    jpeg, quality = encode_jpeg(image, quality, target_bytes, min_quality)
+    timings = {"decode": decoded - began, "encode": time.perf_counter() - decoded}
+    return jpeg, image.width, image.height, quality, timings
+
+
+def make_thumbnail(data, max_side=1024, quality=85):
+    """Small JPEG preview of image bytes"""
+    image = Image.open(io.BytesIO(data))
+    image.draft("RGB", (max_side, max_side))
+    image = ImageOps.exif_transpose(image).convert("RGB")
+    image.thumbnail((max_side, max_side))
+    return encode_jpeg(image, quality=quality)[0]
@@ -0,0 +1,992 @@
+"""Persistent job queue and worker pool for video generation
+
+submit() stores the job in a SQLite queue and returns its id immediately.
+A bounded pool of worker threads claims queued jobs by priority, prepares and
+hosts the image and starts the prediction; a single poller thread then tracks
+every in-flight prediction, so a 2-5 minute render does not pin a thread.
+When the pipeline has webhooks on, predictions report back to its receiver
+instead and the poller only sweeps now and then for lost events.
+The number of predictions running at once is capped to stay under provider
+concurrency limits.
+
+Jobs survive a restart: uploaded images are spooled to disk, and jobs that
+were mid-render resume polling their existing prediction instead of
+starting a new one. Several processes (the app and a batch run) can share
+one jobs directory: each manager holds a lease on the jobs it claimed and
+renews it while it runs, and only takes over another manager's jobs once
+their lease has run out.
+
+Submissions are single-flight: a request identical to an unfinished job
+(same image bytes, prompt, seed and model settings) gets that job's id
+instead of a new job, so a double click or a second tab never pays for the
+same render twice. The check runs in the shared SQLite store, so it also
+covers a batch run and the app sharing one jobs directory.
+
+A job can be a draft: a short, cheap preview render that is claimed ahead
+of full renders and keeps its spooled image, so promote() can queue the
+full-quality render once the user approves the preview.
+
+Jobs can be stopped. Every caller that submits or attaches to a job counts
+as a watcher; release() drops one, and a job nobody watches any more is
+canceled, along with its prediction at the provider so it stops billing.
+Each active stage also has a deadline: a job stuck past it fails and its
+prediction is canceled the same way.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field, fields
+from typing import Optional
+
+import metrics
+from cache import link_or_copy
+from models import FAST, QUALITY
+from pipeline import PipelineError
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+PREPARING = "preparing"
+PREDICTING = "predicting"
+FETCHING = "fetching"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELED = "canceled"
+FINISHED_STATUSES = (SUCCEEDED, FAILED, CANCELED)
+ACTIVE_STATUSES = (PREPARING, PREDICTING, FETCHING)
+# Statuses a job passes through before it finishes, in order
+STAGES = (QUEUED, PREPARING, PREDICTING, FETCHING)
+# Stage durations remembered per stage for ETAs
+DURATION_HISTORY = 50
+# Minimum seconds between progress writes for one job
+PROGRESS_INTERVAL = 0.5
+# Span name recorded in metrics and traces for the time spent in each status
+STAGE_SPANS = {QUEUED: "queue_wait", PREPARING: "preparing", PREDICTING: "prediction", FETCHING: "fetching"}
+# Render tiers: a quick preview clip, or the full video
+DRAFT = "draft"
+FINAL = "final"
+# Previews are claimed before any full render; a full render queued next to
+# its preview waits behind interactive work but ahead of batches
+DRAFT_PRIORITY = 10
+BACKGROUND_PRIORITY = -5
+# Seconds a job may spend preparing or fetching before it fails; the predicting
+# deadline is the pipeline's prediction_timeout. Queue time is not limited
+STAGE_DEADLINES = {PREPARING: 5 * 60, FETCHING: 10 * 60}
+# Seconds a manager's claim on its active jobs lasts, and how often it renews it
+LEASE_SECONDS = 60
+LEASE_RENEW_INTERVAL = 15
+# Seconds the jobs of a UI session that went away keep running, so a reloaded page can rejoin them
+DISCONNECT_GRACE = 60
+# What a job is doing in each active stage, for timeout errors
+STAGE_ACTIVITIES = {PREPARING: "uploading the image", PREDICTING: "generating the video", FETCHING: "downloading the video"}
+
+
+@dataclass
+class Job:
+    """State of one generation job"""
+    id: str
+    prompt: str
+    status: str = QUEUED
+    # Higher priority jobs are claimed first
+    priority: int = 0
+    # Model seed, for variants that differ only by seed
+    seed: Optional[int] = None
+    # Model the job runs on, picked by the pipeline's router at submit; None is the configured model
+    model: Optional[str] = None
+    # DRAFT for a preview clip, FINAL (or None, for older jobs) for the full video
+    tier: Optional[str] = FINAL
+    # Jobs submitted together by submit_variants share one hosted image
+    group_id: Optional[str] = None
+    prediction_id: Optional[str] = None
+    video_url: Optional[str] = None
+    video_path: Optional[str] = None
+    video_filename: Optional[str] = None
+    # Id of the video in the pipeline's output store
+    artifact_id: Optional[str] = None
+    # Result cache key, set once the image is prepared
+    cache_key: Optional[str] = None
+    # Key of the submitted image bytes, prompt, seed and model settings; identical submissions share the job
+    request_key: Optional[str] = None
+    # Callers waiting on the job; once release() drops the last one the job is canceled
+    watchers: Optional[int] = 1
+    # Manager running the job while it is active, and until when its lease holds
+    owner: Optional[str] = None
+    lease_until: Optional[float] = None
+    error: Optional[str] = None
+    # Measured fraction of the current stage done (upload, render or download), when known
+    progress: Optional[float] = None
+    # When the job entered its current status
+    stage_started_at: Optional[float] = None
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+
+    @property
+    def done(self):
+        return self.status in FINISHED_STATUSES
+
+    @property
+    def draft(self):
+        return self.tier == DRAFT
+
+
+JOB_COLUMNS = [f.name for f in fields(Job)]
+
+
+class JobStore:
+    """SQLite table of jobs, safe to share between threads"""
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, prompt TEXT NOT NULL, status TEXT NOT NULL, "
+            "priority INTEGER NOT NULL DEFAULT 0, seed INTEGER, model TEXT, tier TEXT, group_id TEXT, prediction_id TEXT, video_url TEXT, "
+            "video_path TEXT, video_filename TEXT, artifact_id TEXT, cache_key TEXT, request_key TEXT, watchers INTEGER, owner TEXT, lease_until REAL, error TEXT, "
+            "progress REAL, stage_started_at REAL, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        # Add columns introduced after the table was first created
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for name in JOB_COLUMNS:
+            if name not in existing:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {name}")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, priority, created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_request_key ON jobs (request_key)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_prediction ON jobs (prediction_id)")
+        self._lock = threading.Lock()
+
+    def _row_to_job(self, row):
+        return Job(**dict(zip(JOB_COLUMNS, row))) if row else None
+
+    def _insert(self, job):
+        self._conn.execute(
+            f"INSERT INTO jobs ({', '.join(JOB_COLUMNS)}) VALUES ({', '.join('?' * len(JOB_COLUMNS))})",
+            [getattr(job, name) for name in JOB_COLUMNS],
+        )
+
+    def add(self, job):
+        with self._lock:
+            self._insert(job)
+
+    def add_unique(self, job):
+        """Insert a job unless an unfinished one has the same request_key; returns the id of the job to follow
+
+        An existing job is raised to the new job's priority, so an interactive
+        request is not left behind a batch item it attached to, and gains a
+        watcher.
+        """
+        placeholders = ', '.join('?' * len(FINISHED_STATUSES))
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    f"SELECT id FROM jobs WHERE request_key = ? AND status NOT IN ({placeholders}) "
+                    "ORDER BY created_at LIMIT 1",
+                    (job.request_key, *FINISHED_STATUSES),
+                ).fetchone()
+                if row:
+                    self._conn.execute(
+                        "UPDATE jobs SET priority = MAX(priority, ?), watchers = COALESCE(watchers, 1) + 1 WHERE id = ?",
+                        (job.priority, row[0]),
+                    )
+                else:
+                    self._insert(job)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return row[0] if row else job.id
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return self._row_to_job(row)
+
+    def update(self, job_id, expected_status=None, **changes):
+        """Change a job's fields; with expected_status, only while the job is in that status
+
+        Returns whether the job was changed.
+        """
+        changes["updated_at"] = time.time()
+        where, params = "id = ?", [job_id]
+        if expected_status is not None:
+            where, params = "id = ? AND status = ?", [job_id, expected_status]
+        with self._lock:
+            cursor = self._conn.execute(
+                f"UPDATE jobs SET {', '.join(f'{name} = ?' for name in changes)} WHERE {where}",
+                [*changes.values(), *params],
+            )
+        return cursor.rowcount > 0
+
+    def watch(self, job_id):
+        """Add a watcher to an unfinished job; returns the new count, or None if the job is unknown or finished"""
+        placeholders = ', '.join('?' * len(FINISHED_STATUSES))
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    f"UPDATE jobs SET watchers = COALESCE(watchers, 1) + 1 "
+                    f"WHERE id = ? AND status NOT IN ({placeholders})",
+                    (job_id, *FINISHED_STATUSES),
+                )
+                row = self._conn.execute(
+                    f"SELECT watchers FROM jobs WHERE id = ? AND status NOT IN ({placeholders})",
+                    (job_id, *FINISHED_STATUSES),
+                ).fetchone()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return row[0] if row else None
+
+    def unwatch(self, job_id, **changes):
+        """Take a watcher off an unfinished job, applying changes in the same transaction if it was the last one
+
+        Returns the job as it was before the changes if they were applied, else
+        None, so a watcher added meanwhile always keeps the job alive.
+        """
+        changes["updated_at"] = time.time()
+        placeholders = ', '.join('?' * len(FINISHED_STATUSES))
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                job = self._row_to_job(self._conn.execute(
+                    f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ? AND status NOT IN ({placeholders})",
+                    (job_id, *FINISHED_STATUSES),
+                ).fetchone())
+                watchers = max((1 if job is None or job.watchers is None else job.watchers) - 1, 0)
+                if job is not None and watchers:
+                    self._conn.execute("UPDATE jobs SET watchers = ? WHERE id = ?", (watchers, job_id))
+                elif job is not None:
+                    self._conn.execute(
+                        f"UPDATE jobs SET watchers = 0, {', '.join(f'{name} = ?' for name in changes)} WHERE id = ?",
+                        (*changes.values(), job_id),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return job if job is not None and not watchers else None
+
+    def by_prediction(self, prediction_id):
+        """Job waiting on a prediction id, or None"""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE prediction_id = ? ORDER BY created_at DESC LIMIT 1",
+                (prediction_id,),
+            ).fetchone()
+        return self._row_to_job(row)
+
+    def with_status(self, *statuses, owner=None):
+        """Jobs in any of the given statuses (and run by owner, if given), oldest first"""
+        where, params = f"status IN ({', '.join('?' * len(statuses))})", list(statuses)
+        if owner is not None:
+            where, params = f"{where} AND owner = ?", [*params, owner]
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE {where} ORDER BY created_at", params,
+            ).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def expired(self, now):
+        """Active jobs whose lease has run out (or that never had one), oldest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE status IN ({', '.join('?' * len(ACTIVE_STATUSES))}) "
+                "AND (lease_until IS NULL OR lease_until < ?) ORDER BY created_at",
+                (*ACTIVE_STATUSES, now),
+            ).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def renew(self, owner, lease_until):
+        """Extend the lease on every active job run by owner"""
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE jobs SET lease_until = ? WHERE owner = ? AND status IN ({', '.join('?' * len(ACTIVE_STATUSES))})",
+                (lease_until, owner, *ACTIVE_STATUSES),
+            )
+
+    def take_over(self, job_id, expected_status, now, **changes):
+        """Change a job still in expected_status whose lease ran out by now; returns whether it was changed"""
+        changes["updated_at"] = now
+        with self._lock:
+            cursor = self._conn.execute(
+                f"UPDATE jobs SET {', '.join(f'{name} = ?' for name in changes)} "
+                "WHERE id = ? AND status = ? AND (lease_until IS NULL OR lease_until < ?)",
+                [*changes.values(), job_id, expected_status, now],
+            )
+        return cursor.rowcount > 0
+
+    def count(self, *statuses):
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT COUNT(*) FROM jobs WHERE status IN ({', '.join('?' * len(statuses))})", statuses
+            ).fetchone()[0]
+
+    def claim_next(self, owner, lease_until):
+        """Atomically move the highest-priority queued job to PREPARING under owner's lease and return it"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id FROM jobs WHERE status = ? ORDER BY priority DESC, created_at LIMIT 1", (QUEUED,)
+                ).fetchone()
+                if row:
+                    now = time.time()
+                    self._conn.execute(
+                        "UPDATE jobs SET status = ?, owner = ?, lease_until = ?, stage_started_at = ?, updated_at = ? "
+                        "WHERE id = ?",
+                        (PREPARING, owner, lease_until, now, now, row[0]),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return self.get(row[0]) if row else None
+
+    def position(self, job_id):
+        """Number of queued jobs that will be claimed before this one (0 = next)"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM jobs j, jobs me WHERE me.id = ? AND j.status = ? AND j.id != me.id "
+                "AND (j.priority > me.priority OR (j.priority = me.priority AND j.created_at < me.created_at))",
+                (job_id, QUEUED),
+            ).fetchone()
+        return row[0]
+
+    def delete_finished(self, before):
+        """Remove finished jobs last updated before a timestamp; returns their ids"""
+        with self._lock:
+            placeholders = ', '.join('?' * len(FINISHED_STATUSES))
+            ids = [row[0] for row in self._conn.execute(
+                f"SELECT id FROM jobs WHERE status IN ({placeholders}) AND updated_at < ?",
+                (*FINISHED_STATUSES, before),
+            )]
+            self._conn.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in ids])
+        return ids
+
+
+class JobManager:
+    """Runs queued pipeline jobs on a bounded worker pool"""
+
+    def __init__(self, pipeline, root="jobs", max_workers=2, max_predictions=4, retention=24 * 3600, prepare_ahead=8,
+                 deadlines=None):
+        self.pipeline = pipeline
+        # Seconds a job may spend in each active stage; None or missing is unlimited
+        self.deadlines = {PREDICTING: pipeline.config.prediction_timeout, **STAGE_DEADLINES, **(deadlines or {})}
+        self.root = root
+        # Queued jobs whose image is prepared on the image pool before a worker claims them
+        self.prepare_ahead = prepare_ahead
+        self._preparing = {}
+        # group id -> (created time, Future of the group's HostedImage)
+        self._groups = {}
+        # Recent seconds spent in each stage, for progress estimates and ETAs
+        self._durations = {stage: deque(maxlen=DURATION_HISTORY) for stage in STAGES}
+        # Cap on jobs past the queue at once (preparing, predicting or fetching)
+        self.max_predictions = max_predictions
+        # Seconds a finished job stays queryable
+        self.retention = retention
+        self.inputs_dir = os.path.join(root, "inputs")
+        os.makedirs(self.inputs_dir, exist_ok=True)
+        # JSON timing trace of every finished job
+        self.traces_dir = os.path.join(root, "traces")
+        os.makedirs(self.traces_dir, exist_ok=True)
+        self._traces = {}
+        self.store = JobStore(os.path.join(root, "jobs.sqlite3"))
+        self._wakeup = threading.Condition()
+        self._poller = None
+        # Leases on claimed jobs are held in this manager's name
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        # Start the webhook receiver, if configured, before resuming predictions
+        pipeline.add_prediction_listener(self._on_webhook)
+        if pipeline.webhooks:
+            logger.info("Predictions report to %s", pipeline.webhook_url)
+        self._recover()
+        threading.Thread(target=self._lease_loop, name="job-leases", daemon=True).start()
+        self._workers = [
+            threading.Thread(target=self._work_loop, name=f"job-worker-{i}", daemon=True)
+            for i in range(max_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def _add(self, job):
+        """Store a job whose input is spooled, or attach to an identical unfinished one; returns the job id to follow"""
+        job_id = self.store.add_unique(job)
+        metrics.cache_lookup("inflight", job_id != job.id)
+        if job_id != job.id:
+            logger.info("Request attached to in-flight job %s", job_id)
+            os.remove(self._input_path(job.id))
+        return job_id
+
+    def submit(self, image, prompt, priority=0, sla=None, tier=FINAL):
+        """Queue a job for image bytes and a prompt; returns the job id
+
+        sla ("fast", "quality" or "cheap") lets the pipeline's router pick the
+        model, and tier=DRAFT renders a preview clip; that raises ValueError
+        when no model has a preview setting. An identical request that is
+        still queued or running is not queued again: its job id is returned
+        instead.
+        """
+        model = self.pipeline.pick_model(sla, draft=tier == DRAFT)
+        if model is None:
+            raise ValueError("None of the configured models can render a cheaper preview")
+        # Keyed like the result cache, but on the bytes as submitted since nothing is prepared yet
+        request_key = self.pipeline.result_key(
+            hashlib.sha256(image).hexdigest(), prompt, model=model, draft=tier == DRAFT,
+        )
+        job = Job(
+            id=uuid.uuid4().hex, prompt=prompt, priority=priority, model=model, tier=tier, request_key=request_key,
+        )
+        with open(self._input_path(job.id), "wb") as f:
+            f.write(image)
+        job_id = self._add(job)
+        if job_id != job.id:
+            return job_id
+        # Start decoding right away so a burst of uploads is prepared in parallel, if this manager runs them
+        if self._workers and len(self._preparing) < self.prepare_ahead and self.pipeline.cached_hosted_image(image, model, record=False) is None:
+            with metrics.tracing(self._trace(job.id)):
+                self._preparing[job.id] = self.pipeline.prepare_image_async(image, model)
+        self._prune()
+        self._notify()
+        return job.id
+
+    def submit_draft(self, image, prompt, final=False):
+        """Queue a preview render ahead of full renders; returns (draft id, final id)
+
+        With final, the full-quality render is queued at the same time at
+        BACKGROUND_PRIORITY; otherwise the final id is None and promote()
+        starts it once the preview is approved.
+        """
+        draft_id = self.submit(image, prompt, priority=DRAFT_PRIORITY, sla=FAST, tier=DRAFT)
+        final_id = self.submit(image, prompt, priority=BACKGROUND_PRIORITY, sla=QUALITY) if final else None
+        return draft_id, final_id
+
+    def promote(self, draft_id, priority=0, sla=QUALITY):
+        """Queue the full-quality render of a draft's image and prompt; returns its job id
+
+        Returns None when the draft is unknown or its image was pruned.
+        """
+        draft = self.store.get(draft_id)
+        if draft is None:
+            return None
+        try:
+            with open(self._input_path(draft_id), "rb") as f:
+                image = f.read()
+        except FileNotFoundError:
+            return None
+        return self.submit(image, draft.prompt, priority, sla)
+
+    def submit_variants(self, image, variants, priority=0, sla=None):
+        """Queue one job per (prompt, seed) pair for the same image bytes; returns the job ids
+
+        The image is prepared and hosted once for the whole group, and the
+        predictions then run side by side up to max_predictions. Variants
+        identical to an unfinished job get that job's id, as with submit().
+        Raises ValueError for no variants, or an unknown sla.
+        """
+        variants = list(variants)
+        if not variants:
+            raise ValueError("No variants to render")
+        # One model for the whole group, so the hosted image fits every variant
+        model = self.pipeline.pick_model(sla)
+        if model is None:
+            raise ValueError(f"No configured model can render variants for SLA {sla}")
+        group_id = uuid.uuid4().hex
+        digest = hashlib.sha256(image).hexdigest()
+        jobs = [
+            Job(
+                id=uuid.uuid4().hex, prompt=prompt, seed=seed, priority=priority, model=model, group_id=group_id,
+                request_key=self.pipeline.result_key(digest, prompt, seed, model),
+            )
+            for prompt, seed in variants
+        ]
+        first = self._input_path(jobs[0].id)
+        with open(first, "wb") as f:
+            f.write(image)
+        for job in jobs[1:]:
+            link_or_copy(first, self._input_path(job.id))
+        job_ids = [self._add(job) for job in jobs]
+        self._prune()
+        self._notify()
+        return job_ids
+
+    def watch(self, job_id):
+        """Count one more caller waiting on an unfinished job, such as a reloaded page following it again
+
+        Returns False if the job is unknown or already finished.
+        """
+        return self.store.watch(job_id) is not None
+
+    def release(self, job_id):
+        """Stop waiting on a job; the job is canceled once nobody waits on it. Returns whether it was canceled"""
+        job = self.store.unwatch(job_id, status=CANCELED, error="Canceled")
+        if job is None:
+            return False
+        self._finished(job_id, CANCELED)
+        self._stop(job, "Canceled")
+        return True
+
+    def cancel(self, job_id, error="Canceled", status=CANCELED, expected_status=None):
+        """Stop an unfinished job in whatever stage it is (or only in expected_status); returns whether it stopped
+
+        A running prediction is canceled at the provider. A worker still
+        creating one cancels it as soon as it has the id, and a download in
+        progress is discarded when it completes.
+        """
+        job = self.store.get(job_id)
+        if job is None or job.done or expected_status not in (None, job.status):
+            return False
+        if not self._finish(job_id, job.status, status=status, error=error):
+            # The job moved to another stage meanwhile
+            return expected_status is None and self.cancel(job_id, error, status)
+        self._stop(job, error)
+        return True
+
+    def _stop(self, job, error):
+        """Stop the work of a job that was just finished while in job.status"""
+        if job.status == PREDICTING:
+            self.pipeline.cancel_prediction(job.prediction_id)
+        logger.info("Job %s stopped while %s: %s", job.id, job.status, error)
+
+    def get(self, job_id):
+        """Current state of a job, or None if it is unknown or expired"""
+        return self.store.get(job_id)
+
+    def position(self, job_id):
+        """Place of a queued job in the queue (0 = next to run)"""
+        return self.store.position(job_id)
+
+    def stage_progress(self, job):
+        """Fraction of the job's current stage done: measured when possible, else estimated from recent jobs"""
+        if job.progress is not None:
+            return job.progress
+        typical = self._typical(job.status)
+        if not typical:
+            return 0.0
+        # Never claim a stage is finished on an estimate alone
+        return min(self._elapsed(job) / typical, 0.95)
+
+    def eta(self, job):
+        """Estimated seconds until a job finishes, from recent stage durations; None without enough history"""
+        if job.done:
+            return 0.0
+        later = STAGES[STAGES.index(job.status) + 1:]
+        typical = [self._typical(stage) for stage in later]
+        if None in typical:
+            return None
+        elapsed = self._elapsed(job)
+        if job.progress:
+            # Extrapolate from the measured rate of this stage
+            remaining = elapsed * (1 - job.progress) / job.progress
+        elif self._typical(job.status) is not None:
+            remaining = max(self._typical(job.status) - elapsed, 0)
+        else:
+            return None
+        return remaining + sum(typical)
+
+    def _typical(self, stage):
+        durations = self._durations.get(stage)
+        if not durations:
+            return None
+        return sorted(durations)[len(durations) // 2]
+
+    def _elapsed(self, job):
+        return time.time() - (job.stage_started_at or job.created_at)
+
+    def trace(self, job_id):
+        """Timing spans of a job as a dict, or None for unknown or pruned jobs"""
+        trace = self._traces.get(job_id)
+        if trace is not None:
+            return trace.to_dict()
+        try:
+            path = self._trace_path(job_id)
+        except ValueError:
+            return None
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _trace_path(self, job_id):
+        # Ids come from the metrics endpoint's URL, so only accept the hex ids jobs get
+        if not re.fullmatch(r"[0-9a-f]{32}", job_id):
+            raise ValueError(f"Invalid job id: {job_id}")
+        return os.path.join(self.traces_dir, f"{job_id}.json")
+
+    def _trace(self, job_id):
+        """In-memory Trace collecting a running job's spans"""
+        return self._traces.setdefault(job_id, metrics.Trace(job_id))
+
+    def _stage_done(self, job, now, status=None):
+        """Remember how long a job spent in its current stage (or status)"""
+        status = status or job.status
+        started = job.stage_started_at if status == job.status and job.stage_started_at else job.created_at
+        self._durations[status].append(now - started)
+        metrics.record(STAGE_SPANS[status], now - started, start=started, trace=self._trace(job.id))
+
+    def _advance(self, job, status, **changes):
+        """Move a job to its next stage, remembering how long the current one took
+
+        Returns False, changing nothing, if the job already left the status it
+        had when read (say, a webhook and the poller both saw it finish).
+        """
+        now = time.time()
+        if not self.store.update(
+            job.id, expected_status=job.status, status=status, stage_started_at=now, progress=None, **changes,
+        ):
+            return False
+        self._stage_done(job, now)
+        return True
+
+    def _progress_callback(self, job_id):
+        """progress(done, total) callback that records a job's stage progress, at most every PROGRESS_INTERVAL"""
+        last = 0
+
+        def progress(done, total):
+            nonlocal last
+            now = time.monotonic()
+            if total and (now - last >= PROGRESS_INTERVAL or done >= total):
+                last = now
+                self.store.update(job_id, progress=done / total)
+
+        return progress
+
+    def _input_path(self, job_id):
+        return os.path.join(self.inputs_dir, job_id)
+
+    def _notify(self):
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    def _finish(self, job_id, expected_status=None, **changes):
+        """Record a job's outcome; returns False if it had left expected_status (say, it was canceled)"""
+        if not self.store.update(job_id, expected_status, **changes):
+            return False
+        self._finished(job_id, changes["status"])
+        return True
+
+    def _finished(self, job_id, status):
+        """Clean up after a job that just reached a finished status"""
+        self._drop_preparing(job_id)
+        # A draft's image stays spooled for promote() until the job is pruned
+        if not self.store.get(job_id).draft:
+            self._remove_input(job_id)
+        metrics.JOBS.inc(status=status)
+        trace = self._traces.pop(job_id, None)
+        if trace is not None:
+            try:
+                trace.save(self._trace_path(job_id))
+            except OSError:
+                logger.exception("Could not save trace of job %s", job_id)
+        self._notify()
+
+    def _fail(self, job_id, error, stage="job", expected_status=None):
+        metrics.FAILURES.inc(stage=stage)
+        self._finish(job_id, expected_status, status=FAILED, error=error)
+
+    def _remove_input(self, job_id):
+        try:
+            os.remove(self._input_path(job_id))
+        except FileNotFoundError:
+            pass
+
+    def _prune(self):
+        # Videos are left to the output store's own eviction
+        before = time.time() - self.retention
+        for job_id in self.store.delete_finished(before):
+            self._remove_input(job_id)
+            try:
+                os.remove(self._trace_path(job_id))
+            except FileNotFoundError:
+                pass
+            logger.info("Pruned job %s", job_id)
+        with self._wakeup:
+            for group_id, (created, _) in list(self._groups.items()):
+                if created < before:
+                    del self._groups[group_id]
+        # Another manager may have claimed or finished a job prepared here
+        for job_id in list(self._preparing):
+            job = self.store.get(job_id)
+            if job is None or job.done or (job.status != QUEUED and job.owner != self.owner):
+                self._drop_preparing(job_id)
+
+    def _drop_preparing(self, job_id):
+        """Forget (and stop, if it has not started) the prepare-ahead of a job"""
+        preparing = self._preparing.pop(job_id, None)
+        if preparing is not None:
+            preparing.cancel()
+
+    def _recover(self):
+        """Requeue or resume jobs whose manager stopped renewing their lease (a stopped process)"""
+        now = time.time()
+        requeued = resumed = False
+        for job in self.store.expired(now):
+            if job.status == PREPARING:
+                # No prediction was recorded yet, so it is safe to start over
+                taken = self.store.take_over(job.id, PREPARING, now, status=QUEUED, owner=None, lease_until=None)
+                requeued = requeued or taken
+            else:
+                # Poll the prediction again; a lost download restarts from its output URL
+                taken = self.store.take_over(
+                    job.id, job.status, now, status=PREDICTING, owner=self.owner, lease_until=now + LEASE_SECONDS,
+                )
+                resumed = resumed or taken
+            if taken:
+                logger.info("Took over job %s from %s", job.id, job.owner or "a stopped process")
+        if requeued:
+            self._notify()
+        if resumed:
+            self._ensure_poller()
+
+    def _lease_loop(self):
+        """Keep this manager's active jobs leased, and take over jobs whose lease ran out"""
+        while True:
+            time.sleep(LEASE_RENEW_INTERVAL)
+            try:
+                self.store.renew(self.owner, time.time() + LEASE_SECONDS)
+                self._recover()
+            except Exception:
+                logger.exception("Could not renew job leases")
+
+    def _claim(self):
+        """Wait for a queued job while there is spare prediction capacity"""
+        with self._wakeup:
+            while True:
+                if self.store.count(*ACTIVE_STATUSES) < self.max_predictions:
+                    job = self.store.claim_next(self.owner, time.time() + LEASE_SECONDS)
+                    if job:
+                        return job
+                self._wakeup.wait(timeout=5)
+
+    def _work_loop(self):
+        while True:
+            job = self._claim()
+            try:
+                with metrics.tracing(self._trace(job.id)):
+                    self._start(job)
+            except Exception as e:
+                logger.exception("Job %s failed", job.id)
+                self._fail(job.id, f"Unexpected error: {e}", expected_status=PREPARING)
+
+    def _start(self, job):
+        """Prepare and host the image, then hand the prediction to the poller"""
+        # The poller also enforces the preparing deadline
+        self._ensure_poller()
+        image = self._input_path(job.id)
+        # The queue wait ended when the job was claimed
+        self._stage_done(job, job.stage_started_at, QUEUED)
+        progress = self._progress_callback(job.id)
+        try:
+            if job.group_id:
+                hosted, prepared = self._group_image(job.group_id, image, progress, job.model), None
+            else:
+                # Reuse an earlier upload of the same image when its link is still valid
+                hosted = self.pipeline.cached_hosted_image(image, job.model)
+                preparing = self._preparing.pop(job.id, None)
+                if hosted:
+                    prepared = None
+                else:
+                    prepared = (preparing or self.pipeline.prepare_image_async(image, job.model)).result()
+            cache_key = self.pipeline.result_key(
+                hosted.image_digest if hosted else prepared.digest, job.prompt, job.seed, job.model, job.draft,
+            )
+            if self._finish_from_cache(job, cache_key):
+                return
+            hosted = hosted or self.pipeline.host_image(prepared, progress)
+            if self.store.get(job.id).status != PREPARING:
+                # Canceled or timed out while the image was being prepared
+                return
+            prediction_id = self.pipeline.start_prediction(hosted, job.prompt, job.seed, job.model, job.draft)
+        except PipelineError as e:
+            self._fail(job.id, str(e), e.stage, expected_status=PREPARING)
+            return
+        if not self._advance(job, PREDICTING, prediction_id=prediction_id, cache_key=cache_key):
+            # Canceled while the prediction was being created
+            self.pipeline.cancel_prediction(prediction_id)
+
+    def _group_image(self, group_id, image, progress=None, model=None):
+        """HostedImage shared by a variant group; the first job to get here hosts it, the rest wait"""
+        with self._wakeup:
+            entry = self._groups.get(group_id)
+            first = entry is None
+            if first:
+                entry = self._groups[group_id] = (time.time(), Future())
+        hosted = entry[1]
+        if first:
+            try:
+                hosted.set_result(self.pipeline.host(image, progress, model))
+            except Exception as e:
+                hosted.set_exception(e)
+        return hosted.result()
+
+    def _finish_from_cache(self, job, cache_key):
+        """Complete a job from the result cache; returns False on a miss"""
+        video = self.pipeline.store_cached_video(cache_key)
+        if video is None:
+            return False
+        logger.info("Job %s answered from the result cache", job.id)
+        self._finish_video(job.id, video, PREPARING, cache_key=cache_key)
+        return True
+
+    def _finish_video(self, job_id, video, expected_status, **changes):
+        return self._finish(
+            job_id, expected_status, status=SUCCEEDED, video_path=video.path, video_filename=video.filename,
+            artifact_id=video.artifact_id, **changes,
+        )
+
+    def _traced_fetch(self, job_id, result):
+        with metrics.tracing(self._trace(job_id)):
+            self._fetch(job_id, result)
+
+    def _fetch(self, job_id, result):
+        try:
+            video = self.pipeline.fetch_result(result, self._progress_callback(job_id))
+            job = self.store.get(job_id)
+            if self.pipeline.result_cache and job.cache_key:
+                self.pipeline.result_cache.put(job.cache_key, video.path)
+        except PipelineError as e:
+            self._fail(job_id, str(e), e.stage, expected_status=FETCHING)
+            return
+        except Exception as e:
+            logger.exception("Job %s failed", job_id)
+            self._fail(job_id, f"Unexpected error: {e}", expected_status=FETCHING)
+            return
+        if job.status == FETCHING:
+            self._stage_done(job, time.time())
+        self._finish_video(job_id, video, FETCHING)
+
+    def _ensure_poller(self):
+        with self._wakeup:
+            if self._poller is None or not self._poller.is_alive():
+                self._poller = threading.Thread(target=self._poll_loop, name="job-poller", daemon=True)
+                self._poller.start()
+
+    def _poll_loop(self):
+        """Check this manager's predicting jobs, and its active jobs' deadlines, until none are left"""
+        while True:
+            with self._wakeup:
+                active = self.store.with_status(*ACTIVE_STATUSES, owner=self.owner)
+                if not active:
+                    self._poller = None
+                    return
+            for job in active:
+                if self._expired(job):
+                    self._time_out(job)
+                    continue
+                if job.status != PREDICTING:
+                    continue
+                try:
+                    status = self.pipeline.prediction_status(job.prediction_id)
+                except PipelineError as e:
+                    # Usually a blip; the stage deadline cancels a job whose status stays out of reach
+                    logger.warning("Could not check job %s, will retry: %s", job.id, e)
+                    metrics.RETRIES.inc(kind="status")
+                    continue
+                self._on_status(job, status)
+            time.sleep(self.pipeline.status_poll_interval)
+
+    def _expired(self, job):
+        limit = self.deadlines.get(job.status)
+        return bool(limit) and self._elapsed(job) > limit
+
+    def _time_out(self, job):
+        """Fail a job that overran its stage deadline, canceling its prediction"""
+        limit = self.deadlines[job.status]
+        logger.warning("Job %s spent over %g s %s", job.id, limit, STAGE_ACTIVITIES[job.status])
+        error = f"Timed out after {limit / 60:g} minutes {STAGE_ACTIVITIES[job.status]}"
+        if self.cancel(job.id, error, FAILED, expected_status=job.status):
+            metrics.FAILURES.inc(stage="timeout")
+
+    def _on_webhook(self, status):
+        job = self.store.by_prediction(status.prediction_id)
+        if job is not None and job.status == PREDICTING and job.owner == self.owner:
+            self._on_status(job, status)
+
+    def _on_status(self, job, status):
+        """Apply a predicting job's latest PredictionStatus, from the poller or a webhook"""
+        if not status.done:
+            if status.progress is not None and status.progress != job.progress:
+                self.store.update(job.id, expected_status=PREDICTING, progress=status.progress)
+            return
+        try:
+            result = status.result()
+        except PipelineError as e:
+            self._fail(job.id, str(e), e.stage, expected_status=PREDICTING)
+            return
+        if self._advance(job, FETCHING, video_url=result.video_url):
+            threading.Thread(target=self._traced_fetch, args=(job.id, result), daemon=True).start()
+
+
+class SessionJobs:
+    """Jobs each UI session waits on, released some time after the session goes away
+
+    The grace period lets a reloaded page, which runs as a new session, watch
+    its jobs again before the old session lets go of them.
+    """
+
+    def __init__(self, manager, grace=DISCONNECT_GRACE):
+        self.manager = manager
+        self.grace = grace
+        # session id -> ids of the jobs it watches, once per watch
+        self._jobs = {}
+        # session id -> (time it went away, job ids)
+        self._ended = {}
+        self._lock = threading.Lock()
+
+    def follow(self, session_id, job_id):
+        """Record a watch the session already holds, such as the job id submit() returned"""
+        with self._lock:
+            self._jobs.setdefault(session_id, []).append(job_id)
+
+    def rejoin(self, session_id, job_id):
+        """Watch an unfinished job again, say after a page reload; returns False if it has finished"""
+        if not self.manager.watch(job_id):
+            return False
+        self.follow(session_id, job_id)
+        return True
+
+    def release(self, session_id, job_id):
+        """Stop the session waiting on a job; returns whether that canceled the job"""
+        with self._lock:
+            jobs = self._jobs.get(session_id, [])
+            if job_id not in jobs:
+                return False
+            jobs.remove(job_id)
+        return self.manager.release(job_id)
+
+    def touch(self, session_id):
+        """Record that a session is still around, taking back its jobs if it was ended"""
+        with self._lock:
+            if session_id in self._ended:
+                _, jobs = self._ended.pop(session_id)
+                self._jobs.setdefault(session_id, []).extend(jobs)
+
+    def end(self, session_id):
+        """Schedule the release of a session's jobs after the grace period"""
+        with self._lock:
+            jobs = self._jobs.pop(session_id, None)
+            if jobs:
+                self._ended[session_id] = (time.time(), jobs)
+
+    def release_ended(self):
+        """Release the jobs of sessions that ended more than grace seconds ago"""
+        cutoff = time.time() - self.grace
+        with self._lock:
+            expired = [session_id for session_id, (ended, _) in self._ended.items() if ended < cutoff]
+            jobs = [job_id for session_id in expired for job_id in self._ended.pop(session_id)[1]]
+        for job_id in jobs:
+            if self.manager.release(job_id):
+                logger.info("Canceled job %s, nobody is waiting for it any more", job_id)
@@ -0,0 +1,92 @@
+"""Shared media cache for the UI sessions
+
+Sessions keep only lightweight references (artifact id, path, thumbnail)
+in their state. Video bytes are loaded lazily into one process-wide LRU with
+a global memory cap, and SessionRegistry drops a session's references when
+the session ends or goes idle, so its media can be evicted.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class MediaCache:
+    """Process-wide LRU of media bytes under a global memory cap"""
+
+    def __init__(self, max_bytes=256 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        """Bytes for key, calling loader() to read them on a miss"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        data = loader()
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = data
+                self._size += len(data)
+                self._shrink()
+        return data
+
+    def discard(self, key):
+        with self._lock:
+            data = self._entries.pop(key, None)
+            if data is not None:
+                self._size -= len(data)
+
+    def _shrink(self):
+        # Always keep the newest entry, even if it alone is over the cap
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            _, data = self._entries.popitem(last=False)
+            self._size -= len(data)
+
+
+class SessionRegistry:
+    """Tracks which cached media each session uses and releases it when the session is gone"""
+
+    def __init__(self, cache, idle_timeout=30 * 60):
+        self.cache = cache
+        self.idle_timeout = idle_timeout
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def touch(self, session_id, *keys):
+        """Record that a session is alive and currently shows keys"""
+        with self._lock:
+            _, previous = self._sessions.get(session_id, (0, set()))
+            self._sessions[session_id] = (time.time(), set(keys))
+            unused = previous - set(keys) - self._in_use()
+        for key in unused:
+            self.cache.discard(key)
+
+    def release(self, session_id):
+        """Forget a session and discard media no other session shows"""
+        with self._lock:
+            _, used = self._sessions.pop(session_id, (0, set()))
+            unused = used - self._in_use()
+        for key in unused:
+            self.cache.discard(key)
+
+    def _in_use(self):
+        return set().union(*(keys for _, keys in self._sessions.values()))
+
+    def reap(self, is_active=None):
+        """Release sessions idle past idle_timeout or reported inactive; returns their ids"""
+        cutoff = time.time() - self.idle_timeout
+        with self._lock:
+            gone = [
+                session_id for session_id, (last_seen, _) in self._sessions.items()
+                if last_seen < cutoff or (is_active is not None and not is_active(session_id))
+            ]
+        for session_id in gone:
+            logger.info("Releasing media for session %s", session_id)
+            self.release(session_id)
+        return gone
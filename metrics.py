@@ -0,0 +1,254 @@
+"""Timing spans, Prometheus-style metrics and per-job traces
+
+Stages are timed with span() (or record() for durations measured
+elsewhere, such as in a worker process). Every span feeds the
+image2video_stage_seconds histogram, and when a Trace is active for the
+current job (see tracing()) it is also appended to that job's trace, which
+the job manager writes out as JSON when the job finishes.
+
+serve_metrics() exposes the registry in the Prometheus text format on
+/metrics, and job traces on /traces/<job id>.
+"""
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler
+
+from servers import serve, shared_server
+
+logger = logging.getLogger(__name__)
+
+# Seconds; covers sub-millisecond cache lookups up to a slow 10 minute render
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels.get(name, "") for name in self.labels), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labels, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels"""
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # labels -> [bucket counts..., sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            state = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labels + ("le",)
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, state):
+                    lines.append(f"{self.name}_bucket{_label_text(names, key + (bound,))} {count}")
+                lines.append(f"{self.name}_bucket{_label_text(names, key + ('+Inf',))} {state[-1]}")
+                lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {state[-2]}")
+                lines.append(f"{self.name}_count{_label_text(self.labels, key)} {state[-1]}")
+        return lines
+
+
+class Registry:
+    """Set of metrics rendered together"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Prometheus text exposition of every metric"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram(
+    "image2video_stage_seconds", "Time spent in each pipeline stage", labels=("stage",),
+)
+CACHE_LOOKUPS = REGISTRY.counter(
+    "image2video_cache_lookups_total", "Cache lookups by cache and result", labels=("cache", "result"),
+)
+RETRIES = REGISTRY.counter(
+    "image2video_retries_total", "Retried requests and resumed downloads", labels=("kind",),
+)
+FAILURES = REGISTRY.counter(
+    "image2video_failures_total", "Failed jobs by the stage that failed", labels=("stage",),
+)
+JOBS = REGISTRY.counter(
+    "image2video_jobs_total", "Finished jobs by outcome", labels=("status",),
+)
+RATE_LIMIT_WAIT = REGISTRY.histogram(
+    "image2video_rate_limit_wait_seconds", "Time requests queued for the client-side rate limiter", labels=("provider",),
+)
+MODEL_SECONDS = REGISTRY.histogram(
+    "image2video_model_seconds", "Seconds from creation to completion of successful predictions", labels=("model",),
+)
+MODEL_COST = REGISTRY.counter(
+    "image2video_model_cost_usd_total", "Estimated spend on successful predictions", labels=("model",),
+)
+
+
+def cache_lookup(cache, hit):
+    """Count a cache hit or miss"""
+    CACHE_LOOKUPS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+class Trace:
+    """Timing spans of one job"""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, stage, start, duration, **attrs):
+        with self._lock:
+            self.spans.append({"stage": stage, "start": start, "duration": duration, **attrs})
+
+    def to_dict(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span["start"])
+        return {"job_id": self.job_id, "spans": spans}
+
+    def save(self, path):
+        """Write the trace as JSON, atomically"""
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(tmp, path)
+
+
+_current_trace = contextvars.ContextVar("trace", default=None)
+
+
+def current_trace():
+    """Trace of the job running in this context, or None"""
+    return _current_trace.get()
+
+
+@contextmanager
+def tracing(trace):
+    """Attach spans recorded in this context to trace"""
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+def record(stage, duration, start=None, trace=None, **attrs):
+    """Record a duration measured elsewhere for stage"""
+    STAGE_SECONDS.observe(duration, stage=stage)
+    trace = trace or current_trace()
+    if trace is not None:
+        trace.add(stage, start if start is not None else time.time() - duration, duration, **attrs)
+
+
+@contextmanager
+def span(stage, **attrs):
+    """Time the enclosed block as stage"""
+    start = time.time()
+    began = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        attrs["error"] = type(e).__name__
+        raise
+    finally:
+        record(stage, time.perf_counter() - began, start=start, **attrs)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    traces = None
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            self._send(200, REGISTRY.render(), "text/plain; version=0.0.4")
+        elif self.path.startswith("/traces/") and self.traces:
+            trace = self.traces(self.path[len("/traces/"):])
+            if trace is None:
+                self._send(404, "unknown job\n", "text/plain")
+            else:
+                self._send(200, json.dumps(trace, indent=2), "application/json")
+        else:
+            self._send(404, "not found\n", "text/plain")
+
+    def _send(self, status, body, content_type):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug("metrics: " + format, *args)
+
+
+def serve_metrics(bind="127.0.0.1", port=9100, traces=None):
+    """Serve /metrics (and /traces/<job id> when traces is given) from a daemon thread, once per (bind, port)"""
+
+    def start():
+        handler = type("MetricsHandler", (_MetricsHandler,), {"traces": staticmethod(traces) if traces else None})
+        server = serve(bind, port, handler, "metrics")
+        logger.info("Serving metrics on http://%s:%d/metrics", bind, server.server_port)
+        return server
+
+    return shared_server("metrics", bind, port, start)
@@ -0,0 +1,188 @@
+"""Video model registry and SLA-aware routing
+
+Every model the pipeline can run is described by a ModelSpec: the input
+field its first frame goes in, the extra inputs it accepts, how to read the
+video URL from its output, the resolution it renders at and its list price.
+Models missing from the registry get a generic spec, so any model id still
+works as PipelineConfig.model.
+
+ModelStats keeps the render latency and cost observed for each model, and a
+Router picks a model per job from an SLA hint:
+
+- "fast": lowest typical latency, for interactive previews
+- "quality": highest resolution, the fastest of those on a tie
+- "cheap": lowest typical cost per video, for batch work
+
+Observed numbers replace the list values as soon as a model has finished
+its first prediction.
+"""
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "minimax/hailuo-02-fast"
+FAST = "fast"
+QUALITY = "quality"
+CHEAP = "cheap"
+SLAS = (FAST, QUALITY, CHEAP)
+# Predictions remembered per model for latency and cost stats
+STATS_HISTORY = 50
+
+
+def output_url(output):
+    """Normalize a Replicate model output (URL, FileOutput or list of either) to a URL string"""
+    if isinstance(output, (list, tuple)):
+        output = output[0] if output else None
+    if output is None:
+        return None
+    return getattr(output, "url", None) or str(output)
+
+
+@dataclass
+class ModelSpec:
+    """How to call one video model, and what it is expected to cost"""
+    id: str
+    # Input field the hosted first frame URL goes in
+    image_field: str = "first_frame_image"
+    # Extra inputs the model takes besides the prompt and image, seed included;
+    # others are dropped from PipelineConfig.model_input. None passes everything through
+    accepts: Optional[Tuple[str, ...]] = None
+    # Inputs sent unless model_input overrides them
+    defaults: Dict[str, Any] = field(default_factory=dict)
+    # Inputs that turn a render into a clearly cheaper preview clip; empty
+    # when the model has no setting below its default, so it renders no previews
+    draft_input: Dict[str, Any] = field(default_factory=dict)
+    # Turns the prediction output into the video URL
+    parse_output: Callable[[Any], Optional[str]] = output_url
+    # Short side, in pixels, of the frames the model renders
+    resolution: int = 1080
+    # List price in USD per video plus per second of compute, and the typical
+    # seconds from creation to completion, used until stats are observed
+    cost_per_video: float = 0.0
+    cost_per_second: float = 0.0
+    latency: float = 180
+
+    def build_input(self, image_url, prompt, seed=None, extra=None):
+        """Prediction input for a hosted image and prompt; the seed is dropped like any input the model does not accept"""
+        extra = {**self.defaults, **(extra or {})}
+        if seed is not None:
+            extra["seed"] = seed
+        if self.accepts is not None:
+            dropped = sorted(set(extra) - set(self.accepts))
+            if dropped:
+                logger.debug("Dropping inputs %s not accepted by %s", ", ".join(dropped), self.id)
+            extra = {name: value for name, value in extra.items() if name in self.accepts}
+        return {**extra, "prompt": prompt, self.image_field: image_url}
+
+    def cost(self, predict_time=None):
+        """Estimated USD for one prediction that used predict_time seconds of compute"""
+        return self.cost_per_video + self.cost_per_second * (predict_time or 0)
+
+
+MODELS = {}
+
+
+def register_model(spec):
+    """Add a ModelSpec to the registry under its id"""
+    MODELS[spec.id] = spec
+    return spec
+
+
+def get_model(model):
+    """Registered ModelSpec for a model id, or a generic one for unknown models"""
+    return MODELS.get(model) or ModelSpec(model)
+
+
+# List prices and latencies as published by the provider; observed stats take over once jobs finish.
+# hailuo-02-fast and wan-2.2-i2v-fast already default to their shortest, lowest
+# resolution render, so only hailuo-02 (1080p by default) has a preview setting.
+# The Hailuo models take no seed, so their variants differ only by chance
+register_model(ModelSpec(
+    "minimax/hailuo-02-fast",
+    accepts=("duration", "prompt_optimizer", "last_frame_image"),
+    resolution=512,
+    cost_per_video=0.10,
+    latency=90,
+))
+register_model(ModelSpec(
+    "minimax/hailuo-02",
+    accepts=("duration", "resolution", "prompt_optimizer", "last_frame_image"),
+    draft_input={"resolution": "512p", "prompt_optimizer": False},
+    resolution=1080,
+    cost_per_video=0.48,
+    latency=300,
+))
+register_model(ModelSpec(
+    "wan-video/wan-2.2-i2v-fast",
+    image_field="image",
+    accepts=("num_frames", "frames_per_second", "resolution", "go_fast", "seed"),
+    resolution=480,
+    cost_per_video=0.05,
+    latency=60,
+))
+
+
+class ModelStats:
+    """Recent render latency and cost of each model, safe to share between threads"""
+
+    def __init__(self, history=STATS_HISTORY):
+        self._history = history
+        self._latency = {}
+        self._cost = {}
+        self._lock = threading.Lock()
+
+    def record(self, model, latency, cost):
+        with self._lock:
+            self._latency.setdefault(model, deque(maxlen=self._history)).append(latency)
+            self._cost.setdefault(model, deque(maxlen=self._history)).append(cost)
+
+    def _median(self, values, model):
+        with self._lock:
+            recent = sorted(values.get(model, ()))
+        return recent[len(recent) // 2] if recent else None
+
+    def latency(self, model):
+        """Median seconds from creation to completion of recent predictions, or None"""
+        return self._median(self._latency, model)
+
+    def cost(self, model):
+        """Median USD per recent prediction, or None"""
+        return self._median(self._cost, model)
+
+
+class Router:
+    """Picks a model for an SLA hint from a fixed set of candidates"""
+
+    def __init__(self, default, candidates=(), stats=None):
+        self.default = default
+        # The default model is always a candidate
+        self.candidates = list(dict.fromkeys([default, *candidates]))
+        self.stats = stats or ModelStats()
+
+    def latency(self, model):
+        """Typical seconds per prediction: observed when known, else the list value"""
+        observed = self.stats.latency(model)
+        return get_model(model).latency if observed is None else observed
+
+    def cost(self, model):
+        """Typical USD per prediction: observed when known, else the list price"""
+        observed = self.stats.cost(model)
+        return get_model(model).cost() if observed is None else observed
+
+    def pick(self, sla=None, candidates=None):
+        """Model id to run a job with an SLA hint on, out of candidates (all by default); None prefers the default model"""
+        if sla is not None and sla not in SLAS:
+            raise ValueError(f"Unknown SLA: {sla} (expected one of {', '.join(SLAS)})")
+        candidates = self.candidates if candidates is None else candidates
+        if sla is None or len(candidates) == 1:
+            return self.default if self.default in candidates else candidates[0]
+        if sla == FAST:
+            return min(candidates, key=self.latency)
+        if sla == QUALITY:
+            return max(candidates, key=lambda model: (get_model(model).resolution, -self.latency(model)))
+        # CHEAP
+        return min(candidates, key=lambda model: (self.cost(model), self.latency(model)))
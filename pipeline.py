@@ -0,0 +1,895 @@
+"""Image-to-video generation pipeline shared by app.py and app_lovable.py
+
+The pipeline has no UI dependencies: stages raise PipelineError instead of
+printing, and the Replicate client is only imported and built the first time a
+prediction is made, so workers that only run one stage never pay for it.
+
+Stages: prepare image -> host image -> predict -> fetch result
+"""
+import hashlib
+import logging
+import multiprocessing
+import os
+import queue
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field, replace
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import requests
+
+import metrics
+import models
+from cache import HostedImageCache, ResultCache
+from http_client import make_session
+from ratelimit import LimitedTransport, RateLimiter, SQLiteBuckets
+from storage import OutputStore
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = models.DEFAULT_MODEL
+TERMINAL_STATUSES = ("succeeded", "failed", "canceled")
+# Upper bound on remembered reachable URLs
+MAX_VERIFIED_URLS = 4096
+# Finished prediction ids remembered so stats count each prediction once
+MAX_FINISHED_PREDICTIONS = 4096
+URL_CHECK_MIN_TIMEOUT = 0.5
+URL_CHECK_RETRY_DELAY = 0.25
+# How long to trust a hosted URL that the host never expires
+PERMANENT_HOST_TTL = 30 * 24 * 3600
+# Percentage of a tqdm-style progress bar in prediction logs, e.g. " 45%|████"
+LOG_PERCENT = re.compile(r"(\d{1,3})%\|")
+
+
+class PipelineError(Exception):
+    """A pipeline stage failed; the message is safe to show to users"""
+
+    def __init__(self, stage, message):
+        super().__init__(message)
+        self.stage = stage
+
+
+@dataclass
+class PipelineConfig:
+    """Credentials and tunables for a Pipeline"""
+    replicate_api_token: Optional[str] = None
+    # Alternative Replicate API endpoint, e.g. a local fake for benchmarks
+    replicate_base_url: Optional[str] = None
+    imgbb_api_key: Optional[str] = None
+    model: str = DEFAULT_MODEL
+    # Extra model inputs merged into every prediction, where the model accepts them
+    model_input: Dict[str, Any] = field(default_factory=dict)
+    # Inputs merged over model_input and the model's own draft settings for preview renders
+    draft_input: Dict[str, Any] = field(default_factory=dict)
+    # Further models the router may pick for jobs with an SLA hint; empty runs everything on model
+    routed_models: List[str] = field(default_factory=list)
+    # Root of the output store for fetched videos, and its limits
+    output_dir: str = os.path.join(tempfile.gettempdir(), "image2video")
+    output_max_bytes: int = 5 * 1024 ** 3
+    # Videos not accessed for this many seconds are evicted
+    output_max_age: float = 7 * 24 * 3600
+    # Short side images are scaled down to; None uses the model's own resolution
+    image_resolution: Optional[int] = None
+    # Highest JPEG quality, lowered in steps down to jpeg_min_quality until the
+    # upload fits image_target_bytes
+    jpeg_quality: int = 95
+    jpeg_min_quality: int = 70
+    image_target_bytes: Optional[int] = 300 * 1024
+    # Pool running Pillow decode/resize/encode: "process", or "thread" to rely
+    # on Pillow releasing the GIL; image_workers defaults to the CPU count
+    image_pool: str = "process"
+    image_workers: Optional[int] = None
+    upload_timeout: float = 30
+    # When to check a hosted URL is reachable before predicting: "auto" only
+    # for hosts that are not read-after-write consistent, "always" or "never"
+    url_check: str = "auto"
+    # Total seconds one URL check may take, retries included
+    url_check_budget: float = 3
+    # Seconds a URL that passed the check is trusted without re-checking
+    url_check_ttl: float = 600
+    download_timeout: float = 120
+    download_chunk_size: int = 1024 * 1024
+    # Attempts per download; later attempts resume with a Range request
+    download_attempts: int = 3
+    # Connections kept open per host, and retries of 429/5xx/connection errors
+    http_pool_size: int = 10
+    http_retries: int = 3
+    http_backoff: float = 0.5
+    # Client-side limits on provider API requests, per second (bursts of up to
+    # twice that) and in flight per process; 0 disables a limit. Replicate
+    # allows 3000 requests a minute, and 600 prediction creations
+    replicate_rate: float = 50
+    replicate_create_rate: float = 10
+    replicate_concurrency: int = 32
+    imgbb_rate: float = 5
+    imgbb_concurrency: int = 4
+    # SQLite file sharing the request budgets between processes; None keeps them per process
+    rate_limit_path: Optional[str] = None
+    # Seconds a request keeps being retried on 429s before it fails
+    rate_limit_max_wait: float = 120
+    # Seconds between prediction status checks
+    poll_interval: float = 2
+    # Seconds a prediction may run (or stay unreachable) before it is canceled at the provider
+    prediction_timeout: float = 20 * 60
+    # Port of the built-in webhook receiver predictions report to; None polls
+    # every poll_interval instead, 0 picks a free port
+    webhook_port: Optional[int] = None
+    webhook_bind: str = "127.0.0.1"
+    # URL the provider posts to; defaults to the receiver's bind address
+    webhook_public_url: Optional[str] = None
+    # Replicate's webhook signing secret ("whsec_..."); when set, unsigned requests are rejected
+    webhook_secret: Optional[str] = None
+    # With webhooks, seconds between safety-net polls for events that never arrived
+    webhook_poll_interval: float = 60
+    # Directory of the result cache; None disables it
+    result_cache_dir: Optional[str] = None
+    result_cache_max_bytes: int = 2 * 1024 ** 3
+    result_cache_ttl: float = 7 * 24 * 3600
+    # SQLite file remembering hosted URLs per source image; None disables it
+    hosted_cache_path: Optional[str] = None
+    # Image hosting backend: "imgbb", "replicate", "data-uri", "s3" or "local"
+    image_host: str = "imgbb"
+    imgbb_upload_url: str = "https://api.imgbb.com/1/upload"
+    # "multipart" sends raw JPEG bytes, "base64" the legacy encoded form field
+    imgbb_upload_mode: str = "multipart"
+    # Seconds before ImgBB deletes an upload; None keeps it forever
+    imgbb_expiration: Optional[int] = 7 * 24 * 3600
+    # Cached URLs are dropped this long before the host expires them
+    hosted_expiry_margin: float = 3600
+    # S3-compatible bucket for the "s3" host
+    s3_bucket: Optional[str] = None
+    s3_endpoint_url: Optional[str] = None
+    s3_prefix: str = "uploads/"
+    # Public base URL of the bucket; presigned URLs are used when unset
+    s3_public_url: Optional[str] = None
+    s3_url_ttl: int = 24 * 3600
+    # Built-in static file server for the "local" host
+    local_host_dir: str = "hosted"
+    local_host_bind: str = "127.0.0.1"
+    local_host_port: int = 8765
+    # Base URL the model provider reaches the server at; defaults to the bind address
+    local_host_public_url: Optional[str] = None
+
+    @classmethod
+    def from_env(cls, environ=None, **defaults):
+        """Build a config from environment variables (or any mapping, such as st.secrets) over defaults"""
+        environ = os.environ if environ is None else environ
+        values = dict(defaults)
+        for name, (key, cast) in ENV_SETTINGS.items():
+            if environ.get(key) not in (None, ""):
+                values[name] = cast(environ.get(key))
+        return cls(**values)
+
+
+# Environment variable read into each PipelineConfig field by from_env
+ENV_SETTINGS = {
+    "replicate_api_token": ("REPLICATE_API_TOKEN", str),
+    "replicate_base_url": ("REPLICATE_BASE_URL", str),
+    "model": ("REPLICATE_MODEL", str),
+    "routed_models": ("ROUTED_MODELS", lambda value: [model.strip() for model in value.split(",") if model.strip()]),
+    "imgbb_api_key": ("IMGBB_API_KEY", str),
+    "image_host": ("IMAGE_HOST", str),
+    "result_cache_dir": ("RESULT_CACHE_DIR", str),
+    "hosted_cache_path": ("HOSTED_CACHE_PATH", str),
+    "s3_bucket": ("S3_BUCKET", str),
+    "s3_endpoint_url": ("S3_ENDPOINT_URL", str),
+    "s3_public_url": ("S3_PUBLIC_URL", str),
+    "local_host_dir": ("LOCAL_HOST_DIR", str),
+    "local_host_port": ("LOCAL_HOST_PORT", int),
+    "local_host_public_url": ("LOCAL_HOST_PUBLIC_URL", str),
+    "output_dir": ("OUTPUT_DIR", str),
+    "output_max_bytes": ("OUTPUT_MAX_BYTES", int),
+    "prediction_timeout": ("PREDICTION_TIMEOUT", float),
+    "replicate_rate": ("REPLICATE_RATE", float),
+    "replicate_create_rate": ("REPLICATE_CREATE_RATE", float),
+    "replicate_concurrency": ("REPLICATE_CONCURRENCY", int),
+    "imgbb_rate": ("IMGBB_RATE", float),
+    "imgbb_concurrency": ("IMGBB_CONCURRENCY", int),
+    "rate_limit_path": ("RATE_LIMIT_PATH", str),
+    "url_check": ("URL_CHECK", str),
+    "url_check_budget": ("URL_CHECK_BUDGET", float),
+    "image_resolution": ("IMAGE_RESOLUTION", int),
+    "image_target_bytes": ("IMAGE_TARGET_BYTES", int),
+    "image_pool": ("IMAGE_POOL", str),
+    "image_workers": ("IMAGE_WORKERS", int),
+    "webhook_port": ("WEBHOOK_PORT", int),
+    "webhook_bind": ("WEBHOOK_BIND", str),
+    "webhook_public_url": ("WEBHOOK_PUBLIC_URL", str),
+    "webhook_secret": ("WEBHOOK_SECRET", str),
+}
+
+
+@dataclass
+class PreparedImage:
+    """Normalized JPEG bytes ready to be hosted"""
+    data: bytes
+    width: int
+    height: int
+    # sha256 of the normalized JPEG bytes
+    digest: str
+    # sha256 of the bytes as uploaded by the user
+    source_digest: Optional[str] = None
+    mime_type: str = "image/jpeg"
+    # Short side limit the image was scaled to
+    resolution: Optional[int] = None
+
+
+@dataclass
+class HostedImage:
+    """A publicly reachable URL for a prepared image"""
+    url: str
+    display_url: Optional[str] = None
+    # Digest of the prepared image behind the URL, when known
+    image_digest: Optional[str] = None
+    # Whether the URL should be checked for reachability before predicting
+    probe: bool = True
+
+
+@dataclass
+class PredictionResult:
+    """Output of a finished model prediction"""
+    video_url: str
+    prediction_id: Optional[str] = None
+
+
+@dataclass
+class PredictionStatus:
+    """Snapshot of a Replicate prediction while it runs"""
+    prediction_id: str
+    status: str
+    video_url: Optional[str] = None
+    error: Optional[str] = None
+    logs: str = ""
+    model: Optional[str] = None
+
+    @property
+    def done(self):
+        return self.status in TERMINAL_STATUSES
+
+    @property
+    def progress(self):
+        """Fraction done according to the last progress bar in the logs, or None if the model prints none"""
+        percents = LOG_PERCENT.findall(self.logs or "")
+        return min(int(percents[-1]), 100) / 100 if percents else None
+
+    def result(self):
+        """PredictionResult for a finished prediction; raises PipelineError if it did not succeed"""
+        if self.status != "succeeded":
+            raise PipelineError("predict", f"Prediction {self.status}: {self.error or 'no details'}")
+        if not self.video_url:
+            raise PipelineError("predict", "Model returned no video")
+        return PredictionResult(video_url=self.video_url, prediction_id=self.prediction_id)
+
+
+@dataclass
+class VideoResult:
+    """A fetched video on disk"""
+    # Name offered to users when they download the video
+    filename: str
+    path: str
+    size: int
+    # Id of the video in the output store
+    artifact_id: Optional[str] = None
+
+
+def read_image_bytes(image_file):
+    """Raw bytes of an uploaded image given as bytes, a path or a file object"""
+    if isinstance(image_file, (bytes, bytearray)):
+        return bytes(image_file)
+    if isinstance(image_file, (str, os.PathLike)):
+        with open(image_file, "rb") as f:
+            return f.read()
+    if hasattr(image_file, "getvalue"):
+        return image_file.getvalue()
+    image_file.seek(0)
+    return image_file.read()
+
+
+# Prediction attributes read into the same dict shape a webhook delivers
+PREDICTION_FIELDS = ("id", "model", "status", "output", "error", "logs", "metrics", "created_at", "completed_at")
+
+
+def _timestamp(value):
+    """Epoch seconds of a Replicate ISO timestamp, or None"""
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class Pipeline:
+    """Runs the image-to-video stages against ImgBB and Replicate"""
+
+    def __init__(self, config, client=None, http=None):
+        # Without a timeout a stuck prediction would be polled, and billed, forever
+        if config.prediction_timeout is None or config.prediction_timeout <= 0:
+            raise ValueError(f"prediction_timeout must be a positive number of seconds, not {config.prediction_timeout!r}")
+        if config.webhook_port is not None:
+            if config.webhook_public_url and not config.webhook_secret:
+                raise ValueError(
+                    "WEBHOOK_PUBLIC_URL needs WEBHOOK_SECRET, or anyone who finds the URL can post fake results"
+                )
+            if not config.webhook_public_url and not config.replicate_base_url:
+                # The receiver's own address is only reachable from a local API, such as fakes.py
+                logger.warning(
+                    "WEBHOOK_PORT is set without WEBHOOK_PUBLIC_URL, which Replicate needs to reach the receiver; "
+                    "polling predictions instead"
+                )
+                config = replace(config, webhook_port=None)
+        self.config = config
+        self._client = client
+        self._image_host = None
+        self._http = http
+        # URL -> monotonic time until which it is known to be reachable
+        self._verified_urls = OrderedDict()
+        self._verified_lock = threading.Lock()
+        self.hosted_cache = HostedImageCache(config.hosted_cache_path) if config.hosted_cache_path else None
+        self._outputs = None
+        self._image_pool = None
+        self._image_pool_lock = threading.Lock()
+        self.result_cache = None
+        if config.result_cache_dir:
+            self.result_cache = ResultCache(
+                config.result_cache_dir,
+                max_bytes=config.result_cache_max_bytes,
+                ttl=config.result_cache_ttl,
+            )
+        buckets = SQLiteBuckets(config.rate_limit_path) if config.rate_limit_path else None
+        # Provider API limits shared by every thread using this pipeline
+        self.limiters = {
+            name: RateLimiter(name, rate, concurrency=concurrency, buckets=buckets, max_wait=config.rate_limit_max_wait)
+            for name, rate, concurrency in (
+                ("replicate", config.replicate_rate, config.replicate_concurrency),
+                ("replicate_create", config.replicate_create_rate, None),
+                ("imgbb", config.imgbb_rate, config.imgbb_concurrency),
+            )
+        }
+        self.model_stats = models.ModelStats()
+        self.router = models.Router(config.model, config.routed_models, self.model_stats)
+        self._webhooks = None
+        self._webhooks_lock = threading.Lock()
+        # Called with every PredictionStatus a webhook delivers
+        self._prediction_listeners = []
+        # prediction id -> Queue of webhook statuses for wait_for_prediction
+        self._waiters = {}
+        self._finished_predictions = OrderedDict()
+        self._finished_lock = threading.Lock()
+
+    @property
+    def client(self):
+        """Replicate client, created on first use"""
+        if self._client is None:
+            import httpx
+            import replicate
+
+            if not self.config.replicate_api_token:
+                raise PipelineError("predict", "Replicate API token not configured")
+            options = {"base_url": self.config.replicate_base_url} if self.config.replicate_base_url else {}
+            transport = LimitedTransport(
+                httpx.HTTPTransport(), self.limiters["replicate"], self.limiters["replicate_create"],
+            )
+            self._client = replicate.Client(api_token=self.config.replicate_api_token, transport=transport, **options)
+        return self._client
+
+    @property
+    def webhooks(self):
+        """Webhook receiver predictions report to, started on first use; None when webhooks are off"""
+        if self.config.webhook_port is None:
+            return None
+        with self._webhooks_lock:
+            if self._webhooks is None:
+                from webhooks import serve_webhooks
+
+                receiver = serve_webhooks(self.config.webhook_bind, self.config.webhook_port, self.config.webhook_secret)
+                receiver.add_listener(self._on_webhook)
+                self._webhooks = receiver
+            return self._webhooks
+
+    @property
+    def webhook_url(self):
+        """URL predictions post their updates to, or None without webhooks"""
+        if self.webhooks is None:
+            return None
+        if self.config.webhook_public_url:
+            from webhooks import WEBHOOK_PATH
+
+            return self.config.webhook_public_url.rstrip("/") + WEBHOOK_PATH
+        return self.webhooks.url
+
+    @property
+    def status_poll_interval(self):
+        """Seconds between status checks of a running prediction"""
+        return self.config.webhook_poll_interval if self.webhooks else self.config.poll_interval
+
+    def add_prediction_listener(self, listener):
+        """Call listener(PredictionStatus) for every prediction update a webhook delivers"""
+        self._prediction_listeners.append(listener)
+
+    def _on_webhook(self, prediction):
+        status = self.status_from(prediction)
+        waiter = self._waiters.get(status.prediction_id)
+        if waiter is not None:
+            waiter.put(status)
+        for listener in self._prediction_listeners:
+            listener(status)
+
+    @property
+    def image_pool(self):
+        """Executor for Pillow work, created on first use"""
+        with self._image_pool_lock:
+            if self._image_pool is None:
+                if self.config.image_pool == "thread":
+                    self._image_pool = ThreadPoolExecutor(self.config.image_workers, thread_name_prefix="image")
+                elif self.config.image_pool == "process":
+                    # Forking this threaded process could copy locks other threads hold into the workers
+                    methods = multiprocessing.get_all_start_methods()
+                    context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+                    self._image_pool = ProcessPoolExecutor(self.config.image_workers, mp_context=context)
+                else:
+                    raise ValueError(f"Unknown image pool: {self.config.image_pool} (expected process or thread)")
+            return self._image_pool
+
+    def submit_image_work(self, fn, *args):
+        """Run fn(*args) on the image pool and return its Future, replacing a pool a crashed worker broke"""
+        pool = self.image_pool
+        try:
+            work = pool.submit(fn, *args)
+        except BrokenProcessPool:
+            self._discard_image_pool(pool)
+            pool = self.image_pool
+            work = pool.submit(fn, *args)
+
+        def done(work):
+            # Every task of a broken pool fails with this; later ones get a fresh pool
+            if not work.cancelled() and isinstance(work.exception(), BrokenProcessPool):
+                self._discard_image_pool(pool)
+
+        work.add_done_callback(done)
+        return work
+
+    def _discard_image_pool(self, pool):
+        with self._image_pool_lock:
+            if self._image_pool is not pool:
+                return
+            self._image_pool = None
+        logger.warning("An image worker crashed, starting a new image pool")
+        pool.shutdown(wait=False)
+
+    def model_spec(self, model=None):
+        """ModelSpec of a model id, or of the configured model"""
+        return models.get_model(model or self.config.model)
+
+    def pick_model(self, sla=None, draft=False):
+        """Model id to run a job on for an SLA hint ("fast", "quality" or "cheap"); None keeps config.model
+
+        With draft, only models with a cheaper preview setting are considered,
+        and None is returned when there are none.
+        """
+        if not draft:
+            return self.router.pick(sla)
+        candidates = [model for model in self.router.candidates if self.extra_input(model, True) != self.extra_input(model)]
+        return self.router.pick(sla, candidates) if candidates else None
+
+    @property
+    def previews(self):
+        """Whether any routed model can render a cheaper preview clip"""
+        return self.pick_model(draft=True) is not None
+
+    def image_resolution(self, model=None):
+        """Short side images are scaled down to for a model"""
+        return self.config.image_resolution or self.model_spec(model).resolution
+
+    def prepare_image_async(self, image_file, model=None):
+        """Start preparing an image on the image pool; returns a Future of its PreparedImage
+
+        The image is decoded, scaled to the model's resolution and re-encoded as
+        JPEG in a worker, so a burst of uploads uses every core. The future fails
+        with PipelineError if the image cannot be read.
+        """
+        import imaging
+
+        config = self.config
+        resolution = self.image_resolution(model)
+        prepared = Future()
+        # The callback below runs on a pool thread, outside this job's context
+        trace = metrics.current_trace()
+        try:
+            source = read_image_bytes(image_file)
+            work = self.submit_image_work(
+                imaging.prepare_jpeg, source, resolution,
+                config.jpeg_quality, config.image_target_bytes, config.jpeg_min_quality,
+            )
+        except Exception as e:
+            prepared.set_exception(PipelineError("prepare", f"Could not read image: {e}"))
+            return prepared
+
+        def done(work):
+            # A job canceled while its image was in the pool no longer wants it
+            if not prepared.set_running_or_notify_cancel():
+                return
+            try:
+                data, width, height, quality, timings = work.result()
+            except BrokenProcessPool:
+                prepared.set_exception(PipelineError("prepare", "The image worker crashed, please try again"))
+                return
+            except Exception as e:
+                prepared.set_exception(PipelineError("prepare", f"Could not read image: {e}"))
+                return
+            for stage, seconds in timings.items():
+                metrics.record(stage, seconds, trace=trace)
+            logger.info("Prepared %dx%d JPEG at quality %d, %d bytes", width, height, quality, len(data))
+            prepared.set_result(PreparedImage(
+                data=data,
+                width=width,
+                height=height,
+                digest=hashlib.sha256(data).hexdigest(),
+                source_digest=hashlib.sha256(source).hexdigest(),
+                resolution=resolution,
+            ))
+
+        work.add_done_callback(done)
+        # Canceling the result frees the worker too, unless it already started
+        prepared.add_done_callback(lambda prepared: prepared.cancelled() and work.cancel())
+        return prepared
+
+    def prepare_image(self, image_file, model=None):
+        """Decode an uploaded image (path, file object or bytes), scale it to the model's resolution and re-encode it as JPEG"""
+        return self.prepare_image_async(image_file, model).result()
+
+    @staticmethod
+    def _hosted_key(source_digest, resolution):
+        # Models render at different sizes, so each size is hosted separately
+        return f"{source_digest}:{resolution}"
+
+    def cached_hosted_image(self, image_file, model=None, record=True):
+        """HostedImage for an image uploaded earlier for a model's resolution whose link has not expired, or None
+
+        With record=False the lookup is a peek that does not count towards the
+        hosted cache hit ratio.
+        """
+        if self.hosted_cache is None:
+            return None
+        source_digest = hashlib.sha256(read_image_bytes(image_file)).hexdigest()
+        row = self.hosted_cache.get(self._hosted_key(source_digest, self.image_resolution(model)))
+        if record:
+            metrics.cache_lookup("hosted", row is not None)
+        if row is None:
+            return None
+        url, display_url, image_digest = row
+        if record:
+            logger.info("Reusing hosted image %s", url)
+        return HostedImage(url=url, display_url=display_url, image_digest=image_digest, probe=self.image_host.probe)
+
+    def host(self, image_file, progress=None, model=None):
+        """Prepare and host an image for a model, reusing an earlier upload of the same image when possible"""
+        return (
+            self.cached_hosted_image(image_file, model)
+            or self.host_image(self.prepare_image(image_file, model), progress)
+        )
+
+    @property
+    def http(self):
+        """Pooled HTTP session with retries, created on first use"""
+        if self._http is None:
+            self._http = make_session(
+                pool_size=self.config.http_pool_size,
+                retries=self.config.http_retries,
+                backoff=self.config.http_backoff,
+                limits={self.config.imgbb_upload_url: self.limiters["imgbb"]},
+            )
+        return self._http
+
+    @property
+    def outputs(self):
+        """Output store for fetched videos, created on first use"""
+        if self._outputs is None:
+            self._outputs = OutputStore(
+                self.config.output_dir, max_bytes=self.config.output_max_bytes, max_age=self.config.output_max_age,
+            )
+        return self._outputs
+
+    @property
+    def image_host(self):
+        """Hosting backend selected by config.image_host, created on first use"""
+        if self._image_host is None:
+            from hosting import make_image_host
+
+            self._image_host = make_image_host(self.config.image_host, self)
+        return self._image_host
+
+    def host_image(self, prepared, progress=None):
+        """Upload a prepared image to the configured host and return its public URL
+
+        progress, if given, is called as progress(bytes_sent, total_bytes).
+        """
+        with metrics.span("upload", host=self.config.image_host):
+            hosted = self.image_host.upload(prepared, progress)
+        if progress:
+            progress(len(prepared.data), len(prepared.data))
+        self._remember_hosted(prepared, hosted)
+        return hosted
+
+    def _remember_hosted(self, prepared, hosted):
+        lifetime = self.image_host.lifetime
+        if self.hosted_cache is None or prepared.source_digest is None or lifetime is None:
+            return
+        self.hosted_cache.put(
+            self._hosted_key(prepared.source_digest, prepared.resolution), hosted.url, hosted.display_url, prepared.digest,
+            expires_at=time.time() + lifetime - self.config.hosted_expiry_margin,
+        )
+
+    def extra_input(self, model=None, draft=False):
+        """Inputs sent besides the prompt, image and seed; drafts add the preview settings"""
+        if not draft:
+            return self.config.model_input
+        return {**self.config.model_input, **self.model_spec(model).draft_input, **self.config.draft_input}
+
+    def model_input(self, hosted, prompt, seed=None, model=None, draft=False):
+        """Input dict for a model (the configured one by default), built by its registered adapter"""
+        return self.model_spec(model).build_input(hosted.url, prompt, seed, self.extra_input(model, draft))
+
+    def _url_ready(self, url, deadline):
+        """HEAD url until it answers 200 or the deadline passes; returns the last status or error"""
+        while True:
+            try:
+                # Always make at least one attempt, even on an exhausted budget
+                timeout = max(deadline - time.monotonic(), URL_CHECK_MIN_TIMEOUT)
+                last = self.http.head(url, timeout=timeout, allow_redirects=True).status_code
+                if last == 200:
+                    return last
+            except requests.exceptions.RequestException as e:
+                last = e
+            if time.monotonic() + URL_CHECK_RETRY_DELAY >= deadline:
+                return last
+            time.sleep(URL_CHECK_RETRY_DELAY)
+
+    def check_image_url(self, hosted):
+        """Make sure the model provider can fetch a hosted image; returns the HostedImage to use
+
+        Runs at most once per URL within url_check_ttl, inside a url_check_budget
+        time budget, and falls back to the display URL when the direct one fails.
+        """
+        mode = self.config.url_check
+        if mode == "never" or (mode == "auto" and not hosted.probe):
+            return hosted
+        now = time.monotonic()
+        with self._verified_lock:
+            verified = self._verified_urls.get(hosted.url, 0) > now
+        metrics.cache_lookup("url_check", verified)
+        if verified:
+            return hosted
+        with metrics.span("url_check"):
+            return self._check_candidates(hosted, now)
+
+    def _check_candidates(self, hosted, now):
+        """HEAD the hosted URL, then its display URL, within the check budget"""
+        candidates = [hosted.url]
+        if hosted.display_url and hosted.display_url != hosted.url:
+            candidates.append(hosted.display_url)
+        # Split the budget so the fallback URL always gets its turn
+        share = self.config.url_check_budget / len(candidates)
+        for i, url in enumerate(candidates):
+            result = self._url_ready(url, now + share * (i + 1))
+            if result == 200:
+                with self._verified_lock:
+                    self._verified_urls[url] = time.monotonic() + self.config.url_check_ttl
+                    self._verified_urls.move_to_end(url)
+                    while len(self._verified_urls) > MAX_VERIFIED_URLS:
+                        self._verified_urls.popitem(last=False)
+                return hosted if url == hosted.url else replace(hosted, url=url)
+        if isinstance(result, requests.exceptions.Timeout):
+            raise PipelineError("predict", "Timeout accessing image URL. The image might not be publicly accessible.")
+        if isinstance(result, Exception):
+            raise PipelineError("predict", "Connection error accessing image URL. Please try again.")
+        raise PipelineError("predict", f"Image URL not accessible: {result}")
+
+    def start_prediction(self, hosted, prompt, seed=None, model=None, draft=False):
+        """Create a prediction for a hosted image without waiting for it; returns the prediction id
+
+        draft renders a short, cheap preview clip instead of the full video.
+        """
+        hosted = self.check_image_url(hosted)
+        model = model or self.config.model
+        options = {}
+        if self.webhook_url:
+            from webhooks import WEBHOOK_EVENTS
+
+            options = {"webhook": self.webhook_url, "webhook_events_filter": WEBHOOK_EVENTS}
+        try:
+            with metrics.span("start_prediction", model=model, draft=draft):
+                prediction = self.client.predictions.create(
+                    model=model,
+                    input=self.model_input(hosted, prompt, seed, model, draft),
+                    **options,
+                )
+        except PipelineError:
+            raise
+        except Exception as e:
+            raise PipelineError("predict", f"Error generating video: {e}") from e
+        logger.info("Started prediction %s on %s", prediction.id, model)
+        return prediction.id
+
+    def prediction_status(self, prediction_id):
+        """Fetch the current state of a prediction as a PredictionStatus
+
+        A finished prediction also feeds the model's latency and cost stats, so
+        callers should stop asking once the status is done.
+        """
+        try:
+            prediction = self.client.predictions.get(prediction_id)
+        except PipelineError:
+            raise
+        except Exception as e:
+            raise PipelineError("predict", f"Error checking prediction: {e}") from e
+        return self.status_from({name: getattr(prediction, name, None) for name in PREDICTION_FIELDS})
+
+    def status_from(self, prediction):
+        """PredictionStatus of a prediction given as the API's JSON fields (as a webhook delivers it)"""
+        spec = self.model_spec(prediction.get("model"))
+        status = PredictionStatus(
+            prediction_id=prediction["id"],
+            status=prediction["status"],
+            video_url=spec.parse_output(prediction.get("output")) if prediction["status"] == "succeeded" else None,
+            error=prediction.get("error"),
+            logs=prediction.get("logs") or "",
+            model=spec.id,
+        )
+        if status.status == "succeeded":
+            self._record_model_stats(spec, prediction)
+        return status
+
+    def _record_model_stats(self, spec, prediction):
+        with self._finished_lock:
+            # Polls and webhooks can both report the same finished prediction
+            if prediction["id"] in self._finished_predictions:
+                return
+            self._finished_predictions[prediction["id"]] = True
+            while len(self._finished_predictions) > MAX_FINISHED_PREDICTIONS:
+                self._finished_predictions.popitem(last=False)
+        created, completed = _timestamp(prediction.get("created_at")), _timestamp(prediction.get("completed_at"))
+        if created is None or completed is None:
+            return
+        predict_time = (prediction.get("metrics") or {}).get("predict_time")
+        cost = spec.cost(predict_time)
+        self.model_stats.record(spec.id, completed - created, cost)
+        metrics.MODEL_SECONDS.observe(completed - created, model=spec.id)
+        metrics.MODEL_COST.inc(cost, model=spec.id)
+
+    def cancel_prediction(self, prediction_id):
+        """Ask the provider to stop a prediction, and its billing; returns False if the request failed"""
+        try:
+            with metrics.span("cancel_prediction"):
+                self.client.predictions.cancel(prediction_id)
+        except Exception as e:
+            logger.warning("Could not cancel prediction %s: %s", prediction_id, e)
+            return False
+        logger.info("Canceled prediction %s", prediction_id)
+        return True
+
+    def wait_for_prediction(self, prediction_id, on_status=None):
+        """Wait for a prediction to finish and return its PredictionResult; on_status gets every PredictionStatus
+
+        With webhooks the statuses they deliver are used, and the API is only
+        polled when none arrives for webhook_poll_interval. Failed status
+        checks are retried; a prediction still running (or out of reach) after
+        prediction_timeout is canceled.
+        """
+        timeout = self.config.prediction_timeout
+        deadline = time.monotonic() + timeout
+        waiter = queue.Queue() if self.webhooks else None
+        self._waiters[prediction_id] = waiter
+
+        def check():
+            # A failed check is usually a blip; the timeout covers a status that stays out of reach
+            try:
+                return self.prediction_status(prediction_id)
+            except PipelineError as e:
+                logger.warning("Could not check prediction %s, will retry: %s", prediction_id, e)
+                metrics.RETRIES.inc(kind="status")
+                return None
+
+        try:
+            status = check()
+            while True:
+                if status is not None:
+                    if on_status:
+                        on_status(status)
+                    if status.done:
+                        return status.result()
+                if time.monotonic() >= deadline:
+                    self.cancel_prediction(prediction_id)
+                    raise PipelineError("predict", f"Video generation timed out after {timeout / 60:g} minutes")
+                if waiter is None:
+                    time.sleep(self.config.poll_interval)
+                    status = check()
+                    continue
+                try:
+                    wait = max(min(self.config.webhook_poll_interval, deadline - time.monotonic()), 0)
+                    status = waiter.get(timeout=wait)
+                except queue.Empty:
+                    status = check()
+        finally:
+            self._waiters.pop(prediction_id, None)
+
+    def predict(self, hosted, prompt, on_status=None):
+        """Run the model on a hosted image and return the video URL"""
+        return self.wait_for_prediction(self.start_prediction(hosted, prompt), on_status)
+
+    def fetch_result(self, prediction, progress=None):
+        """Stream the generated video into the output store and return a VideoResult
+
+        The body is written in chunks to a .part file; if the connection drops,
+        the download resumes from the bytes already on disk with a Range request.
+        progress, if given, is called as progress(bytes_on_disk, total_bytes),
+        with total_bytes None when the server sends no Content-Length.
+        """
+        with metrics.span("download"):
+            return self._video_result(self.outputs.commit(self._download(prediction.video_url, progress)))
+
+    def _download(self, video_url, progress=None):
+        """Download a video into a resumable .part file in the output store; returns its path"""
+        url_digest = hashlib.sha256(video_url.encode("utf-8")).hexdigest()
+        part = self.outputs.temp_path(f"{url_digest}.part")
+
+        for attempt in range(1, self.config.download_attempts + 1):
+            offset = os.path.getsize(part) if os.path.exists(part) else 0
+            headers = {"Range": f"bytes={offset}-"} if offset else {}
+            try:
+                with self.http.get(video_url, headers=headers, stream=True,
+                                   timeout=self.config.download_timeout) as response:
+                    if response.status_code == 416:
+                        # The part file already holds the whole video
+                        break
+                    if response.status_code not in (200, 206):
+                        raise PipelineError("fetch", f"Failed to download video: {response.status_code}")
+                    # A 200 means the server ignored the Range header, so start over
+                    if response.status_code != 206:
+                        offset = 0
+                    length = response.headers.get("Content-Length")
+                    total = offset + int(length) if length else None
+                    with open(part, "ab" if offset else "wb") as f:
+                        for chunk in response.iter_content(chunk_size=self.config.download_chunk_size):
+                            f.write(chunk)
+                            offset += len(chunk)
+                            if progress:
+                                progress(offset, total)
+                break
+            except requests.exceptions.RequestException as e:
+                if attempt == self.config.download_attempts:
+                    raise PipelineError("fetch", f"Error downloading video: {e}") from e
+                logger.warning("Video download interrupted (%s), resuming", e)
+                metrics.RETRIES.inc(kind="download_resume")
+        return part
+
+    def _video_result(self, artifact):
+        # Offer a readable download name; the stored file is named by its digest
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        return VideoResult(
+            filename=f"generated_video_{timestamp}.mp4",
+            path=artifact.path,
+            size=artifact.size,
+            artifact_id=artifact.id,
+        )
+
+    def store_cached_video(self, key):
+        """VideoResult for a result-cache hit, copied into the output store; None on a miss"""
+        if self.result_cache is None:
+            return None
+        cached = self.result_cache.get(key)
+        metrics.cache_lookup("result", cached is not None)
+        if cached is None:
+            return None
+        return self._video_result(self.outputs.add_file(cached))
+
+    def result_key(self, image_digest, prompt, seed=None, model=None, draft=False):
+        """Result cache key for generating a video (or a draft) from a prepared image digest and prompt on a model"""
+        params = self.extra_input(model, draft)
+        if seed is not None:
+            params = {**params, "seed": seed}
+        return ResultCache.key(image_digest, prompt, model or self.config.model, params)
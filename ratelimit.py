@@ -0,0 +1,254 @@
+"""Client-side rate limits for the provider APIs
+
+Every request to Replicate or ImgBB goes through the provider's RateLimiter:
+a token bucket that spreads requests to at most `rate` per second (with
+bursts up to `burst`), plus a cap on requests in flight. Callers queue for a
+token instead of getting a 429.
+
+The bucket adapts to what the provider says. A 429 pauses every caller for
+the Retry-After time and halves the rate, which then creeps back up to the
+configured rate as requests succeed. X-RateLimit-Remaining/-Reset (or the
+unprefixed RateLimit-*) headers cap the local tokens to what the provider
+has left, so a window shared with other clients is not overrun.
+
+Bucket state lives in memory, or in a SQLite file (SQLiteBuckets) to share
+one budget between processes, such as the app and a batch run. Concurrency
+caps are per process.
+"""
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Rate multiplier after a 429, and the share of the configured rate it never goes below
+BACKOFF = 0.5
+MIN_RATE_SHARE = 0.05
+# Share of the configured rate regained with every successful response
+RECOVERY = 0.05
+# Longest sleep between checks of the bucket, which other threads and processes also change
+MAX_SLEEP = 1.0
+# Reset headers above this are Unix timestamps rather than seconds from now
+EPOCH_THRESHOLD = 10 ** 9
+
+
+def _number(headers, *names):
+    for name in names:
+        value = headers.get(name)
+        if value:
+            try:
+                # Some APIs list several policies ("10, 10;w=1"); the first is the current one
+                return float(value.split(",")[0].split(";")[0])
+            except ValueError:
+                pass
+    return None
+
+
+def retry_after(headers):
+    """Seconds a Retry-After header asks to wait (given in seconds or as an HTTP date), or None"""
+    value = (headers.get("Retry-After") or "").strip()
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def rate_limit_window(headers):
+    """(requests remaining, seconds until the window resets) from rate-limit headers; either may be None"""
+    remaining = _number(headers, "X-RateLimit-Remaining", "RateLimit-Remaining")
+    reset = _number(headers, "X-RateLimit-Reset", "RateLimit-Reset")
+    if reset is not None and reset > EPOCH_THRESHOLD:
+        reset = reset - time.time()
+    return remaining, None if reset is None else max(reset, 0)
+
+
+class MemoryBuckets:
+    """Token bucket state shared by the threads of one process"""
+
+    def __init__(self):
+        self._state = {}
+        self._lock = threading.Lock()
+
+    def update(self, name, change):
+        """Replace a bucket's state with change(state)[0] and return change(state)[1]; state is None at first"""
+        with self._lock:
+            self._state[name], result = change(self._state.get(name))
+        return result
+
+
+class SQLiteBuckets:
+    """Token bucket state in a SQLite file, shared by every process that opens it"""
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            "name TEXT PRIMARY KEY, tokens REAL NOT NULL, rate REAL NOT NULL, "
+            "updated_at REAL NOT NULL, paused_until REAL NOT NULL)"
+        )
+        self._lock = threading.Lock()
+
+    def update(self, name, change):
+        """Replace a bucket's state with change(state)[0] and return change(state)[1]; state is None at first"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT tokens, rate, updated_at, paused_until FROM buckets WHERE name = ?", (name,)
+                ).fetchone()
+                state, result = change(tuple(row) if row else None)
+                self._conn.execute("INSERT OR REPLACE INTO buckets VALUES (?, ?, ?, ?, ?)", (name, *state))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return result
+
+
+class RateLimiter:
+    """Token bucket and in-flight cap for one provider API
+
+    rate is requests per second (0 or None for no limit), burst the most
+    tokens saved up (twice the rate by default) and concurrency the requests
+    in flight at once in this process.
+    """
+
+    def __init__(self, name, rate, burst=None, concurrency=None, buckets=None, max_wait=120):
+        self.name = name
+        self.rate = rate
+        self.burst = burst or max(2 * (rate or 0), 1)
+        # Seconds a request keeps being retried after 429s before the 429 is returned
+        self.max_wait = max_wait
+        self.buckets = buckets or MemoryBuckets()
+        self._slots = threading.BoundedSemaphore(concurrency) if concurrency else None
+
+    def _refill(self, state, now):
+        """(tokens, rate, updated_at, paused_until) brought up to now"""
+        if state is None:
+            return self.burst, self.rate, now, 0.0
+        tokens, rate, updated, paused_until = state
+        return min(self.burst, tokens + max(now - updated, 0) * rate), rate, now, paused_until
+
+    def _take(self, state):
+        now = time.time()
+        tokens, rate, now, paused_until = self._refill(state, now)
+        if now < paused_until:
+            return (tokens, rate, now, paused_until), paused_until - now
+        if tokens >= 1:
+            return (tokens - 1, rate, now, paused_until), 0
+        return (tokens, rate, now, paused_until), (1 - tokens) / rate
+
+    def acquire(self):
+        """Wait for a request token; returns the seconds waited"""
+        if not self.rate:
+            return 0.0
+        started = time.monotonic()
+        while True:
+            wait = self.buckets.update(self.name, self._take)
+            if not wait:
+                break
+            time.sleep(min(wait, MAX_SLEEP))
+        waited = time.monotonic() - started
+        if waited:
+            metrics.RATE_LIMIT_WAIT.observe(waited, provider=self.name)
+        return waited
+
+    @contextmanager
+    def slot(self):
+        """Hold one of the in-flight slots and a token for the duration of a request"""
+        if self._slots is not None:
+            self._slots.acquire()
+        try:
+            self.acquire()
+            yield
+        finally:
+            if self._slots is not None:
+                self._slots.release()
+
+    def observe(self, status_code, headers):
+        """Adapt the bucket to a response: back off on 429, and never hold more tokens than the provider has left"""
+        if not self.rate:
+            return
+        wait = retry_after(headers)
+        remaining, reset = rate_limit_window(headers)
+
+        def change(state):
+            tokens, rate, now, paused_until = self._refill(state, time.time())
+            if status_code == 429:
+                rate = max(rate * BACKOFF, self.rate * MIN_RATE_SHARE)
+                tokens = 0
+                paused_until = max(paused_until, now + (wait if wait is not None else 1 / rate))
+            else:
+                rate = min(rate + self.rate * RECOVERY, self.rate)
+            if remaining is not None:
+                tokens = min(tokens, remaining)
+                if reset:
+                    # Spread what is left of the provider's window over the rest of it
+                    rate = min(rate, max(remaining / reset, self.rate * MIN_RATE_SHARE))
+                    if remaining < 1:
+                        paused_until = max(paused_until, now + reset)
+            return (tokens, rate, now, paused_until), None
+
+        self.buckets.update(self.name, change)
+        if status_code == 429:
+            logger.warning("%s rate limit hit, backing off%s", self.name, f" for {wait:g} s" if wait else "")
+
+    def send(self, attempt):
+        """Make a request through the limits; attempt() sends it and returns the requests or httpx response
+
+        A 429 is retried, after the pause it triggers for every caller, until
+        max_wait seconds have passed; then it is returned as is. Without a
+        rate there is no pause to wait out, so a 429 is returned at once for
+        the caller's own retries to handle.
+        """
+        if not self.rate:
+            with self.slot():
+                return attempt()
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            with self.slot():
+                response = attempt()
+            self.observe(response.status_code, response.headers)
+            if response.status_code != 429 or time.monotonic() >= deadline:
+                return response
+            response.close()
+            metrics.RETRIES.inc(kind="rate_limited")
+
+
+class LimitedTransport:
+    """httpx transport for the Replicate client that sends requests through RateLimiters
+
+    Creating predictions has its own, lower limit at Replicate, so those
+    requests go through create_limiter.
+    """
+
+    def __init__(self, transport, limiter, create_limiter=None):
+        self.transport = transport
+        self.limiter = limiter
+        self.create_limiter = create_limiter or limiter
+
+    def handle_request(self, request):
+        creates = request.method == "POST" and request.url.path.endswith("/predictions")
+        limiter = self.create_limiter if creates else self.limiter
+        return limiter.send(lambda: self.transport.handle_request(request))
+
+    def close(self):
+        self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,28 @@
+"""Small HTTP servers run from daemon threads next to Streamlit or the batch CLI
+
+Streamlit reruns the script and every pipeline starts the servers it needs,
+so each kind of server is started once per (bind, port) and then shared by
+the whole process.
+"""
+import threading
+from http.server import ThreadingHTTPServer
+
+_servers = {}
+_servers_lock = threading.Lock()
+
+
+def serve(bind, port, handler, name):
+    """Start a ThreadingHTTPServer for handler on a daemon thread and return it"""
+    server = ThreadingHTTPServer((bind, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name=name, daemon=True).start()
+    return server
+
+
+def shared_server(name, bind, port, start):
+    """What start() returns for the first request of a kind of server on (bind, port); later requests get the same"""
+    with _servers_lock:
+        server = _servers.get((name, bind, port))
+        if server is None:
+            server = _servers[(name, bind, port)] = start()
+        return server
@@ -0,0 +1,137 @@
+"""Bounded on-disk store for generated videos
+
+Videos are stored under their sha256 digest, so two jobs can never overwrite
+each other's file and identical videos are kept once. Writers download into
+a private temp file and move it into place atomically. A SQLite index tracks
+size and last access, and the store evicts the oldest and least recently used
+artifacts to stay under its age and byte limits.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+
+from cache import link_or_copy
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass
+class Artifact:
+    """A stored video"""
+    id: str
+    path: str
+    size: int
+
+
+def file_digest(path):
+    """sha256 hex digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class OutputStore:
+    """Content-addressed video files under root with size- and age-bounded eviction"""
+
+    def __init__(self, root, max_bytes=5 * 1024 ** 3, max_age=7 * 24 * 3600, suffix=".mp4"):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.suffix = suffix
+        self.tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(root, "index.sqlite3"), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS artifacts ("
+            "id TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._lock = threading.Lock()
+
+    def path(self, artifact_id):
+        return os.path.join(self.root, artifact_id[:2], f"{artifact_id}{self.suffix}")
+
+    def temp_path(self, name=None):
+        """Path for an in-progress write; pass a stable name to resume a previous attempt"""
+        return os.path.join(self.tmp_dir, name or uuid.uuid4().hex)
+
+    def commit(self, tmp_path):
+        """Move a finished temp file into the store and return its Artifact"""
+        artifact_id = file_digest(tmp_path)
+        path = self.path(artifact_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Same digest means same content, so replacing a concurrent writer's file is harmless
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO artifacts (id, size, created_at, last_access) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET last_access = excluded.last_access",
+                (artifact_id, size, now, now),
+            )
+            self._evict(now, keep=artifact_id)
+        return Artifact(id=artifact_id, path=path, size=size)
+
+    def add_file(self, src):
+        """Store a copy of an existing file (hard-linked when possible)"""
+        tmp = self.temp_path()
+        link_or_copy(src, tmp)
+        return self.commit(tmp)
+
+    def get(self, artifact_id):
+        """Artifact for an id, or None once it has been evicted"""
+        with self._lock:
+            row = self._conn.execute("SELECT size FROM artifacts WHERE id = ?", (artifact_id,)).fetchone()
+            path = self.path(artifact_id)
+            if row is None or not os.path.exists(path):
+                return None
+            self._conn.execute("UPDATE artifacts SET last_access = ? WHERE id = ?", (time.time(), artifact_id))
+        return Artifact(id=artifact_id, path=path, size=row[0])
+
+    def _remove(self, artifact_id):
+        self._conn.execute("DELETE FROM artifacts WHERE id = ?", (artifact_id,))
+        try:
+            os.remove(self.path(artifact_id))
+        except FileNotFoundError:
+            pass
+        logger.info("Evicted video %s", artifact_id)
+
+    def _evict(self, now, keep=None):
+        """Drop artifacts unused for max_age, then least recently used ones until under max_bytes"""
+        self._clean_tmp(now)
+        for (artifact_id,) in self._conn.execute(
+            "SELECT id FROM artifacts WHERE last_access <= ?", (now - self.max_age,)
+        ).fetchall():
+            if artifact_id != keep:
+                self._remove(artifact_id)
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM artifacts").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for artifact_id, size in self._conn.execute("SELECT id, size FROM artifacts ORDER BY last_access").fetchall():
+            if artifact_id == keep:
+                continue
+            self._remove(artifact_id)
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def _clean_tmp(self, now):
+        """Remove temp files abandoned by crashed writers"""
+        for name in os.listdir(self.tmp_dir):
+            tmp = os.path.join(self.tmp_dir, name)
+            try:
+                if os.path.getmtime(tmp) < now - self.max_age:
+                    os.remove(tmp)
+            except FileNotFoundError:
+                pass
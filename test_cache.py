@@ -0,0 +1,49 @@
+"""Result and hosted image cache tests"""
+import time
+
+from cache import HostedImageCache, ResultCache
+
+
+def test_result_cache_evicts_least_recently_used_over_max_bytes(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=25)
+    for key in "abc":
+        cache.put(key, b"x" * 10)
+        time.sleep(0.01)
+    # Over 25 bytes after the third put, so the oldest entry went
+    assert cache.get("a") is None
+    assert cache.get("b") and cache.get("c")
+    # Reading b made c the least recently used
+    time.sleep(0.01)
+    cache.get("b")
+    cache.put("d", b"x" * 10)
+    assert cache.get("c") is None
+    assert open(cache.get("b"), "rb").read() == b"x" * 10
+
+
+def test_result_cache_entries_expire(tmp_path):
+    cache = ResultCache(str(tmp_path), ttl=0.1)
+    path = cache.put("a", b"video")
+    assert cache.get("a") == path
+    time.sleep(0.15)
+    assert cache.get("a") is None
+    assert not (tmp_path / "a.mp4").exists()
+
+
+def test_result_cache_copies_files_in(tmp_path):
+    source = tmp_path / "source.mp4"
+    source.write_bytes(b"video")
+    cache = ResultCache(str(tmp_path / "cache"))
+    cache.put("a", str(source))
+    source.unlink()
+    assert open(cache.get("a"), "rb").read() == b"video"
+
+
+def test_hosted_cache_forgets_expired_links(tmp_path):
+    cache = HostedImageCache(str(tmp_path / "hosted.sqlite3"))
+    cache.put("live", "https://host/live.jpg", None, "digest", expires_at=time.time() + 60)
+    cache.put("dead", "https://host/dead.jpg", None, "digest", expires_at=time.time() - 1)
+    assert cache.get("live") == ("https://host/live.jpg", None, "digest")
+    assert cache.get("dead") is None
+    # The expired row is cleared out, and a re-upload replaces it
+    cache.put("dead", "https://host/new.jpg", "https://host/new", "digest2", expires_at=time.time() + 60)
+    assert cache.get("dead") == ("https://host/new.jpg", "https://host/new", "digest2")
@@ -0,0 +1,37 @@
+"""Image upload tests against the fake ImgBB"""
+import hashlib
+import io
+import os
+
+from hosting import MultipartBody
+from pipeline import Pipeline, PipelineConfig, PreparedImage
+
+
+def test_multipart_body_reads_the_same_in_any_chunk_size():
+    data = os.urandom(100_000)
+    body = MultipartBody({"name": "image"}, "image", "image.jpg", "image/jpeg", data)
+    whole = body.read()
+    assert len(whole) == len(body)
+    assert data in whole
+    for size in (1, 7, 4096):
+        body.seek(0)
+        assert b"".join(iter(lambda: body.read(size), b"")) == whole
+    # urllib3 rewinds with seek/tell before retrying
+    body.seek(-10, io.SEEK_END)
+    assert body.tell() == len(body) - 10
+    assert body.read() == whole[-10:]
+
+
+def test_upload_streams_the_image_to_imgbb(services, tmp_path):
+    pipeline = Pipeline(PipelineConfig(**services.pipeline_settings(), output_dir=str(tmp_path / "out")))
+    data = os.urandom(300_000)
+    prepared = PreparedImage(data=data, width=1, height=1, digest=hashlib.sha256(data).hexdigest())
+    progress = []
+    hosted = pipeline.host_image(prepared, lambda sent, total: progress.append((sent, total)))
+
+    assert list(services.images.values()) == [data]
+    assert hosted.url.startswith(services.base_url)
+    # Reported in chunks as the body streams out, ending at 100%
+    fractions = [sent / total for sent, total in progress]
+    assert fractions == sorted(fractions) and len(fractions) > 2
+    assert fractions[-1] == 1
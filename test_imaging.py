@@ -0,0 +1,50 @@
+"""Image scaling and encoding tests"""
+import io
+
+from PIL import Image
+
+from benchmark import make_image
+from imaging import encode_jpeg, make_thumbnail, open_scaled, prepare_jpeg
+
+EXIF_ORIENTATION = 0x0112
+
+
+def jpeg(width, height, orientation=None, mode="RGB"):
+    image = Image.new(mode, (width, height), "red")
+    exif = Image.Exif()
+    if orientation:
+        exif[EXIF_ORIENTATION] = orientation
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG" if mode == "RGB" else "PNG", exif=exif)
+    return buffer.getvalue()
+
+
+def test_large_jpeg_is_scaled_to_the_short_side():
+    data, width, height, _, timings = prepare_jpeg(make_image(4000, 3000), 720)
+    assert (width, height) == (960, 720)
+    assert Image.open(io.BytesIO(data)).size == (960, 720)
+    assert set(timings) == {"decode", "encode"}
+
+
+def test_small_image_is_not_scaled_up():
+    assert open_scaled(make_image(300, 200), 720).size == (300, 200)
+
+
+def test_exif_rotation_is_applied():
+    # Orientation 6: stored landscape, displayed portrait
+    assert open_scaled(jpeg(400, 200, orientation=6), 100).size == (100, 200)
+    assert Image.open(io.BytesIO(make_thumbnail(jpeg(400, 200, orientation=6), max_side=100))).size == (50, 100)
+
+
+def test_transparent_png_becomes_rgb():
+    image = open_scaled(jpeg(64, 32, mode="RGBA"), 16)
+    assert image.mode == "RGB" and image.size == (32, 16)
+
+
+def test_quality_is_lowered_to_fit_the_byte_target():
+    image = open_scaled(make_image(800, 600), 600)
+    best, quality = encode_jpeg(image, quality=95)
+    smaller, lowered = encode_jpeg(image, quality=95, target_bytes=len(best) // 2, min_quality=50)
+    assert lowered < quality and len(smaller) < len(best)
+    # Never below min_quality, even if the target is out of reach
+    assert encode_jpeg(image, quality=95, target_bytes=1, min_quality=80)[1] == 80
@@ -0,0 +1,95 @@
+"""Job manager tests against the fake services in fakes.py (python -m pytest)"""
+import time
+
+import requests
+
+import metrics
+from benchmark import make_image
+from jobs import CANCELED, FAILED, PREDICTING, SUCCEEDED, JobManager
+from pipeline import Pipeline, PipelineConfig
+
+
+def wait_for(condition, timeout=15):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out waiting"
+        time.sleep(0.02)
+
+
+def make_manager(services, tmp_path, **options):
+    config = PipelineConfig(
+        **services.pipeline_settings(), output_dir=str(tmp_path / "out"), poll_interval=0.05, image_pool="thread",
+    )
+    return JobManager(Pipeline(config), root=str(tmp_path / "jobs"), **options)
+
+
+def predicting(manager, job_id):
+    wait_for(lambda: manager.get(job_id).status == PREDICTING)
+    return manager.get(job_id)
+
+
+def test_identical_requests_share_a_job_until_the_last_release(services, tmp_path):
+    manager = make_manager(services, tmp_path)
+    image = make_image(64, 64)
+    job_id = manager.submit(image, "a cat")
+    assert manager.submit(image, "a cat") == job_id
+    assert manager.get(job_id).watchers == 2
+    job = predicting(manager, job_id)
+
+    assert not manager.release(job_id)
+    assert manager.get(job_id).status == PREDICTING
+    assert manager.release(job_id)
+    assert manager.get(job_id).status == CANCELED
+    assert services.predictions[job.prediction_id]["canceled"]
+    # Nothing to attach to any more, so the same request starts over
+    assert manager.submit(image, "a cat") != job_id
+
+
+def test_cancel_stops_the_prediction(services, tmp_path):
+    manager = make_manager(services, tmp_path)
+    job = predicting(manager, manager.submit(make_image(64, 64), "a dog"))
+    assert manager.cancel(job.id)
+    assert manager.get(job.id).status == CANCELED
+    assert services.predictions[job.prediction_id]["canceled"]
+    assert not manager.cancel(job.id)
+
+
+def test_prediction_past_its_deadline_fails_and_is_canceled(services, tmp_path):
+    manager = make_manager(services, tmp_path, deadlines={PREDICTING: 0.5})
+    job = predicting(manager, manager.submit(make_image(64, 64), "a bird"))
+    wait_for(lambda: manager.get(job.id).done)
+    assert manager.get(job.id).status == FAILED
+    assert "Timed out" in manager.get(job.id).error
+    # The job is marked failed just before the prediction is canceled
+    wait_for(lambda: services.predictions[job.prediction_id]["canceled"])
+
+
+def test_recover_takes_over_only_jobs_whose_lease_ran_out(services, tmp_path):
+    first = make_manager(services, tmp_path)
+    job = predicting(first, first.submit(make_image(64, 64), "a fish"))
+    second = make_manager(services, tmp_path)
+    assert second.get(job.id).owner == first.owner
+
+    # The first manager stops renewing, as if its process died
+    first.store.update(job.id, owner="stopped", lease_until=time.time() - 1)
+    second._recover()
+    assert second.get(job.id).owner == second.owner
+    wait_for(lambda: second.get(job.id).done)
+    assert second.get(job.id).status == SUCCEEDED
+    # The running prediction was picked up, not started again
+    assert len(services.predictions) == 1
+
+
+def test_traces_are_served_only_for_job_ids(services, tmp_path):
+    manager = make_manager(services, tmp_path)
+    job_id = manager.submit(make_image(64, 64), "a horse")
+    wait_for(lambda: manager.get(job_id).done)
+    # A .json file outside the traces directory
+    (tmp_path / "secret.json").write_text('{"token": "r8_SECRET"}')
+    server = metrics.serve_metrics(port=0, traces=manager.trace)
+    base = f"http://127.0.0.1:{server.server_port}/traces/"
+
+    assert requests.get(base + job_id).json()["job_id"] == job_id
+    for job in ("../../secret", "..%2F..%2Fsecret", job_id.upper(), job_id + "x"):
+        assert requests.get(base + job).status_code == 404
+    assert manager.trace("../../secret") is None
@@ -0,0 +1,42 @@
+"""Pipeline download tests against the fake video CDN"""
+import hashlib
+
+import pytest
+
+from pipeline import Pipeline, PipelineConfig, PipelineError, PredictionResult
+
+
+@pytest.fixture
+def pipeline(services, tmp_path):
+    return Pipeline(PipelineConfig(**services.pipeline_settings(), output_dir=str(tmp_path / "out")))
+
+
+def part_file(pipeline, url):
+    return pipeline.outputs.temp_path(f"{hashlib.sha256(url.encode('utf-8')).hexdigest()}.part")
+
+
+def test_download_resumes_from_a_partial_file(services, pipeline):
+    url = f"{services.base_url}/videos/p1.mp4"
+    with open(part_file(pipeline, url), "wb") as f:
+        f.write(services.video[:1000])
+    progress = []
+    video = pipeline.fetch_result(PredictionResult(video_url=url), lambda done, total: progress.append((done, total)))
+
+    assert open(video.path, "rb").read() == services.video
+    # Only the rest was fetched, and progress counts the bytes already on disk
+    assert progress[0][0] > 1000
+    assert progress[-1] == (len(services.video), len(services.video))
+
+
+def test_download_of_a_complete_partial_file_keeps_it(services, pipeline):
+    url = f"{services.base_url}/videos/p2.mp4"
+    with open(part_file(pipeline, url), "wb") as f:
+        f.write(services.video)
+    video = pipeline.fetch_result(PredictionResult(video_url=url))
+    assert open(video.path, "rb").read() == services.video
+
+
+def test_missing_video_fails_the_fetch_stage(services, pipeline):
+    with pytest.raises(PipelineError) as error:
+        pipeline.fetch_result(PredictionResult(video_url=f"{services.base_url}/videos/missing"))
+    assert error.value.stage == "fetch"
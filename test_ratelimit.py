@@ -0,0 +1,87 @@
+"""Client-side rate limiter tests"""
+import time
+from email.utils import formatdate
+from types import SimpleNamespace
+
+from fakes import FakeServices, LatencyProfile
+from pipeline import Pipeline, PipelineConfig
+from ratelimit import RateLimiter, SQLiteBuckets, rate_limit_window, retry_after
+
+
+def response(status_code, **headers):
+    return SimpleNamespace(status_code=status_code, headers=headers, close=lambda: None)
+
+
+def test_tokens_beyond_the_burst_are_spread_at_the_rate():
+    limiter = RateLimiter("test", rate=10, burst=2)
+    assert limiter.acquire() < 0.05
+    assert limiter.acquire() < 0.05
+    waited = limiter.acquire()
+    assert 0.05 < waited < 0.5
+
+
+def test_no_rate_means_no_waiting():
+    limiter = RateLimiter("test", rate=0)
+    assert all(limiter.acquire() == 0 for _ in range(100))
+
+
+def test_429_pauses_for_retry_after_and_halves_the_rate():
+    limiter = RateLimiter("test", rate=10, burst=5)
+    limiter.observe(429, {"Retry-After": "0.3"})
+    assert limiter.buckets.update("test", lambda state: (state, state[1])) == 5
+    assert limiter.acquire() >= 0.25
+    # Successful responses win the rate back
+    for _ in range(20):
+        limiter.observe(200, {})
+    assert limiter.buckets.update("test", lambda state: (state, state[1])) == 10
+
+
+def test_provider_window_caps_the_tokens():
+    limiter = RateLimiter("test", rate=100, burst=100)
+    limiter.acquire()
+    limiter.observe(200, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "0.3"})
+    assert limiter.acquire() >= 0.25
+
+
+def test_send_retries_429s_with_a_rate_and_returns_them_without_one():
+    attempts = []
+
+    def attempt():
+        attempts.append(1)
+        return response(429, **{"Retry-After": "0.05"}) if len(attempts) < 3 else response(200)
+
+    assert RateLimiter("test", rate=50).send(attempt).status_code == 200
+    assert len(attempts) == 3
+
+    attempts.clear()
+    assert RateLimiter("test", rate=0).send(lambda: attempts.append(1) or response(429)).status_code == 429
+    assert len(attempts) == 1
+
+
+def test_sqlite_buckets_share_one_budget(tmp_path):
+    path = str(tmp_path / "buckets.sqlite3")
+    first = RateLimiter("shared", rate=5, burst=1, buckets=SQLiteBuckets(path))
+    second = RateLimiter("shared", rate=5, burst=1, buckets=SQLiteBuckets(path))
+    assert first.acquire() < 0.05
+    assert second.acquire() > 0.1
+
+
+def test_limiter_keeps_under_the_fake_api_limit(tmp_path):
+    with FakeServices(LatencyProfile(api_rate=4)) as services:
+        pipeline = Pipeline(PipelineConfig(
+            **services.pipeline_settings(), output_dir=str(tmp_path / "out"), replicate_rate=3, rate_limit_max_wait=5,
+        ))
+        limiter = pipeline.limiters["replicate"]
+        limiter.burst = 1
+        for _ in range(8):
+            limiter.send(lambda: pipeline.http.get(f"{services.base_url}/v1/predictions/none"))
+    assert services.throttled == 0
+
+
+def test_header_parsing():
+    assert retry_after({"Retry-After": "2"}) == 2
+    assert 50 < retry_after({"Retry-After": formatdate(time.time() + 60, usegmt=True)}) <= 60
+    assert retry_after({"Retry-After": "later"}) is None
+    assert rate_limit_window({"RateLimit-Remaining": "10, 10;w=1", "RateLimit-Reset": "3"}) == (10, 3)
+    remaining, reset = rate_limit_window({"X-RateLimit-Remaining": "1", "X-RateLimit-Reset": str(time.time() + 30)})
+    assert remaining == 1 and 25 < reset <= 30
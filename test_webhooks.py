@@ -0,0 +1,45 @@
+"""Webhook receiver tests, with webhooks sent by the fake services"""
+import base64
+import time
+
+import pytest
+import requests
+
+from webhooks import SIGNATURE_TOLERANCE, WebhookReceiver, signed_headers, verify_signature
+
+SECRET = "whsec_" + base64.b64encode(b"test secret for fake webhooks!!!").decode("ascii")
+
+
+@pytest.fixture
+def receiver():
+    receiver = WebhookReceiver(port=0, secret=SECRET)
+    receiver.received = []
+    receiver.add_listener(receiver.received.append)
+    yield receiver
+    receiver.stop()
+
+
+def test_only_requests_signed_with_the_secret_are_dispatched(services, receiver):
+    services.webhook_secret = SECRET
+    assert services.send_webhook(receiver.url, {"id": "p1", "status": "succeeded"}) == 200
+    services.webhook_secret = "whsec_" + base64.b64encode(b"someone else").decode("ascii")
+    assert services.send_webhook(receiver.url, {"id": "p2", "status": "succeeded"}) == 401
+    services.webhook_secret = None
+    assert services.send_webhook(receiver.url, {"id": "p3", "status": "succeeded"}) == 401
+    assert [prediction["id"] for prediction in receiver.received] == ["p1"]
+
+
+def test_signed_bodies_that_are_not_objects_are_rejected(receiver):
+    for body in (b"[1, 2]", b'"succeeded"', b"not json"):
+        response = requests.post(receiver.url, data=body, headers=signed_headers(SECRET, body))
+        assert response.status_code == 400
+    assert receiver.received == []
+
+
+def test_tampered_or_stale_signatures_are_rejected():
+    headers = signed_headers(SECRET, b"{}")
+    assert verify_signature(SECRET, headers, b"{}")
+    assert not verify_signature(SECRET, headers, b'{"id": "forged"}')
+    assert not verify_signature(SECRET, headers, b"{}", now=time.time() + SIGNATURE_TOLERANCE + 5)
+    assert not verify_signature(SECRET, {**headers, "webhook-timestamp": "soon"}, b"{}")
+    assert not verify_signature(SECRET, {"Content-Type": "application/json"}, b"{}")
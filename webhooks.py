@@ -0,0 +1,143 @@
+"""Built-in receiver for Replicate prediction webhooks
+
+Predictions created with a webhook URL are pushed back to us as they make
+progress and when they finish, so nothing has to poll the API or hold a
+thread per render. serve_webhooks() runs a small HTTP server from a daemon
+thread (next to Streamlit or the batch CLI) and hands every prediction it
+receives, as the JSON dict Replicate sends, to the registered listeners.
+
+Requests are signed the Standard Webhooks way: the webhook-signature header
+holds base64 HMAC-SHA256 signatures of "<webhook-id>.<webhook-timestamp>.<body>"
+keyed with the account's signing secret ("whsec_..."). When a secret is
+configured, unsigned, stale or badly signed requests are rejected.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler
+
+from servers import serve, shared_server
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_PATH = "/webhooks/replicate"
+# Seconds a signed request may be old (or early), against replays
+SIGNATURE_TOLERANCE = 300
+# Events to ask Replicate for: logs carry progress bars, completed the result
+WEBHOOK_EVENTS = ["logs", "completed"]
+
+
+def _secret_key(secret):
+    return base64.b64decode(secret.split("_", 1)[1] if secret.startswith("whsec_") else secret)
+
+
+def sign(secret, webhook_id, timestamp, body):
+    """webhook-signature header value for a request body"""
+    payload = f"{webhook_id}.{timestamp}.".encode("utf-8") + body
+    digest = hmac.new(_secret_key(secret), payload, hashlib.sha256).digest()
+    return "v1," + base64.b64encode(digest).decode("ascii")
+
+
+def verify_signature(secret, headers, body, now=None):
+    """Whether a request carries a valid, recent signature for secret"""
+    webhook_id = headers.get("webhook-id")
+    timestamp = headers.get("webhook-timestamp")
+    signatures = headers.get("webhook-signature")
+    if not (webhook_id and timestamp and signatures):
+        return False
+    try:
+        if abs((now or time.time()) - int(timestamp)) > SIGNATURE_TOLERANCE:
+            return False
+    except ValueError:
+        return False
+    expected = sign(secret, webhook_id, timestamp, body).split(",", 1)[1]
+    # The header may list several space-separated signatures while a secret is rotated
+    return any(
+        hmac.compare_digest(signature.split(",", 1)[-1], expected) for signature in signatures.split()
+    )
+
+
+def signed_headers(secret, body):
+    """Headers of a webhook request signed with secret, as Replicate sends them"""
+    webhook_id = f"msg_{uuid.uuid4().hex}"
+    timestamp = str(int(time.time()))
+    return {
+        "Content-Type": "application/json",
+        "webhook-id": webhook_id,
+        "webhook-timestamp": timestamp,
+        "webhook-signature": sign(secret, webhook_id, timestamp, body),
+    }
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    receiver = None
+
+    def do_POST(self):
+        if self.path.split("?", 1)[0] != WEBHOOK_PATH:
+            self._send(404)
+            return
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        receiver = self.receiver
+        if receiver.secret and not verify_signature(receiver.secret, self.headers, body):
+            logger.warning("Rejected webhook with a missing or bad signature")
+            self._send(401)
+            return
+        try:
+            prediction = json.loads(body)
+        except ValueError:
+            prediction = None
+        # Replicate always sends the prediction as a JSON object
+        if not isinstance(prediction, dict):
+            self._send(400)
+            return
+        receiver.dispatch(prediction)
+        self._send(200)
+
+    def _send(self, status):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        logger.debug("webhooks: " + format, *args)
+
+
+class WebhookReceiver:
+    """HTTP server passing received predictions to its listeners"""
+
+    def __init__(self, bind="127.0.0.1", port=8766, secret=None):
+        self.secret = secret
+        self._listeners = []
+        self._lock = threading.Lock()
+        handler = type("WebhookHandler", (_WebhookHandler,), {"receiver": self})
+        self.server = serve(bind, port, handler, "webhooks")
+        self.url = f"http://{bind}:{self.server.server_port}{WEBHOOK_PATH}"
+        logger.info("Receiving webhooks on %s", self.url)
+
+    def add_listener(self, listener):
+        """Call listener(prediction dict) for every webhook received"""
+        with self._lock:
+            self._listeners.append(listener)
+
+    def dispatch(self, prediction):
+        with self._lock:
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(prediction)
+            except Exception:
+                logger.exception("Webhook listener failed for prediction %s", prediction.get("id"))
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def serve_webhooks(bind="127.0.0.1", port=8766, secret=None):
+    """WebhookReceiver for (bind, port), started on first use and shared by every pipeline in the process"""
+    return shared_server("webhooks", bind, port, lambda: WebhookReceiver(bind, port, secret))